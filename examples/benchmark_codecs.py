@@ -0,0 +1,264 @@
+def main(out_path=None, compare_path=None, channel_counts=(1, 2, 8, 16), buffer_sizes=(256, 1024, 4096), min_time=0.05, threshold=0.1) -> int:
+    """
+    Run every benchmark case, optionally save the results to `out_path`, and compare them to `compare_path`.
+
+    Returns the number of cases that regressed by more than `threshold` compared to `compare_path`.
+    """
+    results = []
+
+    print("-" * 80)
+    print(f"{'case':>36} {'dtype':>5} {'ch':>3} {'frames':>6} {'Msamples/s':>11} {'alloc B/call':>13}")
+    print("-" * 80)
+
+    for case in _cases(channel_counts, buffer_sizes):
+        result = _run(case, min_time)
+        results.append(result)
+        if result["error"] is not None:
+            print(f"{result['case']:>36} {result['dtype']:>5} {result['channels']:>3} {result['frames']:>6} {'error: ' + result['error']}")
+        else:
+            print(f"{result['case']:>36} {result['dtype']:>5} {result['channels']:>3} {result['frames']:>6} "
+                  f"{result['samples_per_sec'] / 1e6:>11.1f} {result['alloc_bytes_per_call']:>13.0f}")
+
+    print("-" * 80)
+
+    report = {"environment": _environment(), "results": results}
+
+    if out_path is not None:
+        with open(out_path, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results saved to {out_path}")
+
+    if compare_path is None:
+        return 0
+
+    with open(compare_path) as file:
+        baseline = json.load(file)
+    return _compare(baseline, report, threshold)
+
+
+import sys
+import json
+import time
+import platform
+import tracemalloc
+
+import av
+import numpy as np
+
+from pupil_audio.utils.pyaudio import TimeInfo
+from pupil_audio.blocking.pyaudio import PyAudioCodec
+from pupil_audio.blocking.pyav import PyAVCodec
+from pupil_audio.blocking.wave import WaveCodec
+from pupil_audio.nonblocking.pyaudio2pyav import PyAudio2PyAVTranscoder, PassthroughTranscoder
+
+
+# Growth of the allocations per call that is ignored by the comparison
+ALLOC_SLACK_BYTES = 4096
+
+
+def _cases(channel_counts, buffer_sizes):
+    """
+    Yield `(case, dtype, channels, frames, setup)`, where `setup()` returns `(fn, args)` to be timed.
+    """
+    for frames in buffer_sizes:
+        for channels in channel_counts:
+
+            for codec_cls, dtypes in [
+                (PyAudioCodec, ["<i2", "<f4"]),
+                # WAV files can hold samples that PyAudio can't play
+                (WaveCodec, ["u1", "<i2", "<i4", "<f4"]),
+            ]:
+                for dtype in map(np.dtype, dtypes):
+                    def setup_decode(codec_cls=codec_cls, dtype=dtype, channels=channels, frames=frames):
+                        codec = codec_cls(frame_rate=48000, channels=channels, dtype=dtype)
+                        return codec.decode, (_synthetic_samples(frames, channels, dtype).tobytes(),)
+
+                    def setup_encode(codec_cls=codec_cls, dtype=dtype, channels=channels, frames=frames):
+                        codec = codec_cls(frame_rate=48000, channels=channels, dtype=dtype)
+                        return codec.encode, (_synthetic_samples(frames, channels, dtype),)
+
+                    yield f"{codec_cls.__name__}.decode", dtype, channels, frames, setup_decode
+                    yield f"{codec_cls.__name__}.encode", dtype, channels, frames, setup_encode
+
+            for dtype in map(np.dtype, ["u1", "<i2", "<i4", "<f4", "<f8"]):
+                if channels not in PyAVCodec._channel_layout_names:
+                    continue
+
+                def setup_decode(dtype=dtype, channels=channels, frames=frames):
+                    codec = PyAVCodec(channels=channels, frame_rate=48000, dtype=dtype)
+                    return codec.decode, (codec.encode(_synthetic_samples(frames, channels, dtype)),)
+
+                def setup_decode_into(dtype=dtype, channels=channels, frames=frames):
+                    codec = PyAVCodec(channels=channels, frame_rate=48000, dtype=dtype)
+                    frame = codec.encode(_synthetic_samples(frames, channels, dtype))
+                    return codec.decode, (frame, np.empty((frames, channels), dtype=dtype))
+
+                def setup_encode(dtype=dtype, channels=channels, frames=frames):
+                    codec = PyAVCodec(channels=channels, frame_rate=48000, dtype=dtype)
+                    return codec.encode, (_synthetic_samples(frames, channels, dtype),)
+
+                yield "PyAVCodec.decode", dtype, channels, frames, setup_decode
+                yield "PyAVCodec.decode out", dtype, channels, frames, setup_decode_into
+                yield "PyAVCodec.encode", dtype, channels, frames, setup_encode
+
+            for transcoder_cls in [PyAudio2PyAVTranscoder, PassthroughTranscoder]:
+                if channels not in transcoder_cls._channels_to_pyav_layout:
+                    continue
+                for dtype in sorted(transcoder_cls._dtype_to_pyav_format_interleaved_and_planar.keys(), key=str):
+                    for frame_pool_size in (0, 4):
+                        def setup_transcode(transcoder_cls=transcoder_cls, dtype=dtype, channels=channels, frames=frames, frame_pool_size=frame_pool_size):
+                            transcoder = transcoder_cls(frame_rate=48000, channels=channels, dtype=dtype, frame_pool_size=frame_pool_size)
+                            time_info = TimeInfo(input_buffer_adc_time=0., current_time=0.)
+                            return transcoder.transcode, (_synthetic_samples(frames, channels, dtype).tobytes(), time_info)
+
+                        case = f"{transcoder_cls.__name__}.transcode"
+                        if frame_pool_size:
+                            case += " pool"
+                        yield case, dtype, channels, frames, setup_transcode
+
+
+def _synthetic_samples(frames, channels, dtype) -> np.ndarray:
+    # Noise over the whole range of the dtype, with the shape (frames, channels) the codecs decode to
+    samples = np.random.default_rng(0).uniform(-0.5, 0.5, size=(frames, channels))
+    if dtype.kind == "f":
+        return samples.astype(dtype)
+    info = np.iinfo(dtype)
+    return (samples * (int(info.max) - int(info.min)) + (int(info.max) + int(info.min)) / 2).astype(dtype)
+
+
+def _run(case, min_time) -> dict:
+    name, dtype, channels, frames, setup = case
+    result = {
+        "case": name,
+        "dtype": dtype.str,
+        "channels": channels,
+        "frames": frames,
+        "samples_per_sec": None,
+        "alloc_bytes_per_call": None,
+        "error": None,
+    }
+    try:
+        fn, args = setup()
+        result["samples_per_sec"] = frames * channels / _time_per_call(fn, args, min_time)
+        result["alloc_bytes_per_call"] = _alloc_bytes_per_call(fn, args)
+    except Exception as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+    return result
+
+
+def _time_per_call(fn, args, min_time, repeats=3) -> float:
+    # Enough calls to run for `min_time`, and the fastest of a few batches of them
+    fn(*args)
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / calls
+
+
+def _alloc_bytes_per_call(fn, args, calls=20) -> int:
+    # Peak of the memory traced by tracemalloc during a call, above what was allocated before it.
+    # This covers the Python and numpy heaps, but not the buffers that FFmpeg allocates itself.
+    # Some calls also trigger internal allocations of the interpreter (e.g. growing a cache),
+    # so the steady state is the smallest peak of a few calls.
+    fn(*args)
+    best = None
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            baseline, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = fn(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            del result
+            if best is None or peak - baseline < best:
+                best = peak - baseline
+    finally:
+        tracemalloc.stop()
+    return best
+
+
+def _environment() -> dict:
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "av": av.__version__,
+    }
+
+
+def _case_key(result) -> tuple:
+    return result["case"], result["dtype"], result["channels"], result["frames"]
+
+
+def _compare(baseline, report, threshold) -> int:
+    baseline_results = {_case_key(r): r for r in baseline["results"]}
+    regression_count = 0
+
+    print("-" * 80)
+    print(f"Compared to {baseline['environment'].get('time', 'baseline')}; regressions beyond {100 * threshold:.0f}%:")
+    print(f"{'case':>36} {'dtype':>5} {'ch':>3} {'frames':>6} {'speed':>7} {'alloc B/call':>17}")
+    print("-" * 80)
+
+    for result in report["results"]:
+        old = baseline_results.get(_case_key(result))
+        if old is None or old["error"] is not None or result["error"] is not None:
+            continue
+        speed = result["samples_per_sec"] / old["samples_per_sec"]
+        old_alloc, new_alloc = old["alloc_bytes_per_call"], result["alloc_bytes_per_call"]
+        # The small objects of a call are partly served from numpy and interpreter caches, which
+        # varies by a few KiB between runs; only the growth beyond that counts as a regression
+        alloc_regressed = new_alloc > old_alloc * (1 + threshold) + ALLOC_SLACK_BYTES
+        if speed < 1 - threshold or alloc_regressed:
+            regression_count += 1
+            print(f"{result['case']:>36} {result['dtype']:>5} {result['channels']:>3} {result['frames']:>6} "
+                  f"{speed:>6.2f}x {old_alloc:>8.0f} -> {new_alloc:<6.0f}")
+
+    new_errors = [
+        result for result in report["results"]
+        if result["error"] is not None and baseline_results.get(_case_key(result), {}).get("error") is None
+    ]
+    for result in new_errors:
+        print(f"{result['case']:>36} {result['dtype']:>5} {result['channels']:>3} {result['frames']:>6} error: {result['error']}")
+
+    regression_count += len(new_errors)
+    print("-" * 80)
+    print(f"{regression_count} regressions")
+    return regression_count
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--out", "out_path", default=None, help="Save the results to this JSON file")
+    @click.option("--compare", "compare_path", default=None, help="Compare the results to a JSON file saved by --out")
+    @click.option("--channels", "channel_counts", default=[1, 2, 8, 16], multiple=True, help="Channel counts to benchmark (repeatable)")
+    @click.option("--frames", "buffer_sizes", default=[256, 1024, 4096], multiple=True, help="Buffer sizes in frames (repeatable)")
+    @click.option("--min_time", default=0.05, help="Minimum seconds timed per batch of calls")
+    @click.option("--threshold", default=0.1, help="Relative slowdown (or allocation growth) reported as a regression")
+    def cli(out_path, compare_path, channel_counts, buffer_sizes, min_time, threshold):
+        regression_count = main(
+            out_path=out_path,
+            compare_path=compare_path,
+            channel_counts=channel_counts,
+            buffer_sizes=buffer_sizes,
+            min_time=min_time,
+            threshold=threshold,
+        )
+        sys.exit(1 if regression_count else 0)
+
+    cli()
@@ -0,0 +1,94 @@
+def main(frame_rate=48000, channels=2, duration=30.0):
+    import tempfile
+
+    print("-" * 80)
+    print(f"{duration} sec of {channels} channel audio at {frame_rate} Hz per profile")
+    print(f"{'profile':>16} {'transcoder':>22} {'CPU % per stream':>17} {'kbit/s':>9}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for label, profile, transcoder_cls, sink_cls, ext in _profiles():
+            if not EncoderProfile.available_codecs([profile]):
+                print(f"{label:>16} {'':>22} {'unavailable':>17}")
+                continue
+            result = _run(temp_dir, label, profile, transcoder_cls, sink_cls, ext, frame_rate, channels, duration)
+            print(f"{label:>16} {transcoder_cls.__name__:>22} "
+                  f"{result['cpu_percent']:>17.2f} {result['kbit_per_sec']:>9.1f}")
+
+    print("-" * 80)
+
+
+import os
+import time
+import queue
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.utils.pyav import EncoderProfile
+from pupil_audio.utils.pyaudio import TimeInfo
+from pupil_audio.nonblocking import PyAVFileSink, WavMmapFileSink, PyAudio2PyAVTranscoder
+from pupil_audio.nonblocking.pyaudio2pyav import PassthroughTranscoder
+
+
+def _profiles():
+    return [
+        ("aac 128k", EncoderProfile.aac(bitrate=128000), PyAudio2PyAVTranscoder, PyAVFileSink, "mp4"),
+        ("aac 64k", EncoderProfile.aac(bitrate=64000), PyAudio2PyAVTranscoder, PyAVFileSink, "mp4"),
+        ("opus 64k", EncoderProfile.opus(bitrate=64000), PassthroughTranscoder, PyAVFileSink, "ogg"),
+        ("flac level 0", EncoderProfile.flac(compression_level=0), PassthroughTranscoder, PyAVFileSink, "flac"),
+        ("flac level 5", EncoderProfile.flac(compression_level=5), PassthroughTranscoder, PyAVFileSink, "flac"),
+        ("pcm_s16le", EncoderProfile.pcm_s16le(), PyAudio2PyAVTranscoder, PyAVFileSink, "wav"),
+        ("pcm passthrough", EncoderProfile.pcm_passthrough("int16"), PassthroughTranscoder, PyAVFileSink, "wav"),
+        # The encoder profile is ignored; the buffers are copied into the file as they are
+        ("wav mmap", EncoderProfile.pcm_passthrough("int16"), PassthroughTranscoder, WavMmapFileSink, "wav"),
+    ]
+
+
+def _run(temp_dir, label, profile, transcoder_cls, sink_cls, ext, frame_rate, channels, duration, frames_per_buffer=1024):
+    transcoder = transcoder_cls(frame_rate=frame_rate, channels=channels)
+    in_queue = queue.Queue()
+    file_path = str(Path(temp_dir) / f"{label.replace(' ', '_')}.{ext}")
+
+    sink = sink_cls(
+        file_path=file_path,
+        transcoder=transcoder,
+        in_queue=in_queue,
+        encoder_profile=profile,
+    )
+
+    # A tone with some noise, so that the lossless codecs have something to compress
+    buffer_count = int(duration * frame_rate / frames_per_buffer)
+    t = np.arange(frames_per_buffer * buffer_count) / frame_rate
+    signal = 8000 * np.sin(2 * np.pi * 440 * t) + np.random.normal(0, 200, t.size)
+    samples = np.repeat(signal[:, np.newaxis], channels, axis=1).astype(transcoder.dtype)
+
+    # The whole recording is queued upfront, so the sink runs as fast as it can
+    for i in range(buffer_count):
+        in_frame = samples[i * frames_per_buffer:(i + 1) * frames_per_buffer].tobytes()
+        time_info = TimeInfo(input_buffer_adc_time=i * frames_per_buffer / frame_rate)
+        in_queue.put((in_frame, time_info))
+
+    cpu_start = time.process_time()
+    sink.start()
+    sink.stop()
+    cpu_time = time.process_time() - cpu_start
+
+    audio_duration = buffer_count * frames_per_buffer / frame_rate
+    return {
+        "cpu_percent": 100 * cpu_time / audio_duration,
+        "kbit_per_sec": 8 * os.path.getsize(file_path) / audio_duration / 1000,
+    }
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--frame_rate", default=48000, help="Simulated frame rate")
+    @click.option("--channels", default=2, help="Simulated channel count")
+    @click.option("--duration", default=30.0, help="Seconds of audio encoded per profile")
+    def cli(frame_rate, channels, duration):
+        main(frame_rate=frame_rate, channels=channels, duration=duration)
+
+    cli()
@@ -0,0 +1,127 @@
+import time
+import threading
+
+
+def main(source_count=16, frame_rate=44100, frames_per_buffer=1024, duration=3.0):
+    from pupil_audio.utils import HeartbeatMixin
+
+    callback_rate = frame_rate / frames_per_buffer
+
+    print("-" * 80)
+    print(f"{source_count} simulated sources, {callback_rate:.1f} callbacks/sec each, {duration} sec")
+    print("-" * 80)
+
+    # Threads are only counted while running, without patching threading for the rest of the process
+    with _ThreadCounter() as thread_counter:
+        for label, mixin_cls in [("threading.Timer per call", _TimerHeartbeatMixin), ("shared watchdog", HeartbeatMixin)]:
+            result = _run(mixin_cls, source_count, callback_rate, duration, thread_counter)
+            print(f"{label:>26}: {result['mean_ns']:>9.0f} ns/heartbeat (p99 {result['p99_ns']:>9.0f} ns), "
+                  f"{result['threads_created']:>6} threads created, "
+                  f"{result['max_threads']:>3} max additional live threads")
+
+    print("-" * 80)
+
+
+class _TimerHeartbeatMixin:
+    """
+    The previous HeartbeatMixin implementation, which replaced a threading.Timer on every heartbeat.
+    """
+
+    heartbeat_timeout = 1.
+
+    def heartbeat(self):
+        timer = getattr(self, "_timer", None)
+        if timer is not None:
+            timer.cancel()
+        self._timer = threading.Timer(self.heartbeat_timeout, self.on_heartbeat_unexpectedly_stopped)
+        self._timer.start()
+
+    def heartbeat_complete(self):
+        timer = getattr(self, "_timer", None)
+        if timer is not None:
+            timer.cancel()
+        self._timer = None
+
+    def on_heartbeat_unexpectedly_stopped(self):
+        self._timer = None
+
+
+def _run(mixin_cls, source_count, callback_rate, duration, thread_counter):
+    sources = [mixin_cls() for _ in range(source_count)]
+    durations = []
+    threads_before = thread_counter.value
+    threads_alive_before = threading.active_count()
+    max_threads = threads_alive_before
+
+    interval = 1. / callback_rate
+    next_time = time.monotonic()
+    end_time = next_time + duration
+
+    # All sources are simulated on one thread, interleaving their callbacks
+    while next_time < end_time:
+        for source in sources:
+            start = time.perf_counter_ns()
+            source.heartbeat()
+            durations.append(time.perf_counter_ns() - start)
+        max_threads = max(max_threads, threading.active_count())
+        next_time += interval
+        remaining_time = next_time - time.monotonic()
+        if remaining_time > 0:
+            time.sleep(remaining_time)
+
+    for source in sources:
+        source.heartbeat_complete()
+
+    # Let cancelled timers exit before the next run
+    time.sleep(0.5)
+
+    durations.sort()
+    return {
+        "mean_ns": sum(durations) / len(durations),
+        "p99_ns": durations[int(0.99 * (len(durations) - 1))],
+        "threads_created": thread_counter.value - threads_before,
+        "max_threads": max_threads - threads_alive_before,
+    }
+
+
+class _ThreadCounter:
+    """
+    Counts the started threads while it's entered, by wrapping `threading.Thread.start`.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._original_start = None
+
+    def __enter__(self) -> "_ThreadCounter":
+        original_start = self._original_start = threading.Thread.start
+
+        def start(thread, *args, **kwargs):
+            self.value += 1
+            return original_start(thread, *args, **kwargs)
+
+        threading.Thread.start = start
+        return self
+
+    def __exit__(self, *exc_info):
+        threading.Thread.start = self._original_start
+        self._original_start = None
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--sources", default=16, help="Number of simulated sources")
+    @click.option("--frame_rate", default=44100, help="Simulated frame rate")
+    @click.option("--frames_per_buffer", default=1024, help="Simulated frames per callback buffer")
+    @click.option("--duration", default=3.0, help="Duration of each run in seconds")
+    def cli(sources, frame_rate, frames_per_buffer, duration):
+        main(
+            source_count=sources,
+            frame_rate=frame_rate,
+            frames_per_buffer=frames_per_buffer,
+            duration=duration,
+        )
+
+    cli()
@@ -0,0 +1,152 @@
+def main(capture_count=4, duration=5.0):
+    print("-" * 80)
+    print(f"{capture_count} idle captures (source, queue and sink, no audio delivered), {duration} sec")
+    print(f"{'loops':>10} {'queue':>12} {'wakeups/sec':>12} {'wakeups/sec per capture':>24}")
+    print("-" * 80)
+
+    for label, source_cls, sink_cls in [
+        ("polling", _PollingDeviceSource, _PollingFileSink),
+        ("blocking", PyAudioDeviceSource, PyAVFileSink),
+    ]:
+        for use_ring_buffer in (False, True):
+            wakeups_per_sec = _run(source_cls, sink_cls, use_ring_buffer, capture_count, duration)
+            queue_label = "ring buffer" if use_ring_buffer else "queue"
+            print(f"{label:>10} {queue_label:>12} {wakeups_per_sec:>12.1f} {wakeups_per_sec / capture_count:>24.1f}")
+
+    print("-" * 80)
+
+
+import time
+import queue
+import resource
+import tempfile
+import contextlib
+from pathlib import Path
+from unittest import mock
+
+import pupil_audio.nonblocking.pyaudio
+from pupil_audio.utils.ring_buffer import AudioRingBuffer
+from pupil_audio.nonblocking import PyAVFileSink, PyAudioDeviceSource, PyAudio2PyAVTranscoder
+
+
+class _IdleStream:
+    """
+    Stream of a device that never delivers any buffer.
+    """
+
+    def start_stream(self):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _IdleManager:
+    def open(self, *args, **kwargs):
+        return _IdleStream()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def shared_instance():
+        yield _IdleManager()
+
+
+class _PollingDeviceSource(PyAudioDeviceSource):
+    """
+    The previous internal thread of PyAudioDeviceSource, which polled its queue at 10 Hz.
+    """
+
+    def _internal_signal_handler_loop(self, is_running, internal_queue, out_queue, channels, format, frame_rate, device_index):
+        while is_running.is_set():
+            try:
+                internal_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+
+class _PollingFileSink(PyAVFileSink):
+    """
+    The previous record loop of PyAVFileSink, which polled its queue at 100 Hz.
+    """
+
+    def _wake_record_loop(self):
+        pass
+
+    def _record_loop(self):
+        self._finished.wait()
+        self._finished.clear()
+        self.open_output()
+        while True:
+            try:
+                in_frame, in_timestamp = self._queue.get(timeout=0.01)
+            except queue.Empty:
+                if self.is_running:
+                    continue
+                break
+            self.write(in_frame, in_timestamp)
+        self.close_output()
+        self._finished.set()
+
+
+def _wakeups() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_nvcsw + usage.ru_nivcsw
+
+
+def _run(source_cls, sink_cls, use_ring_buffer, capture_count, duration) -> float:
+    captures = []
+
+    with tempfile.TemporaryDirectory() as temp_dir, mock.patch.object(pupil_audio.nonblocking.pyaudio, "PyAudioManager", _IdleManager):
+        for i in range(capture_count):
+            transcoder = PyAudio2PyAVTranscoder(frame_rate=48000, channels=2)
+            if use_ring_buffer:
+                shared_queue = AudioRingBuffer(seconds=1., frame_rate=48000, channels=2, dtype=transcoder.dtype)
+            else:
+                shared_queue = queue.Queue()
+            source = source_cls(
+                device_index=i,
+                frame_rate=transcoder.frame_rate,
+                channels=transcoder.channels,
+                format=transcoder.pyaudio_format,
+                out_queue=shared_queue,
+            )
+            sink = sink_cls(
+                file_path=str(Path(temp_dir) / f"{i}.mp4"),
+                transcoder=transcoder,
+                in_queue=shared_queue,
+            )
+            captures.append((source, sink))
+
+        for source, sink in captures:
+            sink.start()
+            source.start()
+
+        # Let the threads settle before measuring
+        time.sleep(0.5)
+        wakeups_before = _wakeups()
+        time.sleep(duration)
+        wakeups = _wakeups() - wakeups_before
+
+        start_time = time.perf_counter()
+        for source, sink in captures:
+            source.stop()
+            sink.stop()
+        stop_time = time.perf_counter() - start_time
+        assert stop_time < 1., f"Stopping took {stop_time:.3f} sec"
+
+    return wakeups / duration
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--capture_count", default=4, help="Number of idle captures")
+    @click.option("--duration", default=5.0, help="Seconds measured per run")
+    def cli(capture_count, duration):
+        main(capture_count=capture_count, duration=duration)
+
+    cli()
@@ -0,0 +1,107 @@
+def main(frame_rate=48000, channels=2, duration=60.0, repeats=3, frames_per_buffer=1024):
+    record_ns = _record_cost_ns()
+
+    print("-" * 80)
+    print(f"LatencyHistogram.record with two perf_counter calls: {record_ns:.0f} ns per stage")
+    print(f"{duration} sec of {channels} channel audio at {frame_rate} Hz, best of {repeats} runs")
+    print(f"{'profile':>16} {'CPU % off':>10} {'CPU % on':>10} {'extra µs per buffer':>20}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for label, profile, transcoder_cls, sink_cls, ext in _profiles():
+            if not EncoderProfile.available_codecs([profile]):
+                print(f"{label:>16} {'unavailable':>10}")
+                continue
+            # The settings alternate, so that a drift of the machine load affects both alike
+            cpu = {False: float("inf"), True: float("inf")}
+            for _ in range(repeats):
+                for measure_latency in (False, True):
+                    cpu_percent = _run(temp_dir, profile, transcoder_cls, sink_cls, ext, frame_rate, channels, duration, measure_latency, frames_per_buffer)
+                    cpu[measure_latency] = min(cpu[measure_latency], cpu_percent)
+            # CPU percentages are per second of audio, so their difference is spread over its buffers
+            overhead_us = 1e6 * (cpu[True] - cpu[False]) / 100 * frames_per_buffer / frame_rate
+            print(f"{label:>16} {cpu[False]:>10.3f} {cpu[True]:>10.3f} {overhead_us:>20.1f}")
+
+    print("-" * 80)
+
+
+import time
+import queue
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.utils.pyav import EncoderProfile
+from pupil_audio.utils.pyaudio import TimeInfo
+from pupil_audio.utils.latency import LatencyHistogram, PipelineLatency
+from pupil_audio.nonblocking import PyAVFileSink, WavMmapFileSink, PyAudio2PyAVTranscoder
+from pupil_audio.nonblocking.pyaudio2pyav import PassthroughTranscoder
+
+
+def _profiles():
+    return [
+        ("aac 128k", EncoderProfile.aac(bitrate=128000), PyAudio2PyAVTranscoder, PyAVFileSink, "mp4"),
+        ("pcm passthrough", EncoderProfile.pcm_passthrough("int16"), PassthroughTranscoder, PyAVFileSink, "wav"),
+        ("wav mmap", EncoderProfile.pcm_passthrough("int16"), PassthroughTranscoder, WavMmapFileSink, "wav"),
+    ]
+
+
+def _record_cost_ns(count=1_000_000) -> float:
+    histogram = LatencyHistogram()
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(count):
+        t = perf_counter()
+        histogram.record(perf_counter() - t)
+    return 1e9 * (perf_counter() - start) / count
+
+
+def _run(temp_dir, profile, transcoder_cls, sink_cls, ext, frame_rate, channels, duration, measure_latency, frames_per_buffer) -> float:
+    transcoder = transcoder_cls(frame_rate=frame_rate, channels=channels)
+    in_queue = queue.Queue()
+    latency = PipelineLatency() if measure_latency else None
+
+    sink = sink_cls(
+        file_path=str(Path(temp_dir) / f"benchmark.{ext}"),
+        transcoder=transcoder,
+        in_queue=in_queue,
+        encoder_profile=profile,
+        latency=latency,
+    )
+
+    buffer_count = int(duration * frame_rate / frames_per_buffer)
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-8000, 8000, size=(frames_per_buffer * buffer_count, channels), dtype=transcoder.dtype)
+
+    # The whole recording is queued upfront, so the sink runs as fast as it can
+    queued_time = time.perf_counter()
+    for i in range(buffer_count):
+        in_frame = samples[i * frames_per_buffer:(i + 1) * frames_per_buffer].tobytes()
+        time_info = TimeInfo(input_buffer_adc_time=i * frames_per_buffer / frame_rate)
+        if measure_latency:
+            # Queued like by a source that measures latency
+            time_info["queued_time"] = queued_time
+        in_queue.put((in_frame, time_info))
+
+    cpu_start = time.process_time()
+    sink.start()
+    sink.stop()
+    cpu_time = time.process_time() - cpu_start
+
+    return 100 * cpu_time / (buffer_count * frames_per_buffer / frame_rate)
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--frame_rate", default=48000, help="Simulated frame rate")
+    @click.option("--channels", default=2, help="Simulated channel count")
+    @click.option("--duration", default=60.0, help="Seconds of audio encoded per run")
+    @click.option("--repeats", default=3, help="Runs per profile and setting; the fastest one is reported")
+    @click.option("--frames_per_buffer", default=1024, help="Frames per queued buffer")
+    def cli(frame_rate, channels, duration, repeats, frames_per_buffer):
+        main(frame_rate=frame_rate, channels=channels, duration=duration, repeats=repeats, frames_per_buffer=frames_per_buffer)
+
+    cli()
@@ -0,0 +1,61 @@
+def main(in_names, duration=10.0, max_workers=None):
+    import tempfile
+
+    print("-" * 80)
+    print(f"{duration} sec per run, max workers {max_workers or 'default'}")
+    print(f"{'devices':>8} {'workers':>8} {'CPU %':>8} {'CPU % per device':>17} {'dropouts':>9} {'dropped frames':>15} {'max backlog':>12}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for device_count in range(1, len(in_names) + 1):
+            result = _run(in_names[:device_count], temp_dir, duration, max_workers)
+            print(f"{device_count:>8} {result['workers']:>8} "
+                  f"{result['cpu_percent']:>8.2f} {result['cpu_percent'] / device_count:>17.2f} "
+                  f"{result['dropout_count']:>9} {result['dropped_frames']:>15} {result['max_backlog']:>12}")
+
+    print("-" * 80)
+
+
+import time
+
+from pupil_audio.nonblocking import MultiDeviceCapture
+
+
+def _run(in_names, out_dir, duration, max_workers):
+    capture = MultiDeviceCapture(in_names=in_names, out_dir=out_dir, max_workers=max_workers)
+
+    max_backlog = 0
+
+    cpu_start = time.process_time()
+    capture.start()
+    start_time = time.monotonic()
+    while time.monotonic() - start_time < duration:
+        time.sleep(0.1)
+        max_backlog = max([max_backlog] + [stats.backlog for stats in capture.stats()])
+    capture.stop()
+    cpu_time = time.process_time() - cpu_start
+
+    all_stats = capture.stats()
+    capture.cleanup()
+
+    return {
+        "workers": capture.max_workers,
+        "cpu_percent": 100 * cpu_time / duration,
+        "dropout_count": sum(stats.dropout_count for stats in all_stats),
+        "dropped_frames": sum(stats.dropped_frames for stats in all_stats),
+        "max_backlog": max_backlog,
+    }
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--device", "devices", multiple=True, help="Input device name (all input devices if not set)")
+    @click.option("--duration", default=10.0, help="Seconds recorded per run")
+    @click.option("--max_workers", default=None, type=click.INT, help="Size of the encoder pool")
+    def cli(devices, duration, max_workers):
+        in_names = list(devices) or MultiDeviceCapture.available_input_devices()
+        main(in_names=in_names, duration=duration, max_workers=max_workers)
+
+    cli()
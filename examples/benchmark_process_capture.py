@@ -0,0 +1,62 @@
+def main(in_name, runs=10, duration=1.0):
+    import tempfile
+
+    print("-" * 80)
+    print(f"Device: {in_name}, {runs} runs of {duration} sec")
+    print(f"{'capture':>28} {'start ms (mean/max)':>20} {'stop ms (mean/max)':>20}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for capture_cls in [PyAudio2PyAVCapture, PyAudio2PyAVProcessCapture]:
+            out_path = str(Path(temp_dir) / f"{capture_cls.__name__}.mp4")
+            start_times, stop_times = _run(capture_cls, in_name, out_path, runs, duration)
+            print(f"{capture_cls.__name__:>28} "
+                  f"{1e3 * np.mean(start_times):>10.2f}/{1e3 * np.max(start_times):<9.2f} "
+                  f"{1e3 * np.mean(stop_times):>10.2f}/{1e3 * np.max(stop_times):<9.2f}")
+
+    print("-" * 80)
+
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.nonblocking import PyAudio2PyAVCapture, PyAudio2PyAVProcessCapture
+
+
+def _run(capture_cls, in_name, out_path, runs, duration):
+    capture = capture_cls(in_name=in_name, out_path=out_path)
+
+    start_times, stop_times = [], []
+
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            capture.start()
+            start_times.append(time.perf_counter() - start)
+
+            time.sleep(duration)
+
+            start = time.perf_counter()
+            capture.stop()
+            stop_times.append(time.perf_counter() - start)
+    finally:
+        if isinstance(capture, PyAudio2PyAVProcessCapture):
+            capture.cleanup()
+
+    return start_times, stop_times
+
+
+if __name__ == "__main__":
+    import click
+    import examples.utils as example_utils
+
+    @click.command()
+    @click.option("--runs", default=10, help="Start/stop cycles per capture")
+    @click.option("--duration", default=1.0, help="Seconds recorded per cycle")
+    def cli(runs, duration):
+        in_name = example_utils.get_user_selected_input_name()
+        main(in_name=in_name, runs=runs, duration=duration)
+
+    cli()
@@ -0,0 +1,73 @@
+def main(frame_rate=48000, channels=2, duration=30.0, callback_sizes=(64, 256, 1024, 4096)):
+    import tempfile
+
+    print("-" * 80)
+    print(f"{duration} sec of {channels} channel audio at {frame_rate} Hz per run")
+    print(f"{'frames/callback':>16} {'batching':>9} {'encode calls/sec':>17} {'CPU % per stream':>17}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for frames_per_buffer in callback_sizes:
+            for is_batching in (False, True):
+                result = _run(temp_dir, frame_rate, channels, duration, frames_per_buffer, is_batching)
+                print(f"{frames_per_buffer:>16} {str(is_batching):>9} "
+                      f"{result['encode_calls_per_sec']:>17.1f} {result['cpu_percent']:>17.2f}")
+
+    print("-" * 80)
+
+
+import time
+import queue
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.utils.pyaudio import TimeInfo
+from pupil_audio.nonblocking import PyAVFileSink, PyAudio2PyAVTranscoder
+
+
+def _run(temp_dir, frame_rate, channels, duration, frames_per_buffer, is_batching):
+    transcoder = PyAudio2PyAVTranscoder(frame_rate=frame_rate, channels=channels)
+    in_queue = queue.Queue()
+
+    sink = PyAVFileSink(
+        file_path=str(Path(temp_dir) / f"{frames_per_buffer}-{is_batching}.mp4"),
+        transcoder=transcoder,
+        in_queue=in_queue,
+        encode_frame_size=None if is_batching else 0,
+    )
+
+    buffer_count = int(duration * frame_rate / frames_per_buffer)
+    samples = np.random.uniform(-1000, 1000, size=frames_per_buffer * channels).astype(transcoder.dtype)
+    in_frame = samples.tobytes()
+
+    # The whole recording is queued upfront, so the sink runs as fast as it can
+    for i in range(buffer_count):
+        time_info = TimeInfo(input_buffer_adc_time=i * frames_per_buffer / frame_rate)
+        in_queue.put((in_frame, time_info))
+
+    cpu_start = time.process_time()
+    sink.start()
+    while not in_queue.empty():
+        time.sleep(0.01)
+    sink.stop()
+    cpu_time = time.process_time() - cpu_start
+
+    audio_duration = buffer_count * frames_per_buffer / frame_rate
+    return {
+        "encode_calls_per_sec": sink.encode_call_count / audio_duration,
+        "cpu_percent": 100 * cpu_time / audio_duration,
+    }
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--frame_rate", default=48000, help="Simulated frame rate")
+    @click.option("--channels", default=2, help="Simulated channel count")
+    @click.option("--duration", default=30.0, help="Seconds of audio encoded per run")
+    def cli(frame_rate, channels, duration):
+        main(frame_rate=frame_rate, channels=channels, duration=duration)
+
+    cli()
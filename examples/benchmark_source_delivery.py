@@ -0,0 +1,97 @@
+def main(in_name, duration=5.0):
+    import pyaudio
+    from pupil_audio.utils.pyaudio import DeviceInfo
+
+    device = DeviceInfo.named_input(in_name)
+
+    print("-" * 80)
+    print(f"Device: {in_name}, {duration} sec per run")
+    print("-" * 80)
+
+    for label, direct_delivery in [("relay thread", False), ("direct delivery", True)]:
+        result = _run(device, pyaudio.paInt16, direct_delivery, duration)
+        print(f"{label:>16}: "
+              f"callback-to-sink latency mean {1e6 * result['latency_mean']:>7.0f} us, "
+              f"p99 {1e6 * result['latency_p99']:>7.0f} us, "
+              f"{result['context_switches_per_sec']:>7.1f} context switches/sec, "
+              f"{result['buffer_count']} buffers")
+
+    print("-" * 80)
+
+
+import time
+import queue
+import resource
+import threading
+
+from pupil_audio.nonblocking import PyAudioDeviceSource
+
+
+class _TimedDeviceSource(PyAudioDeviceSource):
+    def _stream_callback(self, in_data, frame_count, time_info, status):
+        time_info = dict(time_info, callback_time=time.perf_counter())
+        return super()._stream_callback(in_data, frame_count, time_info, status)
+
+
+def _run(device, format, direct_delivery, duration):
+    out_queue = queue.Queue()
+
+    source = _TimedDeviceSource(
+        device_index=device.index,
+        frame_rate=device.default_sample_rate,
+        channels=device.max_input_channels,
+        format=format,
+        out_queue=out_queue,
+        direct_delivery=direct_delivery,
+    )
+
+    latencies = []
+    is_running = threading.Event()
+    is_running.set()
+
+    def consume():
+        while is_running.is_set():
+            try:
+                _, time_info = out_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            latencies.append(time.perf_counter() - time_info["callback_time"])
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    source.start()
+    time.sleep(duration)
+    source.stop()
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    is_running.clear()
+    consumer.join()
+    source.cleanup()
+
+    context_switches = (
+        (usage_after.ru_nvcsw - usage_before.ru_nvcsw) +
+        (usage_after.ru_nivcsw - usage_before.ru_nivcsw)
+    )
+
+    latencies.sort()
+    return {
+        "buffer_count": len(latencies),
+        "latency_mean": sum(latencies) / max(len(latencies), 1),
+        "latency_p99": latencies[int(0.99 * (len(latencies) - 1))] if latencies else float("nan"),
+        "context_switches_per_sec": context_switches / duration,
+    }
+
+
+if __name__ == "__main__":
+    import click
+    import examples.utils as example_utils
+
+    @click.command()
+    @click.option("--duration", default=5.0, help="Duration of each run in seconds")
+    def cli(duration):
+        in_name = example_utils.get_user_selected_input_name()
+        main(in_name=in_name, duration=duration)
+
+    cli()
@@ -0,0 +1,69 @@
+def main(frames_per_buffer=1024, iterations=2000, frame_pool_size=0):
+    import numpy as np
+
+    from pupil_audio.utils.pyaudio import TimeInfo
+    from pupil_audio.nonblocking.pyaudio2pyav import PyAudio2PyAVTranscoder, PassthroughTranscoder
+
+    time_info = TimeInfo(input_buffer_adc_time=0., current_time=0.)
+
+    print("-" * 80)
+    print(f"{frames_per_buffer} frames per buffer, {iterations} iterations, frame pool size {frame_pool_size}")
+    print(f"{'transcoder':>22} {'dtype':>6} {'channels':>8} {'ns/sample':>10}")
+    print("-" * 80)
+
+    for transcoder_cls in [PyAudio2PyAVTranscoder, PassthroughTranscoder]:
+        dtypes = sorted(transcoder_cls._dtype_to_pyav_format_interleaved_and_planar.keys(), key=str)
+        channel_counts = sorted(transcoder_cls._channels_to_pyav_layout.keys())
+
+        for dtype in dtypes:
+            for channels in channel_counts:
+                transcoder = transcoder_cls(
+                    frame_rate=48000, channels=channels, dtype=dtype, frame_pool_size=frame_pool_size,
+                )
+                in_frame = _synthetic_buffer(frames_per_buffer, channels, dtype)
+                elapsed = _time(transcoder.transcode, in_frame, time_info, iterations)
+                ns_per_sample = 1e9 * elapsed / (iterations * frames_per_buffer * channels)
+                print(f"{transcoder_cls.__name__:>22} {dtype.str:>6} {channels:>8} {ns_per_sample:>10.2f}")
+
+    print("-" * 80)
+
+
+import time
+
+import numpy as np
+
+
+def _synthetic_buffer(frames, channels, dtype) -> bytes:
+    samples = np.random.uniform(-0.5, 0.5, size=frames * channels)
+    if dtype.kind == "f":
+        return samples.astype(dtype).tobytes()
+    info = np.iinfo(dtype)
+    scaled = samples * (int(info.max) - int(info.min)) + (int(info.max) + int(info.min)) / 2
+    return scaled.astype(dtype).tobytes()
+
+
+def _time(fn, in_frame, time_info, iterations) -> float:
+    # Warm up, e.g. to fill the frame pool
+    for _ in range(10):
+        fn(in_frame, time_info)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(in_frame, time_info)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--frames_per_buffer", default=1024, help="Frames per transcoded buffer")
+    @click.option("--iterations", default=2000, help="Transcoded buffers per configuration")
+    @click.option("--frame_pool_size", default=0, help="Size of the transcoder frame pool (0 disables it)")
+    def cli(frames_per_buffer, iterations, frame_pool_size):
+        main(
+            frames_per_buffer=frames_per_buffer,
+            iterations=iterations,
+            frame_pool_size=frame_pool_size,
+        )
+
+    cli()
@@ -0,0 +1,105 @@
+def main(duration=600.0, channels=2, frame_rate=48000, chunk_size=1024):
+    import tempfile
+
+    print("-" * 80)
+    print(f"Reading {duration} sec of {channels} channel int16 audio at {frame_rate} Hz, {chunk_size} frames per chunk")
+    print(f"{'reader':>28} {'MB/s':>10} {'x realtime':>12}")
+    print("-" * 80)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = str(Path(temp_dir) / "benchmark.wav")
+        _write_file(path, duration, channels, frame_rate)
+        data_size = os.path.getsize(path)
+
+        for label, read_fn in [
+            ("wave.readframes", _read_stdlib),
+            ("WaveFileInputStream", _read_mmap),
+            ("WaveFileInputStream blocks", _read_mmap_blocks),
+        ]:
+            # Every reader reduces the samples, so that they are actually touched
+            elapsed = _time(read_fn, path, chunk_size)
+            print(f"{label:>28} {data_size / elapsed / 1e6:>10.1f} {duration / elapsed:>12.0f}")
+
+    print("-" * 80)
+
+
+import os
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.utils.wav import WavMmapWriter
+from pupil_audio.blocking import WaveFileInputStream
+
+
+def _write_file(path, duration, channels, frame_rate, block_frames=48000):
+    writer = WavMmapWriter(path, frame_rate=frame_rate, channels=channels, dtype=np.int16)
+    rng = np.random.default_rng(0)
+    remaining = int(duration * frame_rate)
+    while remaining > 0:
+        frames = min(block_frames, remaining)
+        writer.write(rng.integers(-8000, 8000, size=(frames, channels), dtype=np.int16))
+        remaining -= frames
+    writer.close()
+
+
+def _read_stdlib(path, chunk_size) -> int:
+    total = 0
+    with wave.open(path, "rb") as file:
+        channels = file.getnchannels()
+        while True:
+            data = file.readframes(chunk_size)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+            total += int(samples[:, 0].sum())
+    return total
+
+
+def _read_mmap(path, chunk_size) -> int:
+    total = 0
+    stream = WaveFileInputStream(path)
+    try:
+        while True:
+            samples = stream.read_decoded(chunk_size)
+            if samples.size == 0:
+                break
+            total += int(samples[:, 0].sum())
+    finally:
+        stream.close()
+    return total
+
+
+def _read_mmap_blocks(path, chunk_size) -> int:
+    stream = WaveFileInputStream(path)
+    try:
+        return sum(int(block[:, 0].sum()) for block in stream.iter_blocks(chunk_size))
+    finally:
+        stream.close()
+
+
+def _time(read_fn, path, chunk_size, repeats=3) -> float:
+    # The best of a few runs, once the file is in the page cache
+    read_fn(path, chunk_size)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        read_fn(path, chunk_size)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--duration", default=600.0, help="Seconds of audio in the benchmark file")
+    @click.option("--channels", default=2, help="Channel count of the benchmark file")
+    @click.option("--frame_rate", default=48000, help="Frame rate of the benchmark file")
+    @click.option("--chunk_size", default=1024, help="Frames per read")
+    def cli(duration, channels, frame_rate, chunk_size):
+        main(duration=duration, channels=channels, frame_rate=frame_rate, chunk_size=chunk_size)
+
+    cli()
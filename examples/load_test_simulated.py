@@ -0,0 +1,195 @@
+def main(stream_counts=(1, 2, 4, 8, 16, 32), duration=10.0, profile="wav", frame_rate=48000, channels=2, frames_per_buffer=1024, jitter=0.002, overflow_probability=0.0, hotplug_cycles=20, out_path=None):
+    """
+    Record from simulated devices with an increasing number of concurrent captures, and run a hotplug storm.
+    """
+    results = []
+
+    print("-" * 100)
+    print(f"{duration} sec per run, {channels} channels at {frame_rate} Hz, {frames_per_buffer} frames per buffer, "
+          f"{profile}, jitter {1000 * jitter:.1f} ms, overflow probability {overflow_probability}")
+    print(f"{'streams':>7} {'CPU %':>7} {'per stream':>10} {'buffers':>8} {'overflows':>9} {'dropouts':>8} "
+          f"{'lost frames':>11} {'callback p99':>12} {'queue p99':>10} {'write p99':>10}")
+    print("-" * 100)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for stream_count in stream_counts:
+            result = _run_captures(temp_dir, stream_count, duration, profile, frame_rate, channels, frames_per_buffer, jitter, overflow_probability)
+            results.append(result)
+            print(f"{stream_count:>7} {result['cpu_percent']:>7.1f} {result['cpu_percent'] / stream_count:>10.2f} "
+                  f"{result['buffer_count']:>8} {result['input_overflow_count']:>9} {result['dropout_count']:>8} "
+                  f"{result['dropped_frames']:>11} {_ms(result['latency']['callback']['p99']):>12} "
+                  f"{_ms(result['latency']['queue']['p99']):>10} {_ms(result['write_p99']):>10}")
+
+    print("-" * 100)
+
+    hotplug = None
+    if hotplug_cycles:
+        hotplug = _run_hotplug_storm(hotplug_cycles)
+        print(f"Hotplug storm: {hotplug['toggle_count']} device changes, {hotplug['detected_count']} detected, "
+              f"detection latency p50 {_ms(hotplug['latency_p50'])} ms, max {_ms(hotplug['latency_max'])} ms")
+        print("-" * 100)
+
+    if out_path is not None:
+        with open(out_path, "w") as file:
+            json.dump({"captures": results, "hotplug": hotplug}, file, indent=2, default=float)
+        print(f"Results saved to {out_path}")
+
+
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from pupil_audio.utils.pyav import EncoderProfile
+from pupil_audio.utils.latency import PipelineLatency
+from pupil_audio.utils.simulated_pyaudio import SimulatedPortAudio, SimulatedDevice
+from pupil_audio.nonblocking import PyAudio2PyAVCapture, PyAVFileSink, WavMmapFileSink, PyAudioBackgroundDeviceMonitor
+from pupil_audio.nonblocking.pyaudio2pyav import PyAudio2PyAVTranscoder, PassthroughTranscoder
+
+
+def _profiles():
+    return {
+        "wav": (EncoderProfile.pcm_passthrough("int16"), PassthroughTranscoder, WavMmapFileSink, "wav"),
+        "flac": (EncoderProfile.flac(compression_level=0), PassthroughTranscoder, PyAVFileSink, "flac"),
+        "aac": (EncoderProfile.aac(), PyAudio2PyAVTranscoder, PyAVFileSink, "mp4"),
+    }
+
+
+def _device_name(index) -> str:
+    # On Linux, only the devices with "hw:" in their name are listed
+    return f"Simulated {index} (hw:{index},0)"
+
+
+def _run_captures(temp_dir, stream_count, duration, profile, frame_rate, channels, frames_per_buffer, jitter, overflow_probability) -> dict:
+    encoder_profile, transcoder_cls, sink_cls, ext = _profiles()[profile]
+
+    backend = SimulatedPortAudio(
+        devices=[
+            SimulatedDevice(name=_device_name(i), max_input_channels=channels, default_sample_rate=float(frame_rate))
+            for i in range(stream_count)
+        ],
+        jitter=jitter,
+        overflow_probability=overflow_probability,
+        seed=stream_count,
+    )
+
+    with backend.installed():
+        captures = [
+            PyAudio2PyAVCapture(
+                in_name=_device_name(i),
+                out_path=str(Path(temp_dir) / f"stream_{i}.{ext}"),
+                frame_rate=frame_rate,
+                channels=channels,
+                transcoder_cls=transcoder_cls,
+                sink_cls=sink_cls,
+                frames_per_buffer=frames_per_buffer,
+                encoder_profile=encoder_profile,
+                measure_latency=True,
+            )
+            for i in range(stream_count)
+        ]
+
+        wall_start, cpu_start = time.monotonic(), time.process_time()
+        for capture in captures:
+            capture.start()
+        time.sleep(duration)
+        for capture in captures:
+            capture.stop()
+        wall_time, cpu_time = time.monotonic() - wall_start, time.process_time() - cpu_start
+
+    stats = [capture.stats() for capture in captures]
+    latency = PipelineLatency.merged(capture.latency for capture in captures)
+    # The sinks either transcode and encode, or copy the buffers into the file
+    write_stages = [h for stage, h in latency.histograms.items() if stage in ("transcode", "encode", "mux") and len(h)]
+
+    return {
+        "stream_count": stream_count,
+        "cpu_percent": 100 * cpu_time / wall_time,
+        "buffer_count": sum(s.buffer_count for s in stats),
+        "input_overflow_count": sum(s.input_overflow_count for s in stats),
+        "dropout_count": sum(s.dropout_count for s in stats),
+        "dropped_frames": sum(s.dropped_frames for s in stats),
+        "simulated": dict(backend.stats()),
+        "latency": latency.summary(),
+        "write_p99": sum(h.percentile(99) for h in write_stages),
+    }
+
+
+def _run_hotplug_storm(cycles, interval=0.1) -> dict:
+    """
+    Connect and disconnect a device every `interval` seconds, and time how long the monitor takes to notice.
+    """
+    backend = SimulatedPortAudio(devices=[SimulatedDevice(name=_device_name(0))])
+    toggled_name = _device_name(1)
+
+    changed_at = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def on_changes(changes):
+        now = time.monotonic()
+        with lock:
+            if toggled_name in changes.added or toggled_name in changes.removed:
+                latencies.append(now - changed_at.pop(toggled_name, now))
+
+    with backend.installed():
+        monitor = PyAudioBackgroundDeviceMonitor(freq_hz=50., min_freq_hz=50., use_inotify=False)
+        monitor.subscribe(on_changes)
+        monitor.start()
+        try:
+            for i in range(2 * cycles):
+                time.sleep(interval)
+                with lock:
+                    changed_at[toggled_name] = time.monotonic()
+                if i % 2 == 0:
+                    backend.add_device(SimulatedDevice(name=toggled_name))
+                else:
+                    backend.remove_device(toggled_name)
+            time.sleep(interval)
+        finally:
+            monitor.stop()
+
+    return {
+        "toggle_count": 2 * cycles,
+        "detected_count": len(latencies),
+        "latency_p50": float(np.median(latencies)) if latencies else float("nan"),
+        "latency_max": max(latencies) if latencies else float("nan"),
+    }
+
+
+def _ms(seconds) -> str:
+    return f"{1000 * seconds:.2f}"
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--streams", "stream_counts", default=[1, 2, 4, 8, 16, 32], multiple=True, help="Concurrent captures per run (repeatable)")
+    @click.option("--duration", default=10.0, help="Seconds recorded per run")
+    @click.option("--profile", default="wav", type=click.Choice(["wav", "flac", "aac"]), help="Output format of the captures")
+    @click.option("--frame_rate", default=48000, help="Frame rate of the simulated devices")
+    @click.option("--channels", default=2, help="Channel count of the simulated devices")
+    @click.option("--frames_per_buffer", default=1024, help="Frames per PortAudio buffer")
+    @click.option("--jitter", default=0.002, help="Maximum delay of a callback, in seconds")
+    @click.option("--overflow_probability", default=0.0, help="Probability of an injected overflow per callback")
+    @click.option("--hotplug_cycles", default=20, help="Connect/disconnect cycles of the hotplug storm (0 skips it)")
+    @click.option("--out", "out_path", default=None, help="Save the results to this JSON file")
+    def cli(stream_counts, duration, profile, frame_rate, channels, frames_per_buffer, jitter, overflow_probability, hotplug_cycles, out_path):
+        main(
+            stream_counts=stream_counts,
+            duration=duration,
+            profile=profile,
+            frame_rate=frame_rate,
+            channels=channels,
+            frames_per_buffer=frames_per_buffer,
+            jitter=jitter,
+            overflow_probability=overflow_probability,
+            hotplug_cycles=hotplug_cycles,
+            out_path=out_path,
+        )
+
+    cli()
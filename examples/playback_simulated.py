@@ -0,0 +1,134 @@
+def main(duration=3.0, frame_rate=48000, channels=2, frames_per_buffer=256, target_latency=0.05, chunk_size=1024, jitter=0.002, unplug_after=1.0) -> bool:
+    """
+    Play a tone on a simulated output device, then unplug the device while playing.
+
+    Returns `True` if the playback didn't underrun, and the unplugged device was detected by the writer.
+    """
+    backend = SimulatedPortAudio(
+        devices=[SimulatedDevice(name=DEVICE_NAME, max_input_channels=0, max_output_channels=channels, default_sample_rate=float(frame_rate))],
+        jitter=jitter,
+    )
+
+    print("-" * 80)
+    print(f"{duration} sec of {channels} channel audio at {frame_rate} Hz, {frames_per_buffer} frames per buffer, "
+          f"target latency {1000 * target_latency:.0f} ms, jitter {1000 * jitter:.1f} ms")
+    print("-" * 80)
+
+    with backend.installed():
+        stats, write_time = _play(duration, frame_rate, channels, frames_per_buffer, target_latency, chunk_size)
+        print(f"Played for {write_time:.2f} sec: {stats.callback_count} callbacks, {stats.underrun_count} underruns "
+              f"({stats.underrun_frames} frames), output latency {_ms(stats.output_latency)} ms")
+
+        unplug_error, unplug_time = _play_until_unplugged(backend, frame_rate, channels, frames_per_buffer, target_latency, chunk_size, unplug_after)
+        if unplug_error is None:
+            print("Unplugged device: not detected")
+        else:
+            print(f"Unplugged device: detected {unplug_time:.2f} sec after unplugging ({unplug_error})")
+
+    print("-" * 80)
+
+    return stats.underrun_count == 0 and unplug_error is not None
+
+
+import sys
+import time
+import threading
+
+import numpy as np
+
+from pupil_audio.blocking import PyAudioDeviceOutputStream
+from pupil_audio.utils.simulated_pyaudio import SimulatedPortAudio, SimulatedDevice
+
+
+# On Linux, only the devices with "hw:" in their name are listed
+DEVICE_NAME = "Simulated output (hw:0,0)"
+
+
+def _open(frame_rate, channels, frames_per_buffer, target_latency) -> PyAudioDeviceOutputStream:
+    return PyAudioDeviceOutputStream(
+        name=DEVICE_NAME,
+        channels=channels,
+        frame_rate=frame_rate,
+        dtype="int16",
+        frames_per_buffer=frames_per_buffer,
+        target_latency=target_latency,
+    )
+
+
+def _tone(frame_rate, channels, chunk_size, chunk_index) -> np.ndarray:
+    # A continuous 440 Hz tone at -12 dBFS on every channel
+    t = (chunk_index * chunk_size + np.arange(chunk_size)) / frame_rate
+    samples = (0.25 * 32767 * np.sin(2 * np.pi * 440. * t)).astype(np.int16)
+    return np.repeat(samples[:, np.newaxis], channels, axis=1)
+
+
+def _play(duration, frame_rate, channels, frames_per_buffer, target_latency, chunk_size):
+    stream = _open(frame_rate, channels, frames_per_buffer, target_latency)
+    start_time = time.monotonic()
+    try:
+        for chunk_index in range(int(duration * frame_rate / chunk_size)):
+            # Blocks while the ring is full, which paces the writes to the device
+            stream.write_decoded(_tone(frame_rate, channels, chunk_size, chunk_index))
+        write_time = time.monotonic() - start_time
+        stats = stream.stats()
+    finally:
+        stream.close()
+    return stats, write_time
+
+
+def _play_until_unplugged(backend, frame_rate, channels, frames_per_buffer, target_latency, chunk_size, unplug_after, timeout=5.):
+    stream = _open(frame_rate, channels, frames_per_buffer, target_latency)
+    unplug_time = []
+
+    def unplug():
+        unplug_time.append(time.monotonic())
+        backend.remove_device(DEVICE_NAME)
+
+    timer = threading.Timer(unplug_after, unplug)
+    timer.start()
+    start_time = time.monotonic()
+    try:
+        chunk_index = 0
+        # Without the check of the stream state, the writes would block forever once the device is gone
+        while time.monotonic() - start_time < unplug_after + timeout:
+            stream.write_decoded(_tone(frame_rate, channels, chunk_size, chunk_index))
+            chunk_index += 1
+        return None, None
+    except IOError as err:
+        return err, time.monotonic() - unplug_time[0]
+    finally:
+        timer.cancel()
+        stream.close(drain=False)
+        backend.add_device(SimulatedDevice(name=DEVICE_NAME, max_input_channels=0, max_output_channels=channels, default_sample_rate=float(frame_rate)))
+
+
+def _ms(seconds) -> str:
+    return f"{1000 * seconds:.2f}"
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option("--duration", default=3.0, help="Seconds of audio played")
+    @click.option("--frame_rate", default=48000, help="Frame rate of the simulated device")
+    @click.option("--channels", default=2, help="Channel count of the simulated device")
+    @click.option("--frames_per_buffer", default=256, help="Frames per PortAudio buffer")
+    @click.option("--target_latency", default=0.05, help="Seconds buffered ahead of the device")
+    @click.option("--chunk_size", default=1024, help="Frames per write")
+    @click.option("--jitter", default=0.002, help="Maximum delay of a callback, in seconds")
+    @click.option("--unplug_after", default=1.0, help="Seconds of playback before the device is unplugged")
+    def cli(duration, frame_rate, channels, frames_per_buffer, target_latency, chunk_size, jitter, unplug_after):
+        is_ok = main(
+            duration=duration,
+            frame_rate=frame_rate,
+            channels=channels,
+            frames_per_buffer=frames_per_buffer,
+            target_latency=target_latency,
+            chunk_size=chunk_size,
+            jitter=jitter,
+            unplug_after=unplug_after,
+        )
+        sys.exit(0 if is_ok else 1)
+
+    cli()
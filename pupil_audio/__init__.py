@@ -1,4 +1,12 @@
-from .utils.pyaudio import PyAudioManager, HostApiInfo, DeviceInfo, TimeInfo
-from .nonblocking.pyaudio import PyAudioDeviceSource, PyAudioDelayedDeviceSource, PyAudioDeviceMonitor, PyAudioBackgroundDeviceMonitor
+from .utils.pyaudio import PyAudioManager, HostApiInfo, DeviceInfo, DeviceSnapshot, TimeInfo
+from .utils.ring_buffer import AudioRingBuffer, SampleRingBuffer, OverflowPolicy
+from .utils.pyav import EncoderProfile
+from .utils.wav import WavInfo, WavMmapWriter, read_wav_info, recover_wav
+from .utils.latency import LatencyHistogram, PipelineLatency
+from .utils.simulated_pyaudio import SimulatedPortAudio, SimulatedDevice
+from .nonblocking.pyaudio import SourceStats, PyAudioDeviceSource, PyAudioDelayedDeviceSource, PyAudioDeviceMonitor, PyAudioBackgroundDeviceMonitor
 from .nonblocking.pyaudio2pyav import PyAudio2PyAVCapture, PyAudio2PyAVTranscoder
+from .nonblocking.process import PyAudio2PyAVProcessCapture
+from .nonblocking.multi_device import MultiDeviceCapture
 from .nonblocking.pyav import PyAVFileSink, PyAVMultipartFileSink
+from .nonblocking.wav import WavMmapFileSink, WavMmapMultipartFileSink
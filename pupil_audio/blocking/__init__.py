@@ -4,7 +4,7 @@ from .base import Codec
 from .base import InputStream, InputStreamWithCodec
 from .base import OutputStream, OutputStreamWithCodec
 
-from .pyaudio import PyAudioCodec, PyAudioDeviceInputStream, PyAudioDeviceOutputStream
+from .pyaudio import PyAudioCodec, PyAudioDeviceInputStream, PyAudioDeviceOutputStream, OutputStreamStats
 
 from .pyav import PyAVCodec, PyAVFileInputStream, PyAVFileOutputStream
 
@@ -34,6 +34,13 @@ class InputStream(T.Generic[EncodedData], abc.ABC):
     def close(self):
         pass
 
+    @property
+    def input_overflow_count(self) -> int:
+        """
+        Number of times the input lost samples because it wasn't read in time; files never do.
+        """
+        return 0
+
 
 class OutputStream(T.Generic[EncodedData], abc.ABC):
 
@@ -1,43 +1,151 @@
+import queue
 import logging
 import threading
 
+import numpy as np
+
+from pupil_audio.utils import key_property
+from pupil_audio.utils.ring_buffer import AudioRingBuffer, OverflowPolicy
+
 
 logger = logging.getLogger(__name__)
 
 
+class ControlStats(dict):
+    """
+    Snapshot of the counters of a `Control` pipeline.
+    """
+    read_chunk_count     = key_property("read_chunk_count",     type=int, readonly=True, default=0)
+    written_chunk_count  = key_property("written_chunk_count",  type=int, readonly=True, default=0)
+    overflow_count       = key_property("overflow_count",       type=int, readonly=True, default=0)
+    input_overflow_count = key_property("input_overflow_count", type=int, readonly=True, default=0)
+    backlog              = key_property("backlog",              type=int, readonly=True, default=0)
+    max_backlog          = key_property("max_backlog",          type=int, readonly=True, default=0)
+    buffer_depth         = key_property("buffer_depth",         type=int, readonly=True, default=0)
+
+
 class Control:
+    """
+    Copies the chunks of an input stream into an output stream.
 
-    def __init__(self):
+    The input is read on one thread and the output written on another, joined by a preallocated
+    `AudioRingBuffer` of `buffer_depth` chunks, so a slow write (e.g. an encoder flush or a disk
+    stall) doesn't hold up the next read. If the writer falls more than `buffer_depth` chunks
+    behind, chunks are dropped according to `overflow_policy` (new chunks by default; use
+    `OverflowPolicy.BLOCK` for inputs that can wait, like files) and counted in `stats()`,
+    next to the overflows of the input itself (see `InputStream.input_overflow_count`).
+
+    The pipeline ends when `stop` is called, or when the input returns an empty chunk; the
+    writer finishes the buffered chunks first. Each stream is closed by the thread using it.
+    """
+
+    def __init__(self, buffer_depth: int = 16, overflow_policy=OverflowPolicy.DROP_NEWEST):
+        assert buffer_depth > 0
+        self.buffer_depth = int(buffer_depth)
+        self.overflow_policy = OverflowPolicy(overflow_policy)
         self._flag = threading.Event()
-        self._thread = None
+        self._reader_thread = None
+        self._writer_thread = None
+        self._buffer = None
+        self._input_stream = None
+        self._read_chunk_count = 0
+        self._written_chunk_count = 0
         self.stop()
 
-    def start(self, *args, **kwargs):
+    @property
+    def is_running(self) -> bool:
+        return any(t is not None and t.is_alive() for t in (self._reader_thread, self._writer_thread))
+
+    def stats(self) -> ControlStats:
+        buffer = self._buffer
+        if buffer is None:
+            return ControlStats(buffer_depth=self.buffer_depth)
+        return ControlStats(
+            read_chunk_count=self._read_chunk_count,
+            written_chunk_count=self._written_chunk_count,
+            overflow_count=buffer.dropped_block_count + buffer.overwritten_block_count,
+            input_overflow_count=self._input_stream.input_overflow_count,
+            backlog=buffer.qsize(),
+            max_backlog=buffer.high_water_mark,
+            buffer_depth=self.buffer_depth,
+        )
+
+    def start(self, input_stream, output_stream, channels, chunk_size):
+        self.stop()
         self._flag.set()
 
-        self._thread = threading.Thread(
-            target=self._process,
+        self._read_chunk_count = 0
+        self._written_chunk_count = 0
+        self._input_stream = input_stream
+        self._buffer = AudioRingBuffer(
+            seconds=None,
+            block_count=self.buffer_depth,
+            frame_rate=input_stream.codec.frame_rate,
+            channels=channels,
+            dtype=np.dtype(input_stream.codec.dtype),
+            frames_per_block=chunk_size,
+            overflow_policy=self.overflow_policy,
+        )
+
+        self._writer_thread = threading.Thread(
+            target=self._write_loop,
+            name="Capture-writer",
+            args=(self._buffer, output_stream, channels),
+        )
+        self._reader_thread = threading.Thread(
+            target=self._read_loop,
             name="Capture",
-            args=args,
-            kwargs=kwargs,
+            args=(self._buffer, input_stream, chunk_size),
         )
 
-        self._thread.start()
+        self._writer_thread.start()
+        self._reader_thread.start()
 
     def stop(self):
         self._flag.clear()
-        if self._thread is not None:
-            self._thread.join()
+        # The reader ends first, and then lets the writer drain the buffer
+        for thread in (self._reader_thread, self._writer_thread):
+            if thread is not None:
+                thread.join()
+        self._reader_thread = None
+        self._writer_thread = None
 
-    def _process(self, input_stream, output_stream, channels, chunk_size):
+    def _read_loop(self, buffer, input_stream, chunk_size):
         try:
             logger.debug("Recording started")
             while self._flag.is_set():
                 data = input_stream.read_decoded(chunk_size)
-                output_stream.write_decoded(data)
-            logging.debug("Recording finished")
+                if len(data) == 0:
+                    logger.debug("End of input")
+                    break
+                self._read_chunk_count += 1
+                # With DROP_NEWEST, a full buffer discards the chunk instead of holding up the input
+                buffer.write(data, block=True)
+            logger.debug("Recording finished")
         finally:
             input_stream.close()
+            buffer.interrupt()
+
+    def _write_loop(self, buffer, output_stream, channels):
+        is_failed = False
+        try:
+            while True:
+                try:
+                    data, _ = buffer.get()
+                except queue.Empty:
+                    # The reader is done, and every buffered chunk was written
+                    break
+                if is_failed:
+                    continue
+                try:
+                    output_stream.write_decoded(data.reshape(-1, channels))
+                    self._written_chunk_count += 1
+                except Exception as err:
+                    # Stop the reader, and keep consuming until it's done, so it never waits on a full buffer
+                    logger.error(err)
+                    is_failed = True
+                    self._flag.clear()
+        finally:
             output_stream.close()
 
 
@@ -1,9 +1,14 @@
+import math
 import logging
+import threading
+import typing as T
 
 import numpy as np
 import pyaudio
 
+from pupil_audio.utils import key_property
 from pupil_audio.utils.pyaudio import PyAudioManager, HostApiInfo, DeviceInfo
+from pupil_audio.utils.ring_buffer import SampleRingBuffer
 
 from .base import Codec
 from .base import InputStreamWithCodec
@@ -39,7 +44,8 @@ class PyAudioCodec(Codec[str]):
         is ordered as [L0, R0, L1, R1, ...]
         """
         # TODO: handle data type as parameter, convert between pyaudio/numpy types
-        result = np.fromstring(data, dtype=self.dtype)
+        # A read-only view of the buffer, without copying the samples
+        result = np.frombuffer(data, dtype=self.dtype)
 
         chunk_length = len(result) / self.channels
         assert chunk_length == int(chunk_length)
@@ -53,10 +59,9 @@ class PyAudioCodec(Codec[str]):
 
         Signal should be a numpy array with shape (chunk_size, self.channels)
         """
-        interleaved = data.flatten()
-
         # TODO: handle data type as parameter, convert between pyaudio/numpy types
-        data = interleaved.astype(self.dtype).tostring()
+        # Interleaved in C order, with a single copy unless the dtype has to be converted
+        data = np.asarray(data, dtype=self.dtype).tobytes()
         return data
 
     @staticmethod
@@ -79,8 +84,21 @@ class PyAudioCodec(Codec[str]):
 
 
 class PyAudioDeviceInputStream(InputStreamWithCodec[str]):
+    """
+    Reads interleaved samples from an input device, with a PortAudio callback stream.
+
+    The callback copies every device buffer into a preallocated `SampleRingBuffer` holding up to
+    `buffer_seconds` seconds of samples, from which `read_raw` and `read_decoded` wait for and
+    read their chunks. The stream starts with the first read.
+
+    A blocking PortAudio read can't report an input overflow without closing the stream, so the
+    callback counts them instead: `input_overflow_count` counts the buffers flagged with
+    `paInputOverflow`, and the buffers that didn't fit into the ring because the reader fell
+    more than `buffer_seconds` behind. If the stream stops while a read waits for samples (e.g.
+    because the device disappeared), the read raises an `IOError` with `paDeviceUnavailable`.
+    """
 
-    def __init__(self, name, channels=None, frame_rate=None, format=None, dtype=None):
+    def __init__(self, name, channels=None, frame_rate=None, format=None, dtype=None, frames_per_buffer=1024, buffer_seconds=0.5):
         device_info = DeviceInfo.named_input(name)
         frame_rate = frame_rate or device_info.default_sample_rate
         channels = channels or device_info.max_input_channels
@@ -90,32 +108,68 @@ class PyAudioDeviceInputStream(InputStreamWithCodec[str]):
 
         self.name = name
         self.frame_rate = int(frame_rate)
-        self.session = PyAudioManager.acquire_shared_instance()
+        self.frames_per_buffer = int(frames_per_buffer)
         self._codec = PyAudioCodec(
             frame_rate=frame_rate,
             channels=channels,
             format=format,
             dtype=dtype,
         )
-        self.stream = self.session.open(
-            format=self.format,
-            channels=self.channels,
-            rate=self.frame_rate,
-            input=True,
-            input_device_index=device_info["index"],
-        )
+
+        capacity_frames = max(int(round(buffer_seconds * self.frame_rate)), 2 * self.frames_per_buffer)
+        self._ring = SampleRingBuffer(capacity_frames, channels=self.channels, dtype=self.dtype)
+        self._chunk_buffer = np.zeros((0, self.channels), dtype=self.dtype)
+
+        self._is_started = False
+        self._input_overflow_count = 0
+
+        self.session = PyAudioManager.acquire_shared_instance()
+        try:
+            self.stream = self.session.open(
+                format=self.format,
+                channels=self.channels,
+                rate=self.frame_rate,
+                input=True,
+                input_device_index=device_info["index"],
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self._stream_callback,
+                start=False,
+            )
+        except Exception:
+            # E.g. the device disappeared, or doesn't support the format
+            PyAudioManager.release_shared_instance(self.session)
+            self.session = None
+            raise
 
     @property
     def codec(self) -> Codec:
         return self._codec
 
+    @property
+    def input_overflow_count(self) -> int:
+        return self._input_overflow_count
+
     def read_raw(self, chunk_size: int) -> str:
-        if not self.stream.is_active:
+        if not self._is_started:
+            self._is_started = True
             self.stream.start_stream()
             logger.debug("PyAudioDeviceInputStream opened")
 
-        self.stream.frames_per_buffer = chunk_size
-        return self.stream.read(chunk_size, exception_on_overflow=False)
+        out = self._chunk_buffer
+        if out.shape[0] != chunk_size:
+            out = self._chunk_buffer = np.zeros((chunk_size, self.channels), dtype=self.dtype)
+
+        ring = self._ring
+        read_count = ring.read_into(out)
+        while read_count < chunk_size:
+            # Wait for the rest of the chunk, but read before the ring is full so no buffer is lost
+            has_data = ring.wait_for_data(min(chunk_size - read_count, ring.capacity_frames - self.frames_per_buffer), timeout=1.)
+            if not has_data and not self.stream.is_active():
+                # The callback stopped (e.g. the device disappeared), so the ring never fills
+                raise IOError("Device unavailable", pyaudio.paDeviceUnavailable)
+            read_count += ring.read_into(out[read_count:])
+
+        return out.tobytes()
 
     def close(self):
         if self.stream is not None:
@@ -125,7 +179,7 @@ class PyAudioDeviceInputStream(InputStreamWithCodec[str]):
             logger.debug("PyAudioDeviceInputStream closed")
         if self.session is not None:
             PyAudioManager.release_shared_instance(self.session)
-            self.stream = None
+            self.session = None
 
     @property
     def format(self) -> int:
@@ -135,10 +189,13 @@ class PyAudioDeviceInputStream(InputStreamWithCodec[str]):
     def channels(self) -> int:
         return self._codec.channels
 
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self._codec.dtype)
+
     @property
     def sample_width(self):
-        with PyAudioManager.shared_instance() as session:
-            return session.get_sample_size(self.format)
+        return pyaudio.get_sample_size(self.format)
 
     @staticmethod
     def enumerate_devices():
@@ -148,11 +205,176 @@ class PyAudioDeviceInputStream(InputStreamWithCodec[str]):
     def default_device():
         return DeviceInfo.default_input()
 
+    # Private
+
+    def _stream_callback(self, in_data, frame_count, time_info, status):
+        if status & pyaudio.paInputOverflow:
+            self._input_overflow_count += 1
+        if self._ring.write(in_data) < frame_count:
+            # The reader fell behind, so the rest of the buffer is lost like in a host overflow
+            self._input_overflow_count += 1
+        return (None, pyaudio.paContinue)
+
+
+class OutputStreamStats(dict):
+    """
+    Snapshot of the playback counters of a `PyAudioDeviceOutputStream`.
+    """
+    underrun_count          = key_property("underrun_count",          type=int,   readonly=True, default=0)
+    underrun_frames         = key_property("underrun_frames",         type=int,   readonly=True, default=0)
+    host_underflow_count    = key_property("host_underflow_count",    type=int,   readonly=True, default=0)
+    callback_count          = key_property("callback_count",          type=int,   readonly=True, default=0)
+    buffered_frames         = key_property("buffered_frames",         type=int,   readonly=True, default=0)
+    output_latency          = key_property("output_latency",          type=float, readonly=True, default=math.nan)
+    total_latency           = key_property("total_latency",           type=float, readonly=True, default=math.nan)
+
 
 class PyAudioDeviceOutputStream(OutputStreamWithCodec[str]):
+    """
+    Plays interleaved samples on an output device, with a PortAudio callback stream.
+
+    Written samples are copied into a preallocated `SampleRingBuffer`, from which the callback
+    fills every device buffer. The ring holds up to `target_latency` seconds of samples, so
+    `write_raw` and `write_decoded` block while it's full, which paces the writer to the device.
+    The stream starts once `prefill` seconds (by default `target_latency`) are buffered.
+
+    If the ring runs dry, the callback plays silence for the missing frames and counts an
+    underrun. If the stream stops while a write waits for space (e.g. because the device
+    disappeared), the write raises an `IOError` with `paDeviceUnavailable`.
+
+    `stats()` reports the underruns, and the output latency measured from the
+    `output_buffer_dac_time` of the callbacks: `output_latency` is the time between a callback
+    and its first frame reaching the DAC, and `total_latency` adds the frames buffered in the ring.
+
+    The device is opened through `PyAudioManager`, so the stream runs against any backend the
+    manager provides.
+    """
+
+    def __init__(self, name=None, channels=None, frame_rate=None, format=None, dtype=None, frames_per_buffer=256, target_latency=0.05, prefill=None):
+        device_info = DeviceInfo.named_output(name) if name is not None else DeviceInfo.default_output()
+        assert device_info is not None, "No output device available"
+
+        frame_rate = frame_rate or device_info.default_sample_rate
+        channels = channels or device_info.max_output_channels
+
+        assert frame_rate
+        assert channels
+
+        self.name = device_info.name
+        self.frame_rate = int(frame_rate)
+        self.frames_per_buffer = int(frames_per_buffer)
+        self._codec = PyAudioCodec(
+            frame_rate=frame_rate,
+            channels=channels,
+            format=format,
+            dtype=dtype,
+        )
 
-    def __init__(self):
-        raise NotImplementedError  # TODO: Implement
+        target_frames = max(int(round(target_latency * self.frame_rate)), self.frames_per_buffer)
+        prefill_frames = target_frames if prefill is None else int(round(prefill * self.frame_rate))
+        self._prefill_frames = min(max(prefill_frames, 0), target_frames)
+        self._ring = SampleRingBuffer(target_frames, channels=self.channels, dtype=self.dtype)
+
+        # Filled by the callback, and handed to PortAudio without converting it to bytes
+        self._callback_buffer = np.zeros((self.frames_per_buffer, self.channels), dtype=self.dtype)
+        self._silence = _silence_value(self.dtype)
+
+        self._is_started = False
+        self._is_draining = False
+        self._drained = threading.Event()
+        self._underrun_count = 0
+        self._underrun_frames = 0
+        self._host_underflow_count = 0
+        self._callback_count = 0
+        self._output_latency = math.nan
+
+        self.session = PyAudioManager.acquire_shared_instance()
+        try:
+            self.stream = self.session.open(
+                format=self.format,
+                channels=self.channels,
+                rate=self.frame_rate,
+                output=True,
+                output_device_index=device_info.index,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self._stream_callback,
+                start=False,
+            )
+        except Exception:
+            # E.g. the device disappeared, or doesn't support the format
+            PyAudioManager.release_shared_instance(self.session)
+            self.session = None
+            raise
+
+    @property
+    def codec(self) -> Codec:
+        return self._codec
+
+    @property
+    def format(self) -> int:
+        return self._codec.format
+
+    @property
+    def channels(self) -> int:
+        return self._codec.channels
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self._codec.dtype)
+
+    @property
+    def sample_width(self):
+        return pyaudio.get_sample_size(self.format)
+
+    @property
+    def is_started(self) -> bool:
+        return self._is_started
+
+    def stats(self) -> OutputStreamStats:
+        buffered_frames = self._ring.available_frames
+        output_latency = self._output_latency
+        return OutputStreamStats(
+            underrun_count=self._underrun_count,
+            underrun_frames=self._underrun_frames,
+            host_underflow_count=self._host_underflow_count,
+            callback_count=self._callback_count,
+            buffered_frames=buffered_frames,
+            output_latency=output_latency,
+            total_latency=output_latency + buffered_frames / self.frame_rate,
+        )
+
+    def write_raw(self, data: str):
+        self._write_frames(np.frombuffer(data, dtype=self.dtype).reshape(-1, self.channels))
+
+    def write_decoded(self, data: np.ndarray):
+        """
+        Play the samples of a 2D numpy array with shape (chunk_size, channels), without converting them to bytes.
+        """
+        data = np.asarray(data)
+        assert data.ndim == 2 and data.shape[1] == self.channels
+        if data.dtype != self.dtype:
+            data = data.astype(self.dtype)
+        self._write_frames(data)
+
+    def close(self, drain: bool = True):
+        """
+        Stop playback, after the buffered frames were played if `drain` is set.
+        """
+        if self.stream is not None:
+            if drain and self._ring.available_frames > 0:
+                self._is_draining = True
+                self._drained.clear()
+                if not self._is_started:
+                    self._start()
+                # Allow for the device latency on top of the buffered frames
+                self._drained.wait(self._ring.available_frames / self.frame_rate + 1.)
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+            logger.debug("PyAudioDeviceOutputStream closed")
+        if self.session is not None:
+            PyAudioManager.release_shared_instance(self.session)
+            self.session = None
 
     @staticmethod
     def enumerate_devices():
@@ -161,3 +383,59 @@ class PyAudioDeviceOutputStream(OutputStreamWithCodec[str]):
     @staticmethod
     def default_device():
         return DeviceInfo.default_output()
+
+    # Private
+
+    def _write_frames(self, frames: np.ndarray):
+        ring = self._ring
+        written = 0
+        while written < frames.shape[0]:
+            written += ring.write(frames[written:])
+            if not self._is_started and ring.available_frames >= self._prefill_frames:
+                self._start()
+            if written < frames.shape[0]:
+                # Wait for the callback to play a device buffer, or all that's left to write
+                has_space = ring.wait_for_space(min(frames.shape[0] - written, self.frames_per_buffer), timeout=1.)
+                if not has_space and not self.stream.is_active():
+                    # The callback stopped (e.g. the device disappeared), so the ring never drains
+                    raise IOError("Device unavailable", pyaudio.paDeviceUnavailable)
+
+    def _start(self):
+        self._is_started = True
+        self.stream.start_stream()
+        logger.debug("PyAudioDeviceOutputStream started")
+
+    def _stream_callback(self, in_data, frame_count, time_info, status):
+        self._callback_count += 1
+
+        out = self._callback_buffer
+        if out.shape[0] < frame_count:
+            out = self._callback_buffer = np.zeros((frame_count, self.channels), dtype=self.dtype)
+        out = out[:frame_count]
+
+        read_count = self._ring.read_into(out)
+        if read_count < frame_count:
+            out[read_count:] = self._silence
+            if self._is_draining:
+                if self._ring.available_frames == 0:
+                    self._drained.set()
+            else:
+                self._underrun_count += 1
+                self._underrun_frames += frame_count - read_count
+
+        if status & pyaudio.paOutputUnderflow:
+            self._host_underflow_count += 1
+
+        dac_time = time_info.get("output_buffer_dac_time", 0.)
+        current_time = time_info.get("current_time", 0.)
+        if dac_time > 0 and current_time > 0:
+            self._output_latency = dac_time - current_time
+
+        # PyAudio copies any C-contiguous buffer into the PortAudio buffer, so the array is returned
+        # as is; unlike a `memoryview` or a `bytearray`, PyAudio accepts a numpy array as bytes
+        return (out, pyaudio.paContinue)
+
+
+def _silence_value(dtype: np.dtype):
+    # Unsigned 8 bit samples are centered on 128
+    return 128 if dtype.kind == "u" else 0
@@ -1,10 +1,13 @@
 import logging
 import platform
 import contextlib
+import typing as T
 
 import numpy as np
 import av
 
+from pupil_audio.utils.pyav import EncoderProfile
+
 from .base import Codec
 from .base import InputStreamWithCodec
 from .base import OutputStreamWithCodec
@@ -28,8 +31,32 @@ class PyAVCodec(Codec[av.AudioFrame]):
         self.format = format
         self.dtype = dtype
 
-    def decode(self, data: av.AudioFrame) -> np.ndarray:
-        raise NotImplementedError
+    def decode(self, data: av.AudioFrame, out: np.ndarray = None) -> np.ndarray:
+        """
+        Convert a frame into a 2D numpy array with shape (samples, channels)
+
+        Planar frames are interleaved one channel at a time, straight from the memory of the
+        frame planes. If `out` is given, the samples are written into it instead of into a
+        new array, and a view of its first `samples` rows is returned.
+        """
+        dtype = self._dtype_from_format(data.format.name)
+        if dtype != self.dtype:
+            raise ValueError(f"Expected a frame with {self.dtype} samples, got {data.format.name}")
+
+        samples = data.samples
+        if out is None:
+            out = np.empty((samples, self.channels), dtype=dtype)
+        else:
+            out = out[:samples]
+
+        if data.format.is_planar:
+            for i, plane in enumerate(data.planes[:self.channels]):
+                # Planes might be padded, so only the first `samples` samples are read
+                out[:, i] = np.frombuffer(plane, dtype=dtype, count=samples)
+        else:
+            out[:] = np.frombuffer(data.planes[0], dtype=dtype, count=samples * self.channels).reshape(samples, self.channels)
+
+        return out
 
     def encode(self, data: np.ndarray) -> av.AudioFrame:
 
@@ -55,17 +82,18 @@ class PyAVCodec(Codec[av.AudioFrame]):
 
     @staticmethod
     def _dtype_from_format(format):
-        if format == "s16p":
-            return np.dtype('int16')
-        else:
+        try:
+            return np.dtype(PyAVCodec._format_dtypes[format])
+        except KeyError:
             raise NotImplementedError()
 
     @staticmethod
-    def _format_from_dtype(dtype):
-        if dtype == np.dtype('int16'):
-            return 's16p'
-        else:
-            raise NotImplementedError()
+    def _format_from_dtype(dtype, planar=True):
+        dtype = np.dtype(dtype)
+        for format, format_dtype in PyAVCodec._format_dtypes.items():
+            if np.dtype(format_dtype) == dtype and av.AudioFormat(format).is_planar == planar:
+                return format
+        raise NotImplementedError()
 
     # https://github.com/mikeboers/PyAV/blob/master/av/audio/frame.pyx
     _format_dtypes = {
@@ -121,22 +149,199 @@ class PyAVCodec(Codec[av.AudioFrame]):
             samples = array.shape[1] // nb_channels
 
         frame = av.AudioFrame(format=format, layout=layout, samples=samples)
-        for i, plane in enumerate(frame.planes):
-            plane.update(array[i, :])
+        # PyAV might report more planes than there are channels, so only the planes of the array rows are written
+        planes = frame.planes
+        for i in range(array.shape[0]):
+            planes[i].update(array[i, :])
         return frame
 
 
 class PyAVFileInputStream(InputStreamWithCodec[av.AudioFrame]):
+    """
+    Decodes an audio stream of any container into fixed-size chunks.
+
+    The decoded frames are converted to `dtype`, `channels` and `frame_rate` (by default, those
+    of the stream) only if they differ, and accumulated in an audio FIFO, from which chunks of
+    exactly `chunk_size` samples are read; only the last chunk is shorter. The FIFO never holds
+    more than one chunk and one decoded frame, so memory use doesn't depend on the file length.
+
+    `read_decoded` returns `(chunk_size, channels)` arrays that are views of a buffer reused by
+    every call, so they are only valid until the next read; copy them to keep them longer.
+    """
+
+    def __init__(self, path, dtype:np.dtype=None, channels:int=None, frame_rate=None, stream_index:int=0):
+        self.path = path
+        self.container = av.open(str(path), "r")
+        self.stream = self.container.streams.audio[stream_index]
+
+        codec_context = self.stream.codec_context
+        native_format = codec_context.format.name if codec_context.format is not None else "flt"
+        native_dtype = PyAVCodec._dtype_from_format(native_format)
+
+        dtype = np.dtype(dtype or native_dtype)
+        channels = int(channels or codec_context.channels)
+        frame_rate = int(frame_rate or codec_context.sample_rate)
+
+        # Frames are only resampled if they don't already match; interleaved frames are cheaper to decode
+        self._frame_format = native_format if dtype == native_dtype else PyAVCodec._format_from_dtype(dtype, planar=False)
+        self._frame_layout = PyAVCodec._channel_layout_names.get(channels) or codec_context.layout.name
+        self._codec = PyAVCodec(
+            channels=channels,
+            frame_rate=frame_rate,
+            dtype=dtype,
+        )
+        self._out = None
+        self._reset_decoder()
+        # Index of the next sample read, counted from time 0 of the stream; known once the first frame is decoded
+        self._position = None
+        self._skip_until = None
+
+    @property
+    def codec(self) -> Codec:
+        return self._codec
+
+    @property
+    def channels(self) -> int:
+        return self._codec.channels
+
+    @property
+    def frame_rate(self) -> int:
+        return self._codec.frame_rate
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._codec.dtype
+
+    @property
+    def duration(self) -> T.Optional[float]:
+        if self.stream.duration is not None:
+            return float(self.stream.duration * self.stream.time_base)
+        if self.container.duration is not None:
+            return self.container.duration / av.time_base
+        return None
+
+    def tell(self) -> float:
+        """
+        Time of the next sample read, in seconds.
+        """
+        return (self._position or 0) / self.frame_rate
+
+    def seek(self, seconds: float):
+        """
+        Continue reading from the sample at `seconds`.
+
+        The container seeks to the closest keyframe before that time, and the samples decoded
+        before it are dropped, so the position is sample-accurate.
+        """
+        seconds = max(0., float(seconds))
+        self.container.seek(int(seconds / self.stream.time_base), stream=self.stream, backward=True)
+        self._reset_decoder()
+        self._position = self._skip_until = int(round(seconds * self.frame_rate))
+
+    def read_raw(self, chunk_size: int) -> T.Optional[av.AudioFrame]:
+        """
+        Return the next `chunk_size` samples as a frame, or `None` at the end of the stream.
+        """
+        fifo = self._fifo
+        while fifo.samples < chunk_size and not self._is_exhausted:
+            self._decode_next_frame()
+
+        if fifo.samples == 0:
+            return None
+
+        frame = fifo.read(min(chunk_size, fifo.samples))
+        self._position += frame.samples
+        return frame
+
+    def read_decoded(self, chunk_size: int) -> np.ndarray:
+        frame = self.read_raw(chunk_size)
+        if self._out is None or self._out.shape[0] < chunk_size:
+            self._out = np.empty((chunk_size, self.channels), dtype=self.dtype)
+        if frame is None:
+            return self._out[:0]
+        return self._codec.decode(frame, out=self._out)
+
+    def iter_blocks(self, block_size: int) -> T.Iterator[np.ndarray]:
+        """
+        Iterate over `(block_size, channels)` arrays until the end of the stream; see `read_decoded`.
+        """
+        while True:
+            block = self.read_decoded(block_size)
+            if block.shape[0] == 0:
+                return
+            yield block
+
+    def close(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+            self.stream = None
+            self._frames = None
+            logger.debug(f"Closed stream: {self.path}")
+
+    def _reset_decoder(self):
+        self._frames = self.container.decode(self.stream)
+        self._resampler = None
+        self._fifo = av.AudioFifo()
+        self._is_exhausted = False
+
+    def _decode_next_frame(self):
+        try:
+            frame = next(self._frames)
+        except StopIteration:
+            # Flush the samples still buffered by the resampler
+            self._is_exhausted = True
+            frame = None
+            if self._resampler is None:
+                return
+
+        if frame is not None and self._matches_output(frame):
+            frames = [frame]
+        else:
+            if self._resampler is None:
+                self._resampler = av.AudioResampler(format=self._frame_format, layout=self._frame_layout, rate=self.frame_rate)
+            frames = self._resampler.resample(frame)
+
+        for frame in frames:
+            self._write_to_fifo(frame)
+
+    def _matches_output(self, frame: av.AudioFrame) -> bool:
+        return (
+            frame.format.name == self._frame_format
+            and frame.layout.name == self._frame_layout
+            and frame.sample_rate == self.frame_rate
+            and self._resampler is None
+        )
 
-    def __init__(self):
-        raise NotImplementedError  # TODO: Implement
+    def _write_to_fifo(self, frame: av.AudioFrame):
+        frame_start = int(round(frame.time * self.frame_rate)) if frame.time is not None else self._position
+        if self._position is None:
+            self._position = frame_start or 0
+
+        skipped_samples = 0
+        if self._skip_until is not None and frame_start is not None:
+            # Drop the samples decoded from the keyframe before the seek target
+            skipped_samples = self._skip_until - frame_start
+            if skipped_samples >= frame.samples:
+                return
+            self._skip_until = None
+            if skipped_samples < 0:
+                # The stream has a gap at the seek target
+                self._position = frame_start
+
+        # The FIFO checks that the pts are contiguous, which doesn't hold across seeks
+        frame.pts = None
+        self._fifo.write(frame)
+        if skipped_samples > 0:
+            self._fifo.read(skipped_samples)
 
 
 class PyAVFileOutputStream(OutputStreamWithCodec[av.AudioFrame]):
 
-    def __init__(self, path, channels:int, frame_rate, format:str=None, dtype:np.dtype=None):
+    def __init__(self, path, channels:int, frame_rate, format:str=None, dtype:np.dtype=None, encoder_profile:EncoderProfile=None):
         self.path = path
         self.frame_rate = frame_rate
+        self.encoder_profile = encoder_profile or EncoderProfile.aac()
         self.container = None
         self.stream = None
         self._codec = PyAVCodec(
@@ -152,8 +357,8 @@ class PyAVFileOutputStream(OutputStreamWithCodec[av.AudioFrame]):
 
     def write_raw(self, data: av.AudioFrame):
         if self.container is None:
-            self.container = av.open(self.path, 'w')
-            self.stream = self.container.add_stream('aac', rate=self.frame_rate)
+            self.container = self.encoder_profile.open_container(self.path)
+            self.stream = self.encoder_profile.add_stream(self.container, self.frame_rate, data.layout.name)
             logger.debug(f"Opened stream: {self.path}")
 
         data.pts = None
@@ -1,8 +1,12 @@
+import mmap
 import wave
 import logging
+import typing as T
 
 import numpy as np
 
+from pupil_audio.utils.wav import read_wav_info
+
 from .base import Codec
 from .base import InputStreamWithCodec
 from .base import OutputStreamWithCodec
@@ -14,13 +18,128 @@ logger = logging.getLogger(__name__)
 
 
 class WaveCodec(PyAudioCodec):
-    pass
+
+    @staticmethod
+    def _format_from_dtype(dtype):
+        # WAV files can hold samples that PyAudio has no format for
+        try:
+            return PyAudioCodec._format_from_dtype(dtype)
+        except NotImplementedError:
+            return None
 
 
 class WaveFileInputStream(InputStreamWithCodec[str]):
+    """
+    Reads a PCM WAV file through a read-only memory map of the whole file.
+
+    `read_decoded` returns `(chunk_size, channels)` views into the mapping, so reading doesn't
+    copy or allocate any samples; the views are read-only, and stay valid after `close`.
+    Reads continue from the current position, which can be changed with `seek`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        info = read_wav_info(path)
+        self.frame_rate = info.frame_rate
+        self.frame_count = info.frame_count
+        self._codec = WaveCodec(
+            frame_rate=info.frame_rate,
+            channels=info.channels,
+            dtype=info.dtype,
+        )
+        self._position = 0
+
+        with open(path, "rb") as file:
+            # The mapping keeps its own handle of the file
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._samples = np.frombuffer(
+            self._mmap,
+            dtype=info.dtype,
+            count=self.frame_count * info.channels,
+            offset=info.data_offset,
+        ).reshape(self.frame_count, info.channels)
+        self._data_offset = info.data_offset
+        self._block_align = info.block_align
+        logger.debug("WaveFileInputStream opened")
+
+    @property
+    def codec(self) -> Codec:
+        return self._codec
+
+    @property
+    def channels(self) -> int:
+        return self._codec.channels
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._codec.dtype
 
-    def __init__(self):
-        raise NotImplementedError  # TODO: Implement
+    @property
+    def sample_width(self) -> int:
+        return self._codec.dtype.itemsize
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.frame_rate
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, frame_index: int, whence: int = 0) -> int:
+        """
+        Move the read position to `frame_index`, relative to the start (`whence=0`), the
+        current position (`whence=1`) or the end of the file (`whence=2`), like `io.IOBase.seek`.
+
+        The position is clipped to the samples of the file; returns the new position.
+        """
+        origin = (0, self._position, self.frame_count)[whence]
+        self._position = min(max(origin + int(frame_index), 0), self.frame_count)
+        return self._position
+
+    def read_raw(self, chunk_size: int) -> memoryview:
+        """
+        Return the next `chunk_size` frames as a read-only view of the interleaved bytes in the file.
+        """
+        start, end = self._advance(chunk_size)
+        offset = self._data_offset
+        return memoryview(self._mmap)[offset + start * self._block_align:offset + end * self._block_align]
+
+    def read_decoded(self, chunk_size: int) -> np.ndarray:
+        """
+        Return the next `chunk_size` frames as a `(chunk_size, channels)` view; shorter at the end of the file.
+        """
+        start, end = self._advance(chunk_size)
+        return self._samples[start:end]
+
+    def iter_blocks(self, block_size: int, start: int = None) -> T.Iterator[np.ndarray]:
+        """
+        Iterate over `(block_size, channels)` views from `start` (or the current position) to the end of the file.
+
+        The last block is shorter, unless the remaining frames fill a whole block.
+        """
+        if start is not None:
+            self.seek(start)
+        while self._position < self.frame_count:
+            yield self.read_decoded(block_size)
+
+    def close(self):
+        if self._mmap is None:
+            return
+        self._samples = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views returned by read_decoded are still in use; the mapping is released along with the last one
+            pass
+        self._mmap = None
+        logger.debug("WaveFileInputStream closed")
+
+    def _advance(self, chunk_size: int) -> T.Tuple[int, int]:
+        start = self._position
+        end = min(start + int(chunk_size), self.frame_count)
+        self._position = end
+        return start, end
 
 
 class WaveFileOutputStream(OutputStreamWithCodec[str]):
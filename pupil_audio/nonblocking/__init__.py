@@ -1,3 +1,6 @@
 from .pyav import PyAVFileSink, PyAVMultipartFileSink
-from .pyaudio import PyAudioDeviceSource, PyAudioDelayedDeviceSource, PyAudioDeviceMonitor, PyAudioBackgroundDeviceMonitor
+from .wav import WavMmapFileSink, WavMmapMultipartFileSink
+from .pyaudio import DeviceChanges, SourceStats, PyAudioDeviceSource, PyAudioDelayedDeviceSource, PyAudioDeviceMonitor, PyAudioBackgroundDeviceMonitor
 from .pyaudio2pyav import PyAudio2PyAVCapture, PyAudio2PyAVTranscoder
+from .multi_device import MultiDeviceCapture
+from .process import PyAudio2PyAVProcessCapture
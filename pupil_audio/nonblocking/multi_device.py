@@ -0,0 +1,444 @@
+import os
+import time
+import queue
+import logging
+import threading
+import typing as T
+from pathlib import Path
+
+from pupil_audio.utils import key_property
+from pupil_audio.utils.pyaudio import DeviceInfo, TimeInfo
+
+from .pyaudio import PyAudioDeviceSource, SourceStats
+from .pyaudio2pyav import PyAudio2PyAVTranscoder
+from .pyav import PyAVFileSink
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceCaptureStats(dict):
+    """
+    Statistics of a single device of a `MultiDeviceCapture`.
+
+    The dropout and overflow counts are those of the `SourceStats` of the device.
+    """
+    name                 = key_property("name",                 type=str,   readonly=True)
+    buffer_count         = key_property("buffer_count",         type=int,   readonly=True, default=0)
+    dropout_count        = key_property("dropout_count",        type=int,   readonly=True, default=0)
+    dropped_frames       = key_property("dropped_frames",       type=int,   readonly=True, default=0)
+    input_overflow_count = key_property("input_overflow_count", type=int,   readonly=True, default=0)
+    backlog              = key_property("backlog",              type=int,   readonly=True, default=0)
+    start_offset         = key_property("start_offset",         type=float, readonly=True, default=None)
+
+
+class MultiDeviceCapture:
+    """
+    Records several input devices at once, each into its own file.
+
+    Every device gets its own source, transcoder and sink, but instead of one encoding thread
+    per sink, the sinks are driven by a shared pool of at most `max_workers` encoder threads.
+    A device is only handed to a worker when its source delivered new buffers, and at most one
+    worker encodes a given device at a time.
+
+    All outputs share a recording clock: the earliest of the ADC times of the first buffers of
+    the devices is the common start reference, and the stream of every device starts at the
+    presentation timestamp that corresponds to its own first buffer relative to that reference.
+    Since the reference is only known once every device captured its first buffer, the encoding
+    waits for them, but at most `reference_timeout` seconds after the first one (the leading
+    frames of a device whose first buffer is older than a reference fixed by the timeout are
+    trimmed).
+    """
+
+    @staticmethod
+    def available_input_devices():
+        return sorted(DeviceInfo.inputs_by_name().keys())
+
+    def __init__(
+        self,
+        in_names: T.List[str],
+        out_dir: str,
+        frame_rate=None,
+        channels=None,
+        dtype=None,
+        source_cls=None,
+        transcoder_cls=None,
+        sink_cls=None,
+        frames_per_buffer=1024,
+        max_workers=None,
+        ext="mp4",
+        encoder_profile=None,
+        stats_sidecar=False,
+        reference_timeout=1.,
+    ):
+        assert len(in_names) > 0
+        assert len(set(in_names)) == len(in_names), "Device names must be unique"
+
+        self.source_cls = source_cls or PyAudioDeviceSource
+        assert issubclass(self.source_cls, PyAudioDeviceSource)
+
+        self.transcoder_cls = transcoder_cls or PyAudio2PyAVTranscoder
+        assert issubclass(self.transcoder_cls, PyAudio2PyAVTranscoder)
+
+        self.sink_cls = sink_cls or PyAVFileSink
+        assert issubclass(self.sink_cls, PyAVFileSink)
+
+        self.max_workers = int(max_workers or min(len(in_names), os.cpu_count() or 1))
+        assert self.max_workers > 0
+
+        self._clock = _RecordingClock(device_count=len(in_names), timeout=reference_timeout, on_fixed=self._schedule_pending)
+        self._ready_queue = queue.Queue()
+        self._workers = []
+        self._is_running = False
+
+        self._devices = []
+        for in_name in in_names:
+            device = DeviceInfo.named_input(in_name)
+
+            transcoder = self.transcoder_cls(
+                frame_rate=int(frame_rate or device.default_sample_rate),
+                channels=int(channels or device.max_input_channels),
+                dtype=dtype,
+            )
+
+            job = _EncoderJob(name=in_name, transcoder=transcoder, clock=self._clock, ready_queue=self._ready_queue)
+
+            file_path = Path(out_dir) / f"{_file_stem(in_name)}.{ext}"
+
+            job.sink = self.sink_cls(
+                file_path=str(file_path),
+                transcoder=transcoder,
+                in_queue=job.queue,
+                encoder_profile=encoder_profile,
+            )
+
+            job.source = self.source_cls(
+                device_index=device.index,
+                frame_rate=transcoder.frame_rate,
+                channels=transcoder.channels,
+                format=transcoder.pyaudio_format,
+                out_queue=job.queue,
+                frames_per_buffer=frames_per_buffer,
+                stats_path=SourceStats.sidecar_path(file_path) if stats_sidecar else None,
+            )
+
+            self._devices.append(job)
+
+    @property
+    def is_running(self) -> bool:
+        return self._is_running
+
+    @property
+    def recording_start_time(self) -> T.Optional[float]:
+        """
+        Earliest ADC time of the first buffers of the devices, which all outputs use as their start reference.
+
+        `None` until it's fixed, once every device captured its first buffer (or the `reference_timeout` passed).
+        """
+        return self._clock.reference_time
+
+    def stats(self) -> T.List[DeviceCaptureStats]:
+        return [job.stats() for job in self._devices]
+
+    def start(self):
+        if self._is_running:
+            return
+        self._is_running = True
+        self._clock.reset()
+
+        for job in self._devices:
+            job.open()
+
+        self._workers = [
+            threading.Thread(
+                name=f"{type(self).__name__}-encoder-{i}",
+                target=self._encoder_loop,
+                args=(self._ready_queue,),
+                daemon=True,
+            )
+            for i in range(self.max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        for job in self._devices:
+            job.transcoder.start()
+            job.source.start()
+
+    def stop(self):
+        if not self._is_running:
+            return
+        self._is_running = False
+
+        for job in self._devices:
+            job.source.stop()
+            job.transcoder.stop()
+
+        # Devices that didn't deliver any buffer don't hold up the others
+        self._clock.fix()
+
+        # The buffers left in the queues are encoded before the outputs are closed
+        for job in self._devices:
+            job.request_close()
+        for job in self._devices:
+            job.wait_closed()
+
+        for _ in self._workers:
+            self._ready_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def cleanup(self):
+        self.stop()
+        for job in self._devices:
+            job.source.cleanup()
+
+    # Private
+
+    def _schedule_pending(self):
+        # The buffers captured while the reference wasn't fixed yet can be encoded now
+        for job in self._devices:
+            if not job.queue.empty():
+                job.schedule()
+
+    @staticmethod
+    def _encoder_loop(ready_queue):
+        while True:
+            job = ready_queue.get()
+            if job is None:
+                break
+            job.process()
+
+
+class _RecordingClock:
+    """
+    Start reference shared by the outputs of a `MultiDeviceCapture`.
+
+    Every device reports the ADC time of its first buffer when it's captured. The reference is the
+    earliest of them, and is fixed once all `device_count` devices reported, or `timeout` seconds
+    after the first report; `on_fixed` is then called on the thread of the report that fixed it.
+    """
+
+    def __init__(self, device_count: int, timeout: float, on_fixed: T.Callable[[], None], time_fn=time.monotonic):
+        self._lock = threading.Lock()
+        self._device_count = device_count
+        self._timeout = timeout
+        self._on_fixed = on_fixed
+        self._time_fn = time_fn
+        self._first_times = []
+        self._deadline = None
+        self.reference_time = None
+
+    def reset(self):
+        with self._lock:
+            self._first_times = []
+            self._deadline = None
+            self.reference_time = None
+
+    def report(self, first_time: T.Optional[float] = None):
+        """
+        Report the ADC time of the first buffer of a device, or only check the timeout if `first_time` is `None`.
+        """
+        if self.reference_time is not None:
+            return
+        with self._lock:
+            if self.reference_time is not None:
+                return
+            if first_time is not None:
+                self._first_times.append(first_time)
+                if self._deadline is None:
+                    self._deadline = self._time_fn() + self._timeout
+            if len(self._first_times) < self._device_count and (self._deadline is None or self._time_fn() < self._deadline):
+                return
+            self.reference_time = min(self._first_times)
+        self._on_fixed()
+
+    def fix(self):
+        """
+        Fix the reference with the first times reported so far, e.g. when the capture stops.
+        """
+        with self._lock:
+            if self.reference_time is None and self._first_times:
+                self.reference_time = min(self._first_times)
+
+    def offset(self, first_time: float) -> float:
+        """
+        Seconds between the common start reference and `first_time`.
+        """
+        assert self.reference_time is not None, "The start reference isn't fixed yet"
+        return first_time - self.reference_time
+
+
+class _SchedulingQueue:
+    """
+    Queue of a single device, which calls `on_put` with every item put, e.g. to schedule the device on the encoder pool.
+    """
+
+    def __init__(self, on_put: T.Callable[[T.Any], None]):
+        self._queue = queue.Queue()
+        self._on_put = on_put
+
+    def put(self, item, block=True, timeout=None):
+        self._queue.put(item, block=block, timeout=timeout)
+        self._on_put(item)
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block=block, timeout=timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def clear(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class _EncoderJob:
+    """
+    Encoding state of a single device, processed by whichever encoder thread picks it up.
+    """
+
+    # Maximum number of buffers encoded before the device yields the worker to other devices
+    BATCH_SIZE = 8
+
+    def __init__(self, name, transcoder, clock, ready_queue):
+        self.name = name
+        self.transcoder = transcoder
+        self.queue = _SchedulingQueue(on_put=self._on_put)
+        self.sink = None
+        self.source = None
+
+        self._clock = clock
+        self._ready_queue = ready_queue
+        self._lock = threading.Lock()
+        self._is_scheduled = False
+        self._is_closing = False
+        self._closed = threading.Event()
+        self._closed.set()
+
+        self._has_reported_first_time = False
+        self._buffer_count = 0
+        self._start_offset = None
+
+    def stats(self) -> DeviceCaptureStats:
+        # The source detects the dropouts of every buffer as it's captured
+        source_stats = self.source.stats() if self.source is not None else SourceStats()
+        return DeviceCaptureStats(
+            name=self.name,
+            buffer_count=self._buffer_count,
+            dropout_count=source_stats.dropout_count,
+            dropped_frames=source_stats.dropped_frames,
+            input_overflow_count=source_stats.input_overflow_count,
+            backlog=self.queue.qsize(),
+            start_offset=self._start_offset,
+        )
+
+    def open(self):
+        self._closed.clear()
+        self._is_scheduled = False
+        self._is_closing = False
+        self._has_reported_first_time = False
+        self._buffer_count = 0
+        self._start_offset = None
+        # Buffers left over from a previous recording would be written with stale timestamps
+        self.queue.clear()
+        self.transcoder.reset()
+        self.sink.open_output()
+
+    def schedule(self):
+        with self._lock:
+            if self._is_scheduled:
+                return
+            self._is_scheduled = True
+        self._ready_queue.put(self)
+
+    def _on_put(self, item):
+        # Called by the source for every buffer, right after it was captured
+        if not self._has_reported_first_time:
+            self._has_reported_first_time = True
+            _, time_info = item
+            self._clock.report(time_info.input_buffer_adc_time)
+        elif self._clock.reference_time is None:
+            self._clock.report()
+        # Until the reference is fixed, the buffers wait in the queue
+        if self._clock.reference_time is not None:
+            self.schedule()
+
+    def request_close(self):
+        with self._lock:
+            self._is_closing = True
+            if self._is_scheduled:
+                return
+            self._is_scheduled = True
+        self._ready_queue.put(self)
+
+    def wait_closed(self):
+        self._closed.wait()
+
+    def process(self):
+        for _ in range(self.BATCH_SIZE):
+            try:
+                in_frame, time_info = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self._write(in_frame, time_info)
+            except Exception as err:
+                logger.error(err)
+
+        with self._lock:
+            if not self.queue.empty():
+                # Back of the line, so that other devices get a turn
+                self._ready_queue.put(self)
+                return
+            if not self._is_closing:
+                self._is_scheduled = False
+                return
+            # The device stays scheduled while it's closed, so no other worker picks it up
+
+        try:
+            self.sink.close_output()
+        except Exception as err:
+            logger.error(err)
+        finally:
+            self._closed.set()
+
+    def _write(self, in_frame, time_info: TimeInfo):
+        frame_rate = self.transcoder.frame_rate
+        bytes_per_frame = self.transcoder.channels * self.transcoder.dtype.itemsize
+        adc_time = time_info.input_buffer_adc_time
+
+        if self._start_offset is None:
+            offset = self._clock.offset(adc_time)
+            if offset < 0:
+                # The buffer started before the common reference, so its leading frames are trimmed
+                skipped_frames = int(round(-offset * frame_rate))
+                if skipped_frames * bytes_per_frame >= len(in_frame):
+                    return
+                in_frame = in_frame[skipped_frames * bytes_per_frame:]
+                adc_time += skipped_frames / frame_rate
+                offset = 0.
+                time_info = TimeInfo(time_info, input_buffer_adc_time=adc_time)
+            self._start_offset = offset
+            self.sink.start_pts = int(round(offset * frame_rate))
+
+        self._buffer_count += 1
+
+        self.sink.write(in_frame, time_info)
+
+
+def _file_stem(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
@@ -0,0 +1,327 @@
+import time
+import signal
+import ctypes
+import logging
+import weakref
+import multiprocessing
+import typing as T
+
+import numpy as np
+
+from pupil_audio.utils import key_property
+from pupil_audio.utils.ring_buffer import OverflowPolicy
+
+from .pyaudio2pyav import PyAudio2PyAVCapture, PyAudio2PyAVTranscoder
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessCaptureStats(dict):
+    """
+    Snapshot of the status of a capture running in a child process.
+
+    `input_overflow_count`, `dropout_count` and `dropped_frames` are the counters of the
+    `SourceStats` of the capture, which the child publishes every 100 ms and after every command.
+    """
+    state                   = key_property("state",                 type=str,   readonly=True)
+    buffer_count            = key_property("buffer_count",          type=int,   readonly=True, default=0)
+    last_adc_time           = key_property("last_adc_time",         type=float, readonly=True, default=None)
+    level_peak              = key_property("level_peak",            type=float, readonly=True, default=0.)
+    level_rms               = key_property("level_rms",             type=float, readonly=True, default=0.)
+    input_overflow_count    = key_property("input_overflow_count",  type=int,   readonly=True, default=0)
+    dropout_count           = key_property("dropout_count",         type=int,   readonly=True, default=0)
+    dropped_frames          = key_property("dropped_frames",        type=int,   readonly=True, default=0)
+
+
+class PyAudio2PyAVProcessCapture:
+    """
+    Runs a `PyAudio2PyAVCapture` (source, transcoder and sink) in a child process.
+
+    The capture threads then don't compete for the GIL of the host application. The child
+    process is spawned (and the device is opened) in the constructor, so `start` and `stop`
+    only cost a round trip over the control pipe. The status, statistics and the live input
+    level are published by the child through shared memory, and can be read at any time
+    without a round trip. If the child doesn't reply to `start` or `stop` within `timeout`
+    seconds, a `TimeoutError` is raised, and its late reply is discarded.
+
+    The classes passed as `source_cls`, `transcoder_cls` and `sink_cls` must be importable
+    by the child process.
+    """
+
+    @staticmethod
+    def available_input_devices():
+        return PyAudio2PyAVCapture.available_input_devices()
+
+    def __init__(
+        self,
+        in_name: str,
+        out_path: str,
+        frame_rate=None,
+        channels=None,
+        dtype=None,
+        source_cls=None,
+        transcoder_cls=None,
+        sink_cls=None,
+        frames_per_buffer=1024,
+        buffer_seconds=None,
+        overflow_policy=OverflowPolicy.DROP_OLDEST,
+        encoder_profile=None,
+        stats_sidecar=False,
+        start_method="spawn",
+        timeout=10.,
+    ):
+        context = multiprocessing.get_context(start_method)
+
+        capture_kwargs = dict(
+            in_name=in_name,
+            out_path=out_path,
+            frame_rate=frame_rate,
+            channels=channels,
+            dtype=dtype,
+            source_cls=source_cls,
+            transcoder_cls=transcoder_cls,
+            sink_cls=sink_cls,
+            frames_per_buffer=frames_per_buffer,
+            buffer_seconds=buffer_seconds,
+            overflow_policy=overflow_policy,
+            encoder_profile=encoder_profile,
+            stats_sidecar=stats_sidecar,
+        )
+
+        self._timeout = timeout
+        # Every command is tagged with the next sequence number, and the child tags its reply with it;
+        # the reply to the construction of the capture has the number 0
+        self._sequence = 0
+        self._shared_status = context.Array(ctypes.c_double, _StatusField.COUNT, lock=False)
+        self._status = np.frombuffer(self._shared_status, dtype=np.float64)
+        self._connection, child_connection = context.Pipe()
+
+        self._process = context.Process(
+            name=type(self).__name__,
+            target=_capture_process_main,
+            args=(child_connection, self._shared_status, capture_kwargs),
+            daemon=True,
+        )
+        self._process.start()
+        child_connection.close()
+
+        # Make sure the recording is finalized if the host application exits without calling cleanup
+        self._finalizer = weakref.finalize(self, _shutdown_capture_process, self._connection, self._process, timeout)
+
+        try:
+            self._wait_for_reply()
+        except Exception:
+            self.cleanup()
+            raise
+
+    @property
+    def is_running(self) -> bool:
+        return self._status[_StatusField.STATE] == _State.RUNNING
+
+    @property
+    def level(self) -> T.Tuple[float, float]:
+        """
+        Peak and RMS level of the last captured buffer, normalized to [0, 1].
+        """
+        return float(self._status[_StatusField.LEVEL_PEAK]), float(self._status[_StatusField.LEVEL_RMS])
+
+    def stats(self) -> ProcessCaptureStats:
+        status = self._status.copy()
+        last_adc_time = status[_StatusField.LAST_ADC_TIME]
+        return ProcessCaptureStats(
+            state=_State.NAMES.get(status[_StatusField.STATE], "unknown"),
+            buffer_count=int(status[_StatusField.BUFFER_COUNT]),
+            last_adc_time=None if np.isnan(last_adc_time) else float(last_adc_time),
+            level_peak=float(status[_StatusField.LEVEL_PEAK]),
+            level_rms=float(status[_StatusField.LEVEL_RMS]),
+            input_overflow_count=int(status[_StatusField.INPUT_OVERFLOW_COUNT]),
+            dropout_count=int(status[_StatusField.DROPOUT_COUNT]),
+            dropped_frames=int(status[_StatusField.DROPPED_FRAMES]),
+        )
+
+    def start(self):
+        self._request(_Command.START)
+
+    def stop(self):
+        self._request(_Command.STOP)
+
+    def cleanup(self):
+        """
+        Stop the capture and terminate the child process.
+        """
+        self._finalizer()
+
+    # Private
+
+    def _request(self, command):
+        if not self._process.is_alive():
+            raise RuntimeError("Capture process is not running")
+        self._sequence += 1
+        self._connection.send((self._sequence, command))
+        self._wait_for_reply()
+
+    def _wait_for_reply(self):
+        deadline = time.monotonic() + self._timeout
+        while True:
+            if not self._connection.poll(max(deadline - time.monotonic(), 0.)):
+                raise TimeoutError(f"Capture process didn't reply within {self._timeout} seconds")
+            sequence, error = self._connection.recv()
+            # The late reply to a command that timed out isn't the reply to this one
+            if sequence == self._sequence:
+                break
+        if error is not None:
+            raise RuntimeError(f"Capture process failed: {error}")
+
+
+class _Command:
+    START = "start"
+    STOP = "stop"
+    CLOSE = "close"
+
+
+class _State:
+    INITIALIZING = 0.
+    STOPPED = 1.
+    RUNNING = 2.
+    CLOSED = 3.
+    FAILED = -1.
+
+    NAMES = {
+        INITIALIZING: "initializing",
+        STOPPED: "stopped",
+        RUNNING: "running",
+        CLOSED: "closed",
+        FAILED: "failed",
+    }
+
+
+class _StatusField:
+    STATE = 0
+    BUFFER_COUNT = 1
+    LAST_ADC_TIME = 2
+    LEVEL_PEAK = 3
+    LEVEL_RMS = 4
+    INPUT_OVERFLOW_COUNT = 5
+    DROPOUT_COUNT = 6
+    DROPPED_FRAMES = 7
+    COUNT = 8
+
+
+# Seconds between two updates of the source counters in the shared status, while the child waits for commands
+_STATS_INTERVAL = 0.1
+
+
+class _LevelMeteringMixin:
+    """
+    Publishes the buffer count, ADC time and input level of every transcoded buffer to the shared status.
+    """
+
+    _shared_status = None
+
+    def transcode(self, in_frame, time_info):
+        status = self._shared_status
+        samples = np.frombuffer(in_frame, dtype=self.dtype)
+
+        if samples.size > 0:
+            if self.dtype.kind == "f":
+                normalized = samples
+            elif self.dtype.kind == "u":
+                offset = 1 << (8 * self.dtype.itemsize - 1)
+                normalized = (samples.astype(np.float32) - offset) / offset
+            else:
+                normalized = samples.astype(np.float32) / np.iinfo(self.dtype).max
+            status[_StatusField.LEVEL_PEAK] = np.abs(normalized).max()
+            status[_StatusField.LEVEL_RMS] = np.sqrt(np.mean(np.square(normalized, dtype=np.float64)))
+
+        status[_StatusField.LAST_ADC_TIME] = time_info.input_buffer_adc_time
+        status[_StatusField.BUFFER_COUNT] += 1
+
+        return super().transcode(in_frame, time_info)
+
+
+def _capture_process_main(connection, shared_status, capture_kwargs):
+    # The host application handles Ctrl+C and stops the capture through the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    status = np.frombuffer(shared_status, dtype=np.float64)
+    status[_StatusField.STATE] = _State.INITIALIZING
+    status[_StatusField.LAST_ADC_TIME] = np.nan
+
+    try:
+        transcoder_cls = capture_kwargs.pop("transcoder_cls", None) or PyAudio2PyAVTranscoder
+        metering_transcoder_cls = type(
+            f"LevelMetering{transcoder_cls.__name__}",
+            (_LevelMeteringMixin, transcoder_cls),
+            {"_shared_status": status},
+        )
+        capture = PyAudio2PyAVCapture(transcoder_cls=metering_transcoder_cls, **capture_kwargs)
+    except Exception as err:
+        status[_StatusField.STATE] = _State.FAILED
+        connection.send((0, f"{type(err).__name__}: {err}"))
+        return
+
+    status[_StatusField.STATE] = _State.STOPPED
+    connection.send((0, None))
+
+    while True:
+        try:
+            while not connection.poll(_STATS_INTERVAL):
+                _publish_source_stats(status, capture)
+            sequence, command = connection.recv()
+        except EOFError:
+            # The host process is gone; finalize the recording anyway
+            sequence, command = None, _Command.CLOSE
+
+        try:
+            if command == _Command.START:
+                capture.start()
+                status[_StatusField.STATE] = _State.RUNNING
+            elif command == _Command.STOP:
+                capture.stop()
+                status[_StatusField.STATE] = _State.STOPPED
+            elif command == _Command.CLOSE:
+                capture.stop()
+                status[_StatusField.STATE] = _State.CLOSED
+            else:
+                raise ValueError(f"Unknown command: {command}")
+            error = None
+        except Exception as err:
+            logger.error(err)
+            error = f"{type(err).__name__}: {err}"
+
+        # The counters are final once the capture stopped
+        _publish_source_stats(status, capture)
+
+        try:
+            connection.send((sequence, error))
+        except (BrokenPipeError, OSError):
+            pass
+
+        if command == _Command.CLOSE:
+            break
+
+    connection.close()
+
+
+def _publish_source_stats(status, capture):
+    stats = capture.stats()
+    status[_StatusField.INPUT_OVERFLOW_COUNT] = stats.input_overflow_count
+    status[_StatusField.DROPOUT_COUNT] = stats.dropout_count
+    status[_StatusField.DROPPED_FRAMES] = stats.dropped_frames
+
+
+def _shutdown_capture_process(connection, process, timeout):
+    if process.is_alive():
+        try:
+            # Nobody waits for the reply, so the command isn't numbered
+            connection.send((None, _Command.CLOSE))
+            connection.poll(timeout)
+        except (BrokenPipeError, OSError):
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning("Capture process didn't exit, terminating it")
+            process.terminate()
+            process.join()
+    connection.close()
@@ -1,70 +1,170 @@
+import json
+import math
 import time
 import queue
 import logging
 import threading
 import collections
 import typing as T
+from pathlib import Path
 
 import pyaudio
 
-from pupil_audio.utils import HeartbeatMixin
+from pupil_audio.utils import HeartbeatMixin, key_property
+from pupil_audio.utils.inotify import DeviceNodeWatcher, InotifyUnavailable
+from pupil_audio.utils.ring_buffer import AudioRingBuffer
 from pupil_audio.utils.pyaudio import PyAudioManager, HostApiInfo, DeviceInfo, TimeInfo
 
 
 logger = logging.getLogger(__name__)
 
 
+class DeviceChanges(collections.namedtuple("DeviceChanges", ["added", "removed", "changed"])):
+    """
+    Devices that were added, removed or changed between two device scans, keyed by name.
+    """
+
+    __slots__ = ()
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    @staticmethod
+    def between(old: T.Mapping[str, DeviceInfo], new: T.Mapping[str, DeviceInfo]) -> "DeviceChanges":
+        added = {name: info for name, info in new.items() if name not in old}
+        removed = {name: info for name, info in old.items() if name not in new}
+        changed = {name: info for name, info in new.items() if name in old and old[name] != info}
+        return DeviceChanges(added=added, removed=removed, changed=changed)
+
+
 class PyAudioDeviceMonitor:
 
     # Public
 
     def __init__(self):
         self.__devices_by_name = {}
+        self.__devices_condition = threading.Condition(threading.RLock())
+        self.__subscribers = []
 
     @property
     def devices_by_name(self) -> T.Mapping[str, DeviceInfo]:
-        return self.__devices_by_name
+        with self.__devices_condition:
+            return self.__devices_by_name
 
     @devices_by_name.setter
     def devices_by_name(self, value: T.Mapping[str, DeviceInfo]):
-        self.__devices_by_name = value
+        with self.__devices_condition:
+            changes = DeviceChanges.between(self.__devices_by_name, value)
+            self.__devices_by_name = value
+            if changes.is_empty:
+                return
+            self.__devices_condition.notify_all()
+            subscribers = tuple(self.__subscribers)
+
+        # Callbacks are called outside the lock, so they are free to query the monitor
+        for callback in subscribers:
+            try:
+                callback(changes)
+            except Exception as err:
+                logger.error(err)
 
     def update(self):
+        # PortAudio only rescans the devices when (re-)initialized
+        PyAudioManager.refresh()
         self.devices_by_name = DeviceInfo.devices_by_name()
 
+    def subscribe(self, callback: T.Callable[[DeviceChanges], None]):
+        """
+        Register a callback that is called with the `DeviceChanges` of every scan that changed the devices.
+        """
+        with self.__devices_condition:
+            self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback: T.Callable[[DeviceChanges], None]):
+        with self.__devices_condition:
+            try:
+                self.__subscribers.remove(callback)
+            except ValueError:
+                pass
+
+    def wait_for(self, name: str, timeout: T.Optional[float] = None, should_wait: T.Callable[[], bool] = None) -> T.Optional[DeviceInfo]:
+        """
+        Block until a device with the given name is available, and return its info.
+
+        Returns `None` if the device didn't appear within `timeout` seconds, or if `should_wait`
+        returned `False` after the waiters were woken up with `wake_waiters`.
+        """
+        should_wait = should_wait or (lambda: True)
+        with self.__devices_condition:
+            self.__devices_condition.wait_for(
+                lambda: name in self.__devices_by_name or not should_wait(),
+                timeout=timeout,
+            )
+            return self.__devices_by_name.get(name, None)
+
+    def wake_waiters(self):
+        """
+        Wake up all `wait_for` callers, so that they re-evaluate their `should_wait` condition.
+        """
+        with self.__devices_condition:
+            self.__devices_condition.notify_all()
+
     def cleanup(self):
         pass
 
 
 class PyAudioBackgroundDeviceMonitor(PyAudioDeviceMonitor):
+    """
+    Keeps the device list up to date on a background thread.
+
+    On Linux, the sound device nodes in `watch_path` are watched with inotify and the devices
+    are only rescanned when a node changes. Otherwise (or if `use_inotify` is `False`), the devices
+    are polled at up to `freq_hz`, backing off to `min_freq_hz` while the device list doesn't change.
+    """
 
     # Public
 
-    def __init__(self, time_fn=time.monotonic):
+    def __init__(
+        self,
+        time_fn=time.monotonic,
+        freq_hz: float = 1.0,
+        min_freq_hz: float = 0.2,
+        watch_path: str = DeviceNodeWatcher.DEFAULT_PATH,
+        use_inotify: bool = True,
+        settle_time: float = 0.2,
+    ):
+        assert freq_hz > 0 and min_freq_hz > 0
         super().__init__()
         self.__time_fn = time_fn
+        self.__min_interval = 1. / freq_hz
+        self.__max_interval = max(1. / min_freq_hz, self.__min_interval)
+        self.__watch_path = watch_path
+        self.__use_inotify = use_inotify
+        self.__settle_time = settle_time
         self.__should_run = threading.Event()
+        self.__wake_up = threading.Event()
+        self.__watcher = None
         self.__monitor_thread = None
-        self.__devices_by_name_lock = threading.RLock()
-
-    @property
-    def devices_by_name(self) -> T.Mapping[str, DeviceInfo]:
-        with self.__devices_by_name_lock:
-            return PyAudioDeviceMonitor.devices_by_name.fget(self)
-
-    @devices_by_name.setter
-    def devices_by_name(self, value: T.Mapping[str, DeviceInfo]):
-        with self.__devices_by_name_lock:
-            PyAudioDeviceMonitor.devices_by_name.fset(self, value)
 
     @property
     def is_running(self):
         return self.__should_run.is_set()
 
+    @property
+    def is_watching(self) -> bool:
+        """
+        Whether device changes are currently detected through inotify instead of polling.
+        """
+        watcher = self.__watcher
+        return watcher is not None and watcher.is_valid
+
     def start(self):
         if self.is_running:
             return
         self.__should_run.set()
+        self.__wake_up.clear()
+        self.__watcher = self.__create_watcher()
         self.__monitor_thread = threading.Thread(
             name=f"{type(self).__name__}#{id(self)}",
             target=self.__monitor_loop,
@@ -74,40 +174,162 @@ class PyAudioBackgroundDeviceMonitor(PyAudioDeviceMonitor):
 
     def stop(self):
         self.__should_run.clear()
+        self.__wake_up.set()
+        if self.__watcher is not None:
+            self.__watcher.wake()
         if self.__monitor_thread is not None:
             self.__monitor_thread.join()
             self.__monitor_thread = None
+        if self.__watcher is not None:
+            self.__watcher.close()
+            self.__watcher = None
 
     def cleanup(self):
         self.stop()
 
     # Private
 
-    def __monitor_loop(self, freq_hz=0.3):
-        exec_time = 1./freq_hz
+    def __create_watcher(self) -> T.Optional[DeviceNodeWatcher]:
+        if not self.__use_inotify:
+            return None
+        try:
+            return DeviceNodeWatcher(self.__watch_path)
+        except InotifyUnavailable as err:
+            logger.debug(f"Falling back to polling for device changes: {err}")
+            return None
+
+    def __scan(self) -> bool:
+        devices_before = self.devices_by_name
+        try:
+            self.update()
+        except Exception as err:
+            logger.error(err)
+        return self.devices_by_name != devices_before
+
+    def __monitor_loop(self):
+        self.__scan()
+
+        if self.__watcher is not None:
+            self.__watch_loop(self.__watcher)
+
+        if self.is_running:
+            self.__poll_loop()
+
+    def __watch_loop(self, watcher: DeviceNodeWatcher):
+        while self.is_running and watcher.is_valid:
+            # If the PortAudio session is in use, the refresh is deferred; retry periodically until it happens
+            timeout = self.__min_interval if PyAudioManager.is_refresh_pending() else None
+
+            if not watcher.wait(timeout=timeout) and not PyAudioManager.is_refresh_pending():
+                continue
+
+            # Device nodes are created in bursts (and their permissions adjusted afterwards),
+            # so wait until they settle before rescanning
+            while self.is_running and watcher.wait(timeout=self.__settle_time):
+                pass
+
+            if self.is_running:
+                self.__scan()
+
+    def __poll_loop(self):
         time_fn = self.__time_fn
+        interval = self.__min_interval
 
         while self.is_running:
             start_time = time_fn()
 
-            try:
-                self.update()
-            except Exception as err:
-                logger.error(err)
+            did_change = self.__scan()
+
+            if did_change:
+                interval = self.__min_interval
+            else:
+                interval = min(2 * interval, self.__max_interval)
 
-            remaining_time = exec_time - (time_fn() - start_time)
+            remaining_time = interval - (time_fn() - start_time)
             if remaining_time > 0:
-                time.sleep(remaining_time)
+                self.__wake_up.wait(remaining_time)
+
+
+class SourceStats(dict):
+    """
+    Snapshot of the input counters of a `PyAudioDeviceSource`.
+
+    `input_overflow_count` and `input_underflow_count` count the buffers flagged by PortAudio.
+    `dropout_count` counts the discontinuities in the ADC time of consecutive buffers (larger
+    than half a buffer), and `dropped_frames` estimates the frames lost in them.
+    `queue_high_water_mark` is the largest number of items observed in the output queue.
+    """
+    buffer_count            = key_property("buffer_count",          type=int,   readonly=True, default=0)
+    frame_count             = key_property("frame_count",           type=int,   readonly=True, default=0)
+    input_overflow_count    = key_property("input_overflow_count",  type=int,   readonly=True, default=0)
+    input_underflow_count   = key_property("input_underflow_count", type=int,   readonly=True, default=0)
+    dropout_count           = key_property("dropout_count",         type=int,   readonly=True, default=0)
+    dropped_frames          = key_property("dropped_frames",        type=int,   readonly=True, default=0)
+    queue_high_water_mark   = key_property("queue_high_water_mark", type=int,   readonly=True, default=0)
+    first_adc_time          = key_property("first_adc_time",        type=float, readonly=True, default=math.nan)
+    last_adc_time           = key_property("last_adc_time",         type=float, readonly=True, default=math.nan)
+
+    @staticmethod
+    def sidecar_path(recording_path: str) -> str:
+        """
+        Path of the statistics sidecar of a recording: `<name>_stats.json` next to it.
+        """
+        recording_path = Path(recording_path)
+        return str(recording_path.with_name(recording_path.stem + "_stats").with_suffix(".json"))
+
+    def save(self, path: str):
+        """
+        Write the snapshot as JSON, e.g. as a sidecar of the recording (see `sidecar_path`).
+        """
+        # NaN isn't valid JSON
+        values = {key: (None if isinstance(value, float) and math.isnan(value) else value) for key, value in self.items()}
+        with open(path, "w") as file:
+            json.dump(values, file, indent=4, sort_keys=True)
+
+    @staticmethod
+    def load(path: str) -> "SourceStats":
+        with open(path) as file:
+            values = json.load(file)
+        return SourceStats({key: (math.nan if value is None else value) for key, value in values.items()})
 
 
 class PyAudioDeviceSource:
+    """
+    Captures an input device in callback mode and puts `(in_data, TimeInfo)` tuples into `out_queue`.
 
-    def __init__(self, device_index, frame_rate, channels, format, out_queue):
+    `out_queue` can also be an `AudioRingBuffer`, in which case the buffers are written into it
+    without allocating any intermediate objects. The PortAudio callback never waits for the
+    consumer indefinitely: with the `BLOCK` overflow policy, it waits for space for at most half
+    a buffer, after which the buffer is discarded and counted in `dropped_block_count`.
+
+    With `direct_delivery` (the default), the PortAudio callback puts the data into `out_queue`
+    itself, and the internal thread only manages the stream and propagates errors. Otherwise,
+    the data is relayed to `out_queue` through the internal thread.
+
+    The callback keeps counters of the overflow flags, the ADC time discontinuities and the
+    queue size of every stream, which are reset by `start` and returned by `stats`. If
+    `stats_path` is set, they are written there as JSON whenever the stream stops.
+
+    If `latency` (a `PipelineLatency`) is set, the duration of every callback is recorded in its
+    `callback` histogram, and the buffers are queued with a `queued_time`, for the sink to
+    record the `queue` stage.
+    """
+
+    def __init__(self, device_index, frame_rate, channels, format, out_queue, direct_delivery=True, frames_per_buffer=1024, stats_path=None, latency=None):
         self._device_index = device_index
         self._frame_rate = int(frame_rate) if frame_rate else None
         self._channels = int(channels) if channels else None
         self._format = format
+        self._frames_per_buffer = int(frames_per_buffer)
         self._out_queue = out_queue
+        self._out_ring_buffer = out_queue if isinstance(out_queue, AudioRingBuffer) else None
+        self._out_ring_buffer_timeout = 0.
+        self._direct_delivery = direct_delivery
+        self._bytes_per_frame = None
+        self._stats_path = stats_path
+        self._latency = latency
+        self._callback_histogram = latency.histogram("callback") if latency is not None else None
+        self._reset_stats()
 
         self._internal_queue = None
         self._internal_thread = None
@@ -122,6 +344,10 @@ class PyAudioDeviceSource:
         if self._internal_is_terminated:
             raise ValueError("Can't start terminated source")
         self.stop()
+        self._bytes_per_frame = self._channels * pyaudio.get_sample_size(self._format)
+        # Computed here, since the frame rate of a delayed source is only known once its device appears
+        self._out_ring_buffer_timeout = 0.5 * self._frames_per_buffer / self._frame_rate if self._frame_rate else 0.
+        self._reset_stats()
         self._internal_queue = queue.Queue()
         self._internal_thread = threading.Thread(
             name=type(self).__name__,
@@ -142,10 +368,31 @@ class PyAudioDeviceSource:
     def stop(self):
         self._internal_is_running.clear()
         if self._internal_queue is not None:
+            # Wake up the internal thread, which blocks until it receives a signal
+            self._internal_queue.put_nowait(PyAudioDeviceSource._StopSignal())
             self._internal_queue = None
         if self._internal_thread is not None:
             self._internal_thread.join()
             self._internal_thread = None
+            if self._stats_path is not None:
+                try:
+                    self.stats().save(self._stats_path)
+                except Exception as err:
+                    logger.error(err)
+
+    def stats(self) -> SourceStats:
+        ring_buffer = self._out_ring_buffer
+        return SourceStats(
+            buffer_count=self._buffer_count,
+            frame_count=self._frame_count,
+            input_overflow_count=self._input_overflow_count,
+            input_underflow_count=self._input_underflow_count,
+            dropout_count=self._dropout_count,
+            dropped_frames=self._dropped_frames,
+            queue_high_water_mark=ring_buffer.high_water_mark if ring_buffer is not None else self._queue_high_water_mark,
+            first_adc_time=self._first_adc_time,
+            last_adc_time=self._last_adc_time,
+        )
 
     def cleanup(self):
         self.stop()
@@ -156,18 +403,51 @@ class PyAudioDeviceSource:
 
     _DataSignal = collections.namedtuple("_DataSignal", ["data"])
 
+    _StopSignal = collections.namedtuple("_StopSignal", [])
+
     def _stream_callback(self, in_data, frame_count, time_info, status):
+        callback_histogram = self._callback_histogram
+        if callback_histogram is None:
+            return self._deliver_buffer(in_data, frame_count, time_info, status)
+        start = time.perf_counter()
+        result = self._deliver_buffer(in_data, frame_count, time_info, status)
+        callback_histogram.record(time.perf_counter() - start)
+        return result
+
+    def _deliver_buffer(self, in_data, frame_count, time_info, status):
+        internal_queue = self._internal_queue
+
         try:
-            time_info = TimeInfo(time_info)
-            bytes_per_channel = pyaudio.get_sample_size(self._format)
-            theoretic_len = frame_count * self._channels * bytes_per_channel
-            assert theoretic_len == len(in_data)
-            out_signal = PyAudioDeviceSource._DataSignal((in_data, time_info))
+            self._count_buffer(frame_count, time_info, status)
+            assert frame_count * self._bytes_per_frame == len(in_data)
+            queued_time = time.perf_counter() if self._latency is not None else None
+            if self._direct_delivery and self._out_ring_buffer is not None:
+                if self._internal_is_running.is_set():
+                    self._out_ring_buffer.write(
+                        in_data,
+                        adc_time=time_info["input_buffer_adc_time"],
+                        current_time=time_info["current_time"],
+                        queued_time=math.nan if queued_time is None else queued_time,
+                        # Blocking the callback would stall the stream, and `stop` with it
+                        block=self._out_ring_buffer_timeout > 0,
+                        timeout=self._out_ring_buffer_timeout,
+                    )
+                return (None, pyaudio.paContinue)
+            if queued_time is None:
+                data = (in_data, TimeInfo(time_info))
+            else:
+                data = (in_data, TimeInfo(time_info, queued_time=queued_time))
         except Exception as err:
-            out_signal = PyAudioDeviceSource._ErrorSignal(err)
+            if internal_queue is not None:
+                internal_queue.put_nowait(PyAudioDeviceSource._ErrorSignal(err))
+            return (None, pyaudio.paContinue)
 
-        if self._internal_queue is not None:
-            self._internal_queue.put_nowait(out_signal)
+        if self._direct_delivery:
+            if self._internal_is_running.is_set():
+                self._out_queue.put_nowait(data)
+                self._count_queue_size(self._out_queue)
+        elif internal_queue is not None:
+            internal_queue.put_nowait(PyAudioDeviceSource._DataSignal(data))
 
         return (None, pyaudio.paContinue)
 
@@ -181,6 +461,7 @@ class PyAudioDeviceSource:
                 rate=frame_rate,
                 input=True,
                 input_device_index=device_index,
+                frames_per_buffer=self._frames_per_buffer,
                 stream_callback=self._stream_callback,
             )
 
@@ -188,12 +469,12 @@ class PyAudioDeviceSource:
 
             try:
                 while is_running.is_set():
-                    try:
-                        signal = internal_queue.get(timeout=0.1)
-                    except queue.Empty:
-                        continue
-                    if isinstance(signal, PyAudioDeviceSource._DataSignal):
+                    signal = internal_queue.get()
+                    if isinstance(signal, PyAudioDeviceSource._StopSignal):
+                        break
+                    elif isinstance(signal, PyAudioDeviceSource._DataSignal):
                         out_queue.put_nowait(signal.data)
+                        self._count_queue_size(out_queue)
                     elif isinstance(signal, PyAudioDeviceSource._ErrorSignal):
                         raise signal.error
                     else:
@@ -204,6 +485,52 @@ class PyAudioDeviceSource:
             stream.stop_stream()
             stream.close()
 
+    def _reset_stats(self):
+        self._buffer_count = 0
+        self._frame_count = 0
+        self._input_overflow_count = 0
+        self._input_underflow_count = 0
+        self._dropout_count = 0
+        self._dropped_frames = 0
+        self._queue_high_water_mark = 0
+        self._first_adc_time = math.nan
+        self._last_adc_time = math.nan
+        self._next_adc_time = None
+
+    def _count_buffer(self, frame_count, time_info, status):
+        # Called for every buffer on the PortAudio thread, so it only updates a few counters
+        self._buffer_count += 1
+        self._frame_count += frame_count
+
+        if status & pyaudio.paInputOverflow:
+            self._input_overflow_count += 1
+        if status & pyaudio.paInputUnderflow:
+            self._input_underflow_count += 1
+
+        adc_time = time_info.get("input_buffer_adc_time", 0.)
+        frame_rate = self._frame_rate
+        # Some host APIs don't provide the ADC time, and report 0
+        if adc_time <= 0 or not frame_rate:
+            return
+
+        next_adc_time = self._next_adc_time
+        if next_adc_time is None:
+            self._first_adc_time = adc_time
+        else:
+            # A gap of more than half a buffer between consecutive buffers means samples were lost
+            gap = adc_time - next_adc_time
+            if gap > 0.5 * frame_count / frame_rate:
+                self._dropout_count += 1
+                self._dropped_frames += int(round(gap * frame_rate))
+
+        self._last_adc_time = adc_time
+        self._next_adc_time = adc_time + frame_count / frame_rate
+
+    def _count_queue_size(self, out_queue):
+        size = out_queue.qsize()
+        if size > self._queue_high_water_mark:
+            self._queue_high_water_mark = size
+
 
 class PyAudioDelayedDeviceSource(HeartbeatMixin, PyAudioDeviceSource):
     def __init__(self, *args, device_index, device_name, device_monitor=None, **kwargs):
@@ -238,6 +565,7 @@ class PyAudioDelayedDeviceSource(HeartbeatMixin, PyAudioDeviceSource):
     def stop(self):
         self.heartbeat_complete()
         self._wait_for_device.clear()
+        self.device_monitor.wake_waiters()
         if self._wait_for_device_thread is not None:
             self._wait_for_device_thread.join()
             self._wait_for_device_thread = None
@@ -257,36 +585,21 @@ class PyAudioDelayedDeviceSource(HeartbeatMixin, PyAudioDeviceSource):
         self.on_input_device_disconnected()
         self.cleanup()
 
-    def __delayed_start(self, device_name, freq_hz=0.3, time_fn=None):
-        exec_time = 1./freq_hz
-        time_fn = time_fn or time.monotonic
-
+    def __delayed_start(self, device_name):
         monitor_was_already_running = self.device_monitor.is_running
 
         if not monitor_was_already_running:
             self.device_monitor.start()
 
-        device_info = None
-
-        while self._wait_for_device.is_set():
-            start_time = time_fn()
-
-            try:
-                self.device_monitor.update()
-                device_info = self.device_monitor.devices_by_name.get(device_name, None)
-                if device_info is not None:
-                    break
-            except Exception as err:
-                logger.error(err)
-
-            remaining_time = exec_time - (time_fn() - start_time)
-            if remaining_time > 0:
-                time.sleep(remaining_time)
+        # The monitor wakes this thread as soon as a scan finds the device
+        device_info = self.device_monitor.wait_for(
+            device_name, should_wait=self._wait_for_device.is_set,
+        )
 
         if not monitor_was_already_running:
             self.device_monitor.stop()
 
-        if device_info is None:
+        if device_info is None or not self._wait_for_device.is_set():
             return
 
         self._device_index = device_info.index
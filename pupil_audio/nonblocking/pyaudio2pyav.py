@@ -1,4 +1,5 @@
 import queue
+import logging
 import threading
 import typing as T
 from fractions import Fraction
@@ -8,11 +9,16 @@ import pyaudio
 import av
 
 from pupil_audio.utils.pyaudio import DeviceInfo, TimeInfo
+from pupil_audio.utils.ring_buffer import AudioRingBuffer, OverflowPolicy
+from pupil_audio.utils.latency import PipelineLatency
 
-from .pyaudio import PyAudioDeviceSource
+from .pyaudio import PyAudioDeviceSource, SourceStats
 from .pyav import PyAVFileSink
 
 
+logger = logging.getLogger(__name__)
+
+
 class PyAudio2PyAVCapture:
     @staticmethod
     def available_input_devices():
@@ -28,14 +34,34 @@ class PyAudio2PyAVCapture:
         source_cls=None,
         transcoder_cls=None,
         sink_cls=None,
+        frames_per_buffer=1024,
+        buffer_seconds=None,
+        overflow_policy=OverflowPolicy.DROP_OLDEST,
+        encoder_profile=None,
+        stats_sidecar=False,
+        measure_latency=False,
+        latency_path=None,
     ):
+        """
+        If `buffer_seconds` is set, the source and the sink are connected by a preallocated
+        `AudioRingBuffer` of that duration (with the given `overflow_policy`), instead of an
+        unbounded queue.
+
+        `encoder_profile` selects the codec and container of the output (AAC by default).
+
+        If `stats_sidecar` is set, the input statistics of the source (see `SourceStats`) are
+        written next to the recording as `<name>_stats.json` when it stops.
+
+        If `measure_latency` is set, the source and the sink record the latency of every stage
+        of the pipeline into `self.latency` (a `PipelineLatency`), which can be read while
+        recording. With `latency_path`, the histograms are also written there in the Prometheus
+        text format when the capture stops (and whenever `write_latency` is called).
+        """
         device = DeviceInfo.named_input(in_name)
 
         frame_rate = int(frame_rate or device.default_sample_rate)
         channels = int(channels or device.max_input_channels)
 
-        self.shared_queue = queue.Queue()
-
         self.source_cls = source_cls or PyAudioDeviceSource
         assert issubclass(self.source_cls, PyAudioDeviceSource)
 
@@ -45,36 +71,97 @@ class PyAudio2PyAVCapture:
         self.sink_cls = sink_cls or PyAVFileSink
         assert issubclass(self.sink_cls, PyAVFileSink)
 
+        self.latency = PipelineLatency() if measure_latency or latency_path else None
+        self.latency_path = latency_path
+
         self.transcoder = self.transcoder_cls(
             frame_rate=frame_rate, channels=channels, dtype=dtype,
         )
 
+        if buffer_seconds:
+            self.shared_queue = AudioRingBuffer(
+                seconds=buffer_seconds,
+                frame_rate=self.transcoder.frame_rate,
+                channels=self.transcoder.channels,
+                dtype=self.transcoder.dtype,
+                frames_per_block=frames_per_buffer,
+                overflow_policy=overflow_policy,
+            )
+        else:
+            self.shared_queue = queue.Queue()
+
         self.source = self.source_cls(
             device_index=device.index,
             frame_rate=self.transcoder.frame_rate,
             channels=self.transcoder.channels,
             format=self.transcoder.pyaudio_format,
             out_queue=self.shared_queue,
+            frames_per_buffer=frames_per_buffer,
+            stats_path=SourceStats.sidecar_path(out_path) if stats_sidecar else None,
+            latency=self.latency,
         )
 
         self.sink = self.sink_cls(
             file_path=out_path,
             transcoder=self.transcoder,
             in_queue=self.shared_queue,
+            encoder_profile=encoder_profile,
+            latency=self.latency,
         )
 
     def start(self):
+        # Buffers left over from a previous recording would be written with stale timestamps
+        _clear_queue(self.shared_queue)
         self.sink.start()
         self.source.start()
 
     def stop(self):
-        self.sink.stop()
+        # The source is stopped first, so that the sink encodes every buffer it delivered
         self.source.stop()
+        self.sink.stop()
+        if self.latency_path is not None:
+            try:
+                self.write_latency()
+            except Exception as err:
+                logger.error(err)
+
+    def stats(self) -> SourceStats:
+        return self.source.stats()
+
+    def write_latency(self, path=None):
+        """
+        Write the latency histograms to `path` (by default `latency_path`) in the Prometheus text format.
+        """
+        assert self.latency is not None, "Latency isn't measured"
+        self.latency.write_prometheus(path or self.latency_path)
+
+
+def _clear_queue(q):
+    if isinstance(q, AudioRingBuffer):
+        q.clear()
+        return
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
 
 
 class PyAudio2PyAVTranscoder:
-    def __init__(self, frame_rate, channels, dtype=None):
-        dtype = dtype or np.dtype("int16")
+    """
+    Converts interleaved PyAudio buffers into planar PyAV audio frames.
+
+    The PyAV format, layout and planarity are resolved once, and the samples are
+    deinterleaved from a `np.frombuffer` view straight into the memory of the frame planes.
+
+    If `frame_pool_size` is set, output frames are reused round-robin instead of being
+    allocated for every buffer. A pooled frame is overwritten `frame_pool_size` calls
+    after it was returned, so the consumer must be done with it by then (e.g. because
+    the frames are copied into an `av.AudioFifo` before encoding).
+    """
+
+    def __init__(self, frame_rate, channels, dtype=None, frame_pool_size=0):
+        dtype = np.dtype(dtype or "int16")
         supported = self._supported_dtypes()
         assert dtype in supported, f"Supported dtypes: {supported}. {dtype} requested."
 
@@ -82,6 +169,18 @@ class PyAudio2PyAVTranscoder:
         self.channels = channels
         self.dtype = dtype
         self.num_encoded_frames = 0
+        self.num_encoded_samples = 0
+
+        self._frame_pool_size = int(frame_pool_size)
+        self._frame_pool = []
+        self._frame_pool_index = 0
+
+        # Resolved once, instead of for every transcoded buffer
+        self._resolved_format = self.pyav_format
+        self._resolved_layout = self.pyav_layout
+        self._resolved_is_planar = av.AudioFormat(self._resolved_format).is_planar
+        self._resolved_rate = int(self.frame_rate)
+        self._resolved_time_base = Fraction(1, self._resolved_rate)
 
     def start(self):
         pass
@@ -91,6 +190,7 @@ class PyAudio2PyAVTranscoder:
 
     def reset(self):
         self.num_encoded_frames = 0
+        self.num_encoded_samples = 0
 
     _dtype_to_pyaudio_format = {
         np.dtype("<f4"): pyaudio.paFloat32,
@@ -155,52 +255,70 @@ class PyAudio2PyAVTranscoder:
         self, in_frame: np.ndarray, time_info: TimeInfo
     ) -> T.Tuple[av.AudioFrame, float]:
 
-        # Step 1: Decode PyAudio input frame
-
-        tmp_frame = np.fromstring(in_frame, dtype=self.dtype)
-
-        chunk_length = len(tmp_frame) / self.channels
-        assert chunk_length == int(chunk_length)
-        chunk_length = int(chunk_length)
+        # Step 1: Decode PyAudio input frame, without copying
 
-        tmp_frame = np.reshape(tmp_frame, (chunk_length, self.channels))
+        in_samples = np.frombuffer(in_frame, dtype=self.dtype)
 
-        # Step 2: Encode PyAV output frame
+        chunk_length, remainder = divmod(in_samples.size, self.channels)
+        assert remainder == 0
 
-        # Flatten in column-major (Fortran-style) order
-        # Effectively converting the buffer to a planar audio frame
-        tmp_frame = tmp_frame.flatten(order="F")
+        # Step 2: Copy the samples into the PyAV output frame
 
-        chunk_length = len(tmp_frame) / self.channels
-        assert chunk_length == int(chunk_length)
-        chunk_length = int(chunk_length)
+        out_frame = self._output_frame(chunk_length)
 
-        tmp_frame = np.reshape(tmp_frame, (self.channels, chunk_length))
-
-        assert tmp_frame.ndim == 2
-        if av.AudioFormat(self.pyav_format).is_planar:
-            assert tmp_frame.shape[0] == self.channels
-            samples = tmp_frame.shape[1]
+        if self._resolved_is_planar:
+            # Deinterleave each channel straight into its plane
+            in_samples = in_samples.reshape(chunk_length, self.channels)
+            planes = out_frame.planes
+            for i in range(self.channels):
+                self._plane_write(planes[i], in_samples[:, i], chunk_length)
         else:
-            assert tmp_frame.shape[0] == 1
-            samples = tmp_frame.shape[1] // self.channels
-
-        out_frame = av.AudioFrame(
-            format=self.pyav_format, layout=self.pyav_layout, samples=samples
-        )
-
-        for i, plane in enumerate(out_frame.planes):
-            plane.update(tmp_frame[i, :])
+            self._plane_write(out_frame.planes[0], in_samples, in_samples.size)
 
-        out_frame.rate = int(self.frame_rate)
-        out_frame.time_base = Fraction(1, int(self.frame_rate))
-        out_frame.pts = out_frame.samples * self.num_encoded_frames
+        out_frame.rate = self._resolved_rate
+        out_frame.time_base = self._resolved_time_base
+        out_frame.pts = self.num_encoded_samples
         self.num_encoded_frames += 1
+        self.num_encoded_samples += chunk_length
 
         return out_frame, time_info.input_buffer_adc_time
 
+    def _output_frame(self, samples: int) -> av.AudioFrame:
+        if self._frame_pool_size <= 0:
+            return av.AudioFrame(
+                format=self._resolved_format, layout=self._resolved_layout, samples=samples
+            )
+
+        pool = self._frame_pool
+        if pool and pool[0].samples != samples:
+            # The buffer size changed, so the pooled frames can't be reused
+            pool.clear()
+
+        if len(pool) < self._frame_pool_size:
+            frame = av.AudioFrame(
+                format=self._resolved_format, layout=self._resolved_layout, samples=samples
+            )
+            pool.append(frame)
+            return frame
+
+        frame = pool[self._frame_pool_index]
+        self._frame_pool_index = (self._frame_pool_index + 1) % len(pool)
+        return frame
+
+    def _plane_write(self, plane, samples: np.ndarray, count: int):
+        # Planes might be padded, so only the first `count` samples are written
+        plane_samples = np.frombuffer(plane, dtype=self.dtype, count=count)
+        if plane_samples.flags.writeable:
+            plane_samples[:] = samples
+        else:
+            plane.update(np.ascontiguousarray(samples))
+
 
 class PassthroughTranscoder(PyAudio2PyAVTranscoder):
+    """
+    Wraps the interleaved PyAudio buffers into interleaved PyAV audio frames, without conversion.
+    """
+
     @property
     def pyav_format(self) -> str:
         try:
@@ -210,37 +328,3 @@ class PassthroughTranscoder(PyAudio2PyAVTranscoder):
             return interleaved
         except KeyError:
             raise ValueError(f"Couldn't map {self.dtype} dtype to a PyAV format")
-
-    def transcode(
-        self, in_frame: np.ndarray, time_info: TimeInfo
-    ) -> T.Tuple[av.AudioFrame, float]:
-
-        # Step 1: Decode PyAudio input frame
-
-        tmp_frame = np.frombuffer(in_frame, dtype=self.dtype)
-        tmp_frame.shape = 1, -1
-
-        chunk_length = tmp_frame.size / self.channels
-        assert chunk_length == int(chunk_length)
-        chunk_length = int(chunk_length)
-
-        if av.AudioFormat(self.pyav_format).is_planar:
-            assert tmp_frame.shape[0] == self.channels
-            samples = tmp_frame.shape[1]
-        else:
-            assert tmp_frame.shape[0] == 1
-            samples = tmp_frame.shape[1] // self.channels
-
-        out_frame = av.AudioFrame(
-            format=self.pyav_format, layout=self.pyav_layout, samples=samples
-        )
-
-        for i, plane in enumerate(out_frame.planes):
-            plane.update(tmp_frame[i, :])
-
-        out_frame.rate = int(self.frame_rate)
-        out_frame.time_base = Fraction(1, int(self.frame_rate))
-        out_frame.pts = out_frame.samples * self.num_encoded_frames
-        self.num_encoded_frames += 1
-
-        return out_frame, time_info.input_buffer_adc_time
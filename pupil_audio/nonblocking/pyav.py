@@ -1,20 +1,65 @@
 import time
 import queue
+import logging
 import threading
+import collections
+import typing as T
 from pathlib import Path
 from fractions import Fraction
 
 import av
-import numpy as np
+
+from pupil_audio.utils.pyav import EncoderProfile
+from pupil_audio.utils.timestamps import TimestampWriter
+from pupil_audio.utils.ring_buffer import AudioRingBuffer
+from pupil_audio.utils.clock_model import ClockModelBuilder
+
+
+logger = logging.getLogger(__name__)
 
 
 class PyAVFileSink():
-    def __init__(self, file_path, transcoder, in_queue, timestamps_path=None):
+    """
+    Encodes the `(in_frame, TimeInfo)` items of `in_queue` into an audio file.
+
+    `in_queue` can be a `queue.Queue` or an `AudioRingBuffer`.
+
+    The transcoded frames are accumulated in an audio FIFO and encoded in frames of exactly
+    `encode_frame_size` samples (by default the native frame size of the encoder), with one
+    sample-accurate timestamp per encoded frame. If `encode_frame_size` is 0, or the encoder
+    accepts variable frame sizes, every transcoded frame is encoded as is.
+
+    The timestamps are streamed to `timestamps_path` by a `TimestampWriter` while recording,
+    so they survive a crash and don't accumulate in memory.
+
+    The codec and container are configured by `encoder_profile` (AAC by default).
+
+    If `clock_model_tolerance` is set, a `ClockModel` of the sample times (within that
+    tolerance, in seconds) is fitted while recording, and saved next to the file as
+    `<name>_clock.npz`; with `clock_model_keep_raw`, the timestamp of every transcoded
+    buffer is saved in it as well.
+
+    If `latency` (a `PipelineLatency`) is set, the time every item waited in `in_queue` (if the
+    source set its `queued_time`) and the durations of the transcode, encode and mux steps are
+    recorded in its histograms.
+
+    Between `start` and `stop`, the record loop calls `open_output`, `write` for every item of
+    `in_queue`, and `close_output`. Instead of starting the sink, another thread can call these
+    steps itself (e.g. a pool of encoder threads shared by several sinks), as long as only one
+    thread at a time does.
+    """
+
+    def __init__(self, file_path, transcoder, in_queue, timestamps_path=None, encode_frame_size=None, clock_model_tolerance=None, clock_model_keep_raw=False, encoder_profile=None, latency=None):
         file_path = Path(file_path)
         self._file_path = str(file_path)
         self._timestamps_path = timestamps_path or str(file_path.with_name(file_path.stem + "_timestamps").with_suffix(".npy"))
-        self._timestamps_list = None
         self._transcoder = transcoder
+        self._encode_frame_size = encode_frame_size
+        self._encoder_profile = encoder_profile or EncoderProfile.aac()
+        self._clock_model_tolerance = clock_model_tolerance
+        self._clock_model_keep_raw = clock_model_keep_raw
+        self._latency = latency
+        self._part = None
         self._queue = in_queue
         self._thread = None
         self._running = threading.Event()
@@ -25,15 +70,41 @@ class PyAVFileSink():
     def is_running(self) -> bool:
         return self._running.is_set()
 
+    @property
+    def file_path(self) -> str:
+        """
+        Path of the file of the current (or next) recording.
+        """
+        return self._file_path
+
+    @property
+    def encode_call_count(self) -> int:
+        """
+        Number of frames submitted to the encoder by the current (or last) recording.
+        """
+        part = self._part
+        return part.output.encode_call_count if part is not None else 0
+
+    @property
+    def start_pts(self) -> int:
+        """
+        Offset added to the presentation timestamps of the current recording, in samples.
+        """
+        part = self._part
+        return part.output.start_pts if part is not None else 0
+
+    @start_pts.setter
+    def start_pts(self, value: int):
+        # Only meaningful before the first buffer is written, e.g. to align the recording to a shared start reference
+        self._part.output.start_pts = int(value)
+
     def start(self):
         if self.is_running:
             return
-        self._timestamps_list = []
         self._running.set()
         self._thread = threading.Thread(
             name=type(self).__name__,
             target=self._record_loop,
-            args=(self._file_path, self._transcoder.frame_rate),
             daemon=True,
         )
         self._thread.start()
@@ -44,79 +115,415 @@ class PyAVFileSink():
             return
         self._running.clear()
         self._transcoder.stop()
+        self._wake_record_loop()
         if self._thread is not None:
             self._thread.join()
             self._thread = None
-        if self._timestamps_list is not None:
-            timestamps = np.array(self._timestamps_list)
-            np.save(self._timestamps_path, timestamps)
-            self._timestamps_list = None
 
-    def _record_loop(self, file_path, frame_rate):
+    # Put into a queue after the last item, to stop the record loop
+    _STOP = object()
+
+    def _wake_record_loop(self):
+        # A loop that already ended (e.g. because the output couldn't be created) would leave the
+        # wake-up in the queue, and the next recording would stop at it
+        if self._thread is None or not self._thread.is_alive():
+            return
+        if isinstance(self._queue, AudioRingBuffer):
+            self._queue.interrupt()
+        else:
+            self._queue.put(PyAVFileSink._STOP)
+
+    def _record_loop(self):
         # First, wait until any other previously called record loop is done
         self._finished.wait()
         self._finished.clear()
 
-        container = av.open(file_path, 'w')
-        stream = container.add_stream('aac', rate=float(frame_rate))
-        should_flush_stream = False
-
-        while True:
+        try:
+            self.open_output()
             try:
-                in_frame, in_timestamp = self._queue.get(timeout=0.01)
-            except queue.Empty:
-                if self.is_running:
-                    continue
-                else:
-                    break
+                # Block until data arrives; `stop` wakes the loop up once the queued items are processed
+                while True:
+                    try:
+                        item = self._queue.get()
+                    except queue.Empty:
+                        # The ring buffer was interrupted
+                        break
+                    if item is PyAVFileSink._STOP:
+                        if self._running.is_set():
+                            # Left over by an earlier recording whose loop ended before `stop` woke it up
+                            continue
+                        break
+
+                    in_frame, in_timestamp = item
+                    self.write(in_frame, in_timestamp)
+            finally:
+                self.close_output()
+        finally:
+            # Finally, signal the end of the recording to other threads, even if it failed
+            self._finished.set()
+
+    # Steps of a recording
 
+    def open_output(self):
+        """
+        Create the output file of a new recording, at `file_path`.
+        """
+        # Every recording starts at pts 0
+        self._transcoder.reset()
+        self._part = self._create_part(self._file_path, self._timestamps_path, self._transcoder.frame_rate)
+
+    def write(self, in_frame, in_timestamp):
+        """
+        Transcode and encode an `(in_frame, TimeInfo)` item into the output.
+        """
+        if self._latency is None:
             out_frame, out_timestamp = self._transcoder.transcode(in_frame, in_timestamp)
+            self._part.write(out_frame, out_timestamp)
+            return
+        start = self._record_queue_latency(in_timestamp)
+        out_frame, out_timestamp = self._transcoder.transcode(in_frame, in_timestamp)
+        self._latency.histogram("transcode").record(time.perf_counter() - start)
+        self._part.write(out_frame, out_timestamp)
 
-            for packet in stream.encode(out_frame):
-                container.mux(packet)
-                should_flush_stream = True
+    def _record_queue_latency(self, in_timestamp) -> float:
+        # Returns the time the item was picked up, as the start of the next stage
+        now = time.perf_counter()
+        queued_time = in_timestamp.get("queued_time")
+        if queued_time is not None:
+            self._latency.histogram("queue").record(now - queued_time)
+        return now
 
-            self._timestamps_list.append(out_timestamp)
+    def close_output(self):
+        """
+        Flush the encoder and finalize the output file.
+        """
+        self._part.close()
 
-        if should_flush_stream:
-            for packet in stream.encode(None):
-                container.mux(packet)
+    def _create_part(self, file_path, timestamps_path, frame_rate) -> "_OutputPart":
+        clock_model_path = None
+        if self._clock_model_tolerance is not None:
+            clock_model_path = Path(file_path)
+            clock_model_path = str(clock_model_path.with_name(clock_model_path.stem + "_clock").with_suffix(".npz"))
 
-        container.close()
+        return _OutputPart(
+            output=self._create_output(file_path, frame_rate),
+            timestamps_path=timestamps_path,
+            clock_model_path=clock_model_path,
+            clock_model_tolerance=self._clock_model_tolerance,
+            clock_model_keep_raw=self._clock_model_keep_raw,
+        )
 
-        # Finally, signal the end of the recording to other threads
-        self._finished.set()
+    def _create_output(self, file_path, frame_rate) -> "_EncodedOutput":
+        return _EncodedOutput(
+            file_path=file_path,
+            profile=self._encoder_profile,
+            frame_rate=frame_rate,
+            layout=self._transcoder.pyav_layout,
+            encode_frame_size=self._encode_frame_size,
+            latency=self._latency,
+        )
+
+
+class _OutputPart:
+    """
+    Encoded output of a recording (or of a part of it), with its timestamp file and optional clock model.
+    """
+
+    def __init__(self, output, timestamps_path, clock_model_path=None, clock_model_tolerance=None, clock_model_keep_raw=False):
+        self.output = output
+        self.file_path = output.file_path
+        self.timestamps_path = timestamps_path
+        self.clock_model_path = clock_model_path
+        # Created on the first write, so that a part opened ahead of time doesn't touch the disk
+        self._timestamps_writer = None
+        self._clock_model_builder = None
+        if clock_model_path is not None:
+            self._clock_model_builder = ClockModelBuilder(
+                frame_rate=output.frame_rate,
+                tolerance=clock_model_tolerance,
+                keep_raw=clock_model_keep_raw,
+            )
+
+    @property
+    def sample_count(self) -> int:
+        return self.output.sample_count
+
+    def write(self, frame: av.AudioFrame, timestamp: float):
+        if self._clock_model_builder is not None:
+            self._clock_model_builder.append(self.output.sample_count, timestamp)
+        if self._timestamps_writer is None:
+            self._timestamps_writer = TimestampWriter(self.timestamps_path)
+        self._timestamps_writer.extend(self.output.write(frame, timestamp))
+
+    def close(self):
+        if self._timestamps_writer is None:
+            self._timestamps_writer = TimestampWriter(self.timestamps_path)
+        try:
+            self._timestamps_writer.extend(self.output.close())
+        finally:
+            self._timestamps_writer.close()
+            builder, self._clock_model_builder = self._clock_model_builder, None
+            if builder is not None and builder.has_timestamps:
+                builder.save(self.clock_model_path)
+
+    def discard(self):
+        """
+        Close a part that never received any frame, without creating any file.
+        """
+        assert self._timestamps_writer is None
+        self.output.close()
+
+
+class _EncodedOutput:
+    """
+    Output container and audio stream of a sink, with a FIFO that batches frames to the encoder frame size.
+    """
+
+    def __init__(self, file_path, profile: EncoderProfile, frame_rate, layout, encode_frame_size=None, latency=None):
+        self.file_path = str(file_path)
+        self.frame_rate = int(frame_rate)
+        self.encode_call_count = 0
+        self.muxed_byte_count = 0
+        self.sample_count = 0
+        # Added to the pts of every encoded frame, e.g. to align the stream to a shared start reference
+        self.start_pts = 0
+
+        self.container = profile.open_container(file_path)
+        self.stream = profile.add_stream(self.container, self.frame_rate, layout)
+
+        if encode_frame_size is None:
+            encode_frame_size = self._native_frame_size(self.stream.codec_context)
+        self.encode_frame_size = encode_frame_size
+
+        self._fifo = av.AudioFifo() if encode_frame_size else None
+        # First sample index and timestamp of the transcoded frames that are still (partially) in the FIFO
+        self._pending_timestamps = collections.deque()
+        self._should_flush_stream = False
+        self._encode_histogram = latency.histogram("encode") if latency is not None else None
+        self._mux_histogram = latency.histogram("mux") if latency is not None else None
+
+    def write(self, frame: av.AudioFrame, timestamp: float) -> T.List[float]:
+        """
+        Encode the frame (or buffer it until an encoder frame is complete).
+
+        Returns the timestamps of the frames submitted to the encoder.
+        """
+        if self._fifo is None:
+            self.sample_count += frame.samples
+            self._encode(frame)
+            return [timestamp]
+
+        self._pending_timestamps.append((self.sample_count, timestamp))
+        self.sample_count += frame.samples
+        self._fifo.write(frame)
+
+        timestamps = []
+        while self._fifo.samples >= self.encode_frame_size:
+            timestamps.append(self._next_timestamp())
+            self._encode(self._fifo.read(self.encode_frame_size))
+        return timestamps
+
+    def close(self) -> T.List[float]:
+        """
+        Encode the samples left in the FIFO, flush the encoder and close the container.
+
+        Returns the timestamps of the frames submitted to the encoder.
+        """
+        timestamps = []
+        # Parts might be closed on another thread, which mustn't record into the histograms
+        self._encode_histogram = None
+
+        if self._fifo is not None and self._fifo.samples > 0:
+            # The last frame is allowed to be shorter than the encoder frame size
+            timestamps.append(self._next_timestamp())
+            self._encode(self._fifo.read(self._fifo.samples))
+
+        if self._should_flush_stream:
+            self._encode_and_mux(None)
+
+        self.container.close()
+        return timestamps
+
+    def _encode(self, frame: av.AudioFrame):
+        self.encode_call_count += 1
+        if self.start_pts and frame.pts is not None:
+            frame.pts += self.start_pts
+        self._encode_and_mux(frame)
+
+    def _encode_and_mux(self, frame: T.Optional[av.AudioFrame]):
+        encode_histogram = self._encode_histogram
+        if encode_histogram is None:
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+                self.muxed_byte_count += packet.size
+                self._should_flush_stream = True
+            return
+        start = time.perf_counter()
+        packets = self.stream.encode(frame)
+        encoded = time.perf_counter()
+        encode_histogram.record(encoded - start)
+        for packet in packets:
+            self.container.mux(packet)
+            self.muxed_byte_count += packet.size
+            self._should_flush_stream = True
+        self._mux_histogram.record(time.perf_counter() - encoded)
+
+    def _next_timestamp(self) -> float:
+        # Timestamp of the first sample of the next frame read from the FIFO,
+        # interpolated from the timestamp of the transcoded frame that contains it
+        sample_index = self._fifo.samples_read
+        pending = self._pending_timestamps
+        while len(pending) > 1 and pending[1][0] <= sample_index:
+            pending.popleft()
+        first_sample_index, timestamp = pending[0]
+        return timestamp + (sample_index - first_sample_index) / self.frame_rate
+
+    @staticmethod
+    def _native_frame_size(codec_context) -> int:
+        # The frame size is only known once the encoder is opened
+        try:
+            codec_context.open()
+        except (AttributeError, ValueError, OSError):
+            return 0
+        return codec_context.frame_size
 
 
 class PyAVMultipartFileSink(PyAVFileSink):
+    """
+    Splits a recording into consecutive parts, without gaps between them.
 
-    def __init__(self, *args, **kwargs):
+    The parts are rotated by the record loop itself, at a buffer boundary, either when
+    `break_part` is called or when the current part reaches `max_part_duration` seconds or
+    `max_part_size` bytes. The container of the next part is opened ahead of time on a
+    background thread, and the previous part is finalized on a background thread as well,
+    so a rotation doesn't hold up the queue. The samples buffered by the encoder of the
+    previous part are flushed into it, so none are lost.
+    """
+
+    def __init__(self, *args, max_part_duration=None, max_part_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.__base_file_path = Path(self._file_path)
         self.__base_timestamp_path = Path(self._timestamps_path)
         self.__file_counter = 0
+        self.__max_part_samples = int(max_part_duration * self._transcoder.frame_rate) if max_part_duration else None
+        self.__max_part_size = max_part_size
+        self.__is_break_requested = False
+        self.__next_part = None
+        self.__next_part_thread = None
+        self.__closing_threads = []
 
-    def start(self):
-        self.__file_counter = 0
-        super().start()
+    @property
+    def part_count(self) -> int:
+        """
+        Number of parts started by the current (or last) recording.
+        """
+        return self.__file_counter + 1
 
     def break_part(self):
-        super().stop()
-        self.__update_file_paths()
-        self._transcoder.reset()
-        super().start()
+        """
+        Start a new part at the next buffer boundary; returns immediately.
+        """
+        self.__is_break_requested = True
 
     def stop(self):
         super().stop()
 
-    def __update_file_paths(self):
+    def open_output(self):
+        # Every recording starts with the first part
+        self.__file_counter = 0
+        self.__is_break_requested = False
+        self._file_path, self._timestamps_path = self.__part_paths(0)
+        super().open_output()
+        self.__prepare_next_part()
+
+    def write(self, in_frame, in_timestamp):
+        if self.__should_rotate():
+            self.__rotate()
+        super().write(in_frame, in_timestamp)
+
+    def close_output(self):
+        try:
+            super().close_output()
+        finally:
+            self.__discard_next_part()
+            for thread in self.__closing_threads:
+                thread.join()
+            self.__closing_threads = []
+
+    def __should_rotate(self) -> bool:
+        if self.__is_break_requested:
+            return True
+        part = self._part
+        if self.__max_part_samples is not None and part.sample_count >= self.__max_part_samples:
+            return True
+        if self.__max_part_size is not None and part.output.muxed_byte_count >= self.__max_part_size:
+            return True
+        return False
+
+    def __rotate(self):
+        self.__is_break_requested = False
+
+        # The next part is usually ready long before it's needed
+        self.__next_part_thread.join()
+        next_part, self.__next_part = self.__next_part, None
+        if next_part is None:
+            # Opening the next part failed; keep recording into the current one
+            self.__prepare_next_part()
+            return
+
+        previous_part, self._part = self._part, next_part
         self.__file_counter += 1
+        self._file_path, self._timestamps_path = next_part.file_path, next_part.timestamps_path
+        # Every part starts at pts 0
+        self._transcoder.reset()
 
+        thread = threading.Thread(
+            name=f"{type(self).__name__}-close-{self.__file_counter - 1}",
+            target=self.__close_part,
+            args=(previous_part,),
+        )
+        thread.start()
+        self.__closing_threads = [t for t in self.__closing_threads if t.is_alive()] + [thread]
+
+        self.__prepare_next_part()
+
+    def __prepare_next_part(self):
+        file_path, timestamps_path = self.__part_paths(self.__file_counter + 1)
+        self.__next_part_thread = threading.Thread(
+            name=f"{type(self).__name__}-open-{self.__file_counter + 1}",
+            target=self.__open_next_part,
+            args=(file_path, timestamps_path, self._transcoder.frame_rate),
+            daemon=True,
+        )
+        self.__next_part_thread.start()
+
+    def __open_next_part(self, file_path, timestamps_path, frame_rate):
+        try:
+            self.__next_part = self._create_part(file_path, timestamps_path, frame_rate)
+        except Exception as err:
+            logger.error(err)
+
+    def __discard_next_part(self):
+        if self.__next_part_thread is not None:
+            self.__next_part_thread.join()
+            self.__next_part_thread = None
+        next_part, self.__next_part = self.__next_part, None
+        if next_part is not None:
+            next_part.discard()
+
+    @staticmethod
+    def __close_part(part):
+        try:
+            part.close()
+        except Exception as err:
+            logger.error(err)
+
+    def __part_paths(self, counter: int) -> T.Tuple[str, str]:
         file_path = self.__base_file_path
         time_path = self.__base_timestamp_path
 
-        file_path = file_path.with_name(file_path.stem + f"-{self.__file_counter}").with_suffix(file_path.suffix)
-        time_path = time_path.with_name(time_path.stem + f"-{self.__file_counter}").with_suffix(time_path.suffix)
+        if counter > 0:
+            file_path = file_path.with_name(file_path.stem + f"-{counter}").with_suffix(file_path.suffix)
+            time_path = time_path.with_name(time_path.stem + f"-{counter}").with_suffix(time_path.suffix)
 
-        self._file_path = str(file_path)
-        self._timestamps_path = str(time_path)
+        return str(file_path), str(time_path)
@@ -0,0 +1,103 @@
+import time
+import typing as T
+
+import numpy as np
+
+from pupil_audio.utils.wav import WavMmapWriter
+
+from .pyav import PyAVFileSink, PyAVMultipartFileSink
+
+
+class WavMmapFileSink(PyAVFileSink):
+    """
+    Writes the `(in_frame, TimeInfo)` items of `in_queue` into an uncompressed WAV file.
+
+    The interleaved PyAudio buffers are copied as they are into the file, through a memory map
+    preallocated in extents of `extent_duration` seconds (see `WavMmapWriter`), so recording
+    doesn't transcode, encode or allocate anything per buffer. The transcoder only provides
+    the format of the samples; `encoder_profile` and `encode_frame_size` are ignored.
+
+    Timestamps and the optional clock model are written just like by `PyAVFileSink`, with one
+    timestamp per buffer. A file left behind by a crash can be repaired with `recover_wav`.
+
+    With `latency`, the copy of every buffer into the file is recorded as its `mux` stage.
+    """
+
+    def __init__(self, *args, extent_duration=60., **kwargs):
+        super().__init__(*args, **kwargs)
+        self._extent_duration = extent_duration
+
+    def write(self, in_frame, in_timestamp):
+        if self._latency is None:
+            self._part.write(in_frame, in_timestamp.input_buffer_adc_time)
+            return
+        start = self._record_queue_latency(in_timestamp)
+        self._part.write(in_frame, in_timestamp.input_buffer_adc_time)
+        self._latency.histogram("mux").record(time.perf_counter() - start)
+
+    def _create_output(self, file_path, frame_rate) -> "_WavMmapOutput":
+        transcoder = self._transcoder
+        bytes_per_second = int(frame_rate) * transcoder.channels * transcoder.dtype.itemsize
+        return _WavMmapOutput(
+            file_path=file_path,
+            frame_rate=frame_rate,
+            channels=transcoder.channels,
+            dtype=transcoder.dtype,
+            extent_size=int(self._extent_duration * bytes_per_second),
+        )
+
+
+class WavMmapMultipartFileSink(PyAVMultipartFileSink, WavMmapFileSink):
+    """
+    Splits a WAV recording into consecutive parts, like `PyAVMultipartFileSink`.
+
+    WAV files can't hold more than 4 GiB of samples, so `max_part_size` defaults to just below that.
+    """
+
+    def __init__(self, *args, max_part_size=WavMmapWriter.MAX_DATA_SIZE - 64 * 1024 * 1024, **kwargs):
+        super().__init__(*args, max_part_size=max_part_size, **kwargs)
+
+
+class _WavMmapOutput:
+    """
+    Output of a `WavMmapFileSink`, with the same interface as the encoded output of `PyAVFileSink`.
+
+    The file is only created by the first write, so a part opened ahead of time doesn't touch the disk.
+    """
+
+    def __init__(self, file_path, frame_rate, channels, dtype, extent_size):
+        self.file_path = str(file_path)
+        self.frame_rate = int(frame_rate)
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.extent_size = extent_size
+        self.encode_call_count = 0
+        self.muxed_byte_count = 0
+        self.sample_count = 0
+        # Frames of silence written before the first buffer, e.g. to align the file to a shared start reference
+        self.start_pts = 0
+        self._writer = None
+
+    def write(self, samples, timestamp: float) -> T.List[float]:
+        writer = self._writer
+        if writer is None:
+            writer = self._writer = WavMmapWriter(
+                self.file_path,
+                frame_rate=self.frame_rate,
+                channels=self.channels,
+                dtype=self.dtype,
+                extent_size=self.extent_size,
+            )
+            if self.start_pts > 0:
+                writer.write_silence(self.start_pts)
+
+        writer.write(samples)
+        self.encode_call_count += 1
+        self.sample_count = writer.frame_count - max(self.start_pts, 0)
+        self.muxed_byte_count = writer.byte_count
+        return [timestamp]
+
+    def close(self) -> T.List[float]:
+        if self._writer is not None:
+            self._writer.close()
+        return []
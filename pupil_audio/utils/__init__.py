@@ -1,4 +1,9 @@
+import time
+import heapq
+import weakref
+import itertools
 import threading
+import typing as T
 
 
 def key_property(key: str, **kwargs):
@@ -37,25 +42,21 @@ def lazy_property(init_fn, **kwargs):
 
     # TODO: Make this thread-safe
 
-    _storage = None
-    _did_init = False
+    # The value is stored per instance, under a key that is unique to this property
+    storage_key = f"_lazy_property_{next(_lazy_property_counter)}"
 
     def fget(self):
-        nonlocal _did_init, _storage, init_fn
-        if not _did_init:
-            _storage = init_fn(self)
-            _did_init = True
-        return _storage
+        try:
+            return self.__dict__[storage_key]
+        except KeyError:
+            value = self.__dict__[storage_key] = init_fn(self)
+            return value
 
     def fset(self, value):
-        nonlocal _did_init, _storage
-        _storage = value
-        _did_init = True
+        self.__dict__[storage_key] = value
 
     def fdel(self):
-        nonlocal _did_init, _storage
-        del _storage
-        del _did_init
+        self.__dict__.pop(storage_key, None)
 
     if is_readonly:
         return property(fget=fget)
@@ -63,6 +64,9 @@ def lazy_property(init_fn, **kwargs):
         return property(fget=fget, fset=fset, fdel=fdel)
 
 
+_lazy_property_counter = itertools.count()
+
+
 class HeartbeatMixin:
 
     # Public
@@ -79,9 +83,13 @@ class HeartbeatMixin:
         The client of the mixin is responsible to call this method periodically,
         in intervals less than `heartbeat_timeout` to avoid `on_heartbeat_unexpectedly_stopped`
         from being called.
+
+        This only records the time of the heartbeat; the deadlines of all instances
+        are checked by a single, shared watchdog thread.
         """
-        self.__destroy_heartbeat_timer()
-        self.__create_heartbeat_timer()
+        self.__last_heartbeat_time = time.monotonic()
+        if self.__heartbeat_token is None:
+            _HeartbeatWatchdog.shared().arm(self)
 
     def heartbeat_complete(self):
         """
@@ -94,20 +102,135 @@ class HeartbeatMixin:
     def on_heartbeat_unexpectedly_stopped(self):
         self.__destroy_heartbeat_timer()
 
+    # Protected
+
+    def _heartbeat_deadline(self, token) -> T.Optional[float]:
+        """
+        Called by the watchdog (holding its lock) to get the current deadline of the heartbeat
+        armed with `token`, or `None` if the heartbeat was completed or re-armed since.
+        """
+        if token is None or token != self.__heartbeat_token:
+            return None
+        return self.__last_heartbeat_time + self.heartbeat_timeout
+
+    def _heartbeat_arm(self, token) -> T.Optional[float]:
+        """
+        Called by the watchdog (holding its lock) to arm the heartbeat with `token`.
+        Returns `None` if the heartbeat is already armed.
+        """
+        if self.__heartbeat_token is not None:
+            return None
+        self.__heartbeat_token = token
+        return self._heartbeat_deadline(token)
+
+    def _heartbeat_disarm(self, token=None) -> bool:
+        """
+        Called by the watchdog (holding its lock) to disarm the heartbeat.
+        Returns `True` if the heartbeat was armed (with `token`, if specified).
+        """
+        if self.__heartbeat_token is None or (token is not None and token != self.__heartbeat_token):
+            return False
+        self.__heartbeat_token = None
+        return True
+
     # Private
 
-    __heartbeat_is_running = lazy_property(lambda self: threading.Event())
+    __heartbeat_token = None
+    __last_heartbeat_time = 0.
 
     def __destroy_heartbeat_timer(self):
-        if self.__heartbeat_is_running.is_set():
-            self.__heartbeat_is_running.clear()
-            self.__heatbeat_timer.cancel()
-            self.__heatbeat_timer = None
-
-    def __create_heartbeat_timer(self):
-        if not self.__heartbeat_is_running.is_set():
-            self.__heartbeat_is_running.set()
-            self.__heatbeat_timer = threading.Timer(
-                self.heartbeat_timeout, self.on_heartbeat_unexpectedly_stopped
-            )
-            self.__heatbeat_timer.start()
+        if self.__heartbeat_token is not None:
+            _HeartbeatWatchdog.shared().disarm(self)
+
+
+class _HeartbeatWatchdog:
+    """
+    Single thread that tracks the heartbeat deadlines of all `HeartbeatMixin` instances in a heap.
+
+    Heartbeats only update a timestamp, so entries in the heap can be stale; an entry that
+    reaches its deadline is re-scheduled with the instance's current deadline, unless
+    that deadline has passed too.
+    """
+
+    # Public
+
+    @staticmethod
+    def shared() -> "_HeartbeatWatchdog":
+        watchdog = _HeartbeatWatchdog._shared_instance
+        if watchdog is None:
+            with _HeartbeatWatchdog._shared_instance_lock:
+                watchdog = _HeartbeatWatchdog._shared_instance
+                if watchdog is None:
+                    watchdog = _HeartbeatWatchdog._shared_instance = _HeartbeatWatchdog()
+        return watchdog
+
+    def __init__(self, time_fn=time.monotonic):
+        self.__time_fn = time_fn
+        self.__condition = threading.Condition(threading.Lock())
+        self.__deadlines = []
+        self.__tokens = itertools.count()
+        self.__thread = None
+
+    def arm(self, mixin: HeartbeatMixin):
+        with self.__condition:
+            token = next(self.__tokens)
+            deadline = mixin._heartbeat_arm(token)
+            if deadline is None:
+                return
+            heapq.heappush(self.__deadlines, (deadline, token, weakref.ref(mixin)))
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    name=type(self).__name__,
+                    target=self.__watch_loop,
+                    daemon=True,
+                )
+                self.__thread.start()
+            self.__condition.notify()
+
+    def disarm(self, mixin: HeartbeatMixin):
+        with self.__condition:
+            # The entry is left in the heap, and discarded once it reaches its deadline
+            mixin._heartbeat_disarm()
+
+    # Private
+
+    _shared_instance = None
+    _shared_instance_lock = threading.Lock()
+
+    def __watch_loop(self):
+        time_fn = self.__time_fn
+        deadlines = self.__deadlines
+
+        while True:
+            with self.__condition:
+                while not deadlines:
+                    self.__condition.wait()
+
+                deadline, token, mixin_ref = deadlines[0]
+                remaining_time = deadline - time_fn()
+                if remaining_time > 0:
+                    self.__condition.wait(remaining_time)
+                    continue
+
+                heapq.heappop(deadlines)
+
+                mixin = mixin_ref()
+                if mixin is None:
+                    continue
+
+                deadline = mixin._heartbeat_deadline(token)
+                if deadline is None:
+                    continue
+
+                if deadline > time_fn():
+                    heapq.heappush(deadlines, (deadline, token, mixin_ref))
+                    continue
+
+                mixin._heartbeat_disarm(token)
+
+            # The callback might block (e.g. joining threads), so don't run it on the watchdog thread
+            threading.Thread(
+                name=f"{type(mixin).__name__}.on_heartbeat_unexpectedly_stopped",
+                target=mixin.on_heartbeat_unexpectedly_stopped,
+                daemon=True,
+            ).start()
@@ -0,0 +1,243 @@
+import array
+import math
+import typing as T
+
+import numpy as np
+
+
+class ClockModel:
+    """
+    Piecewise-linear model of the time of every sample of a recording.
+
+    The model is a continuous polyline through `(sample index, time)` breakpoints, which is
+    within `tolerance` seconds of every timestamp it was fitted to. Since the drift between the
+    sample clock and the ADC clock is slow, a recording of several hours only needs a handful
+    of breakpoints, instead of one timestamp per buffer.
+
+    `sample_to_time` and `time_to_sample` are vectorized and look up the segment of every
+    value with `np.searchsorted`. Values outside the breakpoints are extrapolated from the
+    first or last segment.
+    """
+
+    def __init__(self, breakpoint_samples, breakpoint_times, frame_rate: float, tolerance: float = 0.):
+        breakpoint_samples = np.asarray(breakpoint_samples, dtype=np.int64)
+        breakpoint_times = np.asarray(breakpoint_times, dtype=np.float64)
+        assert breakpoint_samples.ndim == breakpoint_times.ndim == 1
+        assert breakpoint_samples.size == breakpoint_times.size > 0
+        assert np.all(np.diff(breakpoint_samples) > 0), "Breakpoint sample indices must be increasing"
+
+        self.breakpoint_samples = breakpoint_samples
+        self.breakpoint_times = breakpoint_times
+        self.frame_rate = float(frame_rate)
+        self.tolerance = float(tolerance)
+
+        if breakpoint_samples.size > 1:
+            self._slopes = np.diff(breakpoint_times) / np.diff(breakpoint_samples)
+        else:
+            # A single timestamp; assume the nominal frame rate
+            self._slopes = np.array([1. / self.frame_rate])
+
+    def __len__(self) -> int:
+        return self.breakpoint_samples.size
+
+    @staticmethod
+    def fit(sample_indices, times, frame_rate: float, tolerance: float = 1e-4) -> "ClockModel":
+        """
+        Fit a model to the timestamps `times` of the samples `sample_indices`.
+        """
+        builder = ClockModelBuilder(frame_rate=frame_rate, tolerance=tolerance)
+        for sample_index, time in zip(np.asarray(sample_indices).tolist(), np.asarray(times).tolist()):
+            builder.append(sample_index, time)
+        return builder.model()
+
+    def sample_to_time(self, sample_indices) -> np.ndarray:
+        samples = np.asarray(sample_indices, dtype=np.float64)
+        segments = self._segments(self.breakpoint_samples, samples)
+        return self.breakpoint_times[segments] + (samples - self.breakpoint_samples[segments]) * self._slopes[segments]
+
+    def time_to_sample(self, times) -> np.ndarray:
+        """
+        Fractional sample positions of `times`; round them to get sample indices.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        segments = self._segments(self.breakpoint_times, times)
+        return self.breakpoint_samples[segments] + (times - self.breakpoint_times[segments]) / self._slopes[segments]
+
+    def save(self, path: str, raw_sample_indices=None, raw_times=None):
+        """
+        Save the model as `.npz`, optionally with the raw timestamps it was fitted to as a delta-encoded side table.
+        """
+        arrays = dict(
+            breakpoint_samples=self.breakpoint_samples,
+            breakpoint_times=self.breakpoint_times,
+            frame_rate=np.float64(self.frame_rate),
+            tolerance=np.float64(self.tolerance),
+        )
+        if raw_sample_indices is not None and raw_times is not None:
+            arrays.update(_delta_encode(raw_sample_indices, raw_times))
+        np.savez_compressed(path, **arrays)
+
+    @staticmethod
+    def load(path: str) -> "ClockModel":
+        # The side table isn't read, since `np.load` reads the arrays of an `.npz` lazily
+        with np.load(path) as data:
+            return ClockModel(
+                breakpoint_samples=data["breakpoint_samples"],
+                breakpoint_times=data["breakpoint_times"],
+                frame_rate=float(data["frame_rate"]),
+                tolerance=float(data["tolerance"]),
+            )
+
+    @staticmethod
+    def load_raw(path: str) -> T.Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the raw `(sample_indices, times)` saved with the model; empty if there is no side table.
+        """
+        with np.load(path) as data:
+            if "raw_sample_deltas" not in data:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+            return _delta_decode(data)
+
+    # Private
+
+    def _segments(self, breakpoints: np.ndarray, values: np.ndarray) -> np.ndarray:
+        segments = np.searchsorted(breakpoints, values, side="right") - 1
+        return np.clip(segments, 0, self._slopes.size - 1)
+
+
+class ClockModelBuilder:
+    """
+    Fits a `ClockModel` incrementally, one timestamp at a time, in constant time per timestamp.
+
+    Segments are extended for as long as a line from the start of the segment can pass within
+    `tolerance` of all of its timestamps ("swing door" compression). Only the breakpoints are
+    kept, unless `keep_raw` is set, in which case the timestamps are also kept (as compact
+    arrays) to be saved as the side table of the model.
+
+    Timestamps that are NaN, or that don't increase, are ignored.
+    """
+
+    def __init__(self, frame_rate: float, tolerance: float = 1e-4, keep_raw: bool = False):
+        assert tolerance >= 0
+        self.frame_rate = float(frame_rate)
+        self.tolerance = float(tolerance)
+        self.keep_raw = keep_raw
+
+        self._breakpoint_samples = []
+        self._breakpoint_times = []
+        self._raw_sample_indices = array.array("q")
+        self._raw_times = array.array("d")
+
+        # Start of the current segment, and the range of slopes that keep all its points within tolerance
+        self._anchor = None
+        self._slope_min = -math.inf
+        self._slope_max = math.inf
+        self._last = None
+
+    def append(self, sample_index: int, time: float):
+        if math.isnan(time):
+            return
+        if self._last is not None and (sample_index <= self._last[0] or time <= self._last[1]):
+            return
+
+        if self.keep_raw:
+            self._raw_sample_indices.append(sample_index)
+            self._raw_times.append(time)
+
+        if self._anchor is None:
+            self._anchor = (sample_index, time)
+            self._breakpoint_samples.append(sample_index)
+            self._breakpoint_times.append(time)
+            self._last = self._anchor
+            return
+
+        anchor_sample, anchor_time = self._anchor
+        elapsed = sample_index - anchor_sample
+        slope_min = max(self._slope_min, (time - self.tolerance - anchor_time) / elapsed)
+        slope_max = min(self._slope_max, (time + self.tolerance - anchor_time) / elapsed)
+
+        if slope_min <= slope_max:
+            self._slope_min, self._slope_max = slope_min, slope_max
+            self._last = (sample_index, time)
+            return
+
+        # No single line fits the segment anymore; end it at the previous point, and start a new one there
+        self._close_segment()
+        anchor_sample, anchor_time = self._anchor
+        elapsed = sample_index - anchor_sample
+        self._slope_min = (time - self.tolerance - anchor_time) / elapsed
+        self._slope_max = (time + self.tolerance - anchor_time) / elapsed
+        self._last = (sample_index, time)
+
+    @property
+    def has_timestamps(self) -> bool:
+        return self._anchor is not None
+
+    def model(self) -> ClockModel:
+        assert self._anchor is not None, "No timestamps were appended"
+        samples = list(self._breakpoint_samples)
+        times = list(self._breakpoint_times)
+        if self._last is not None and self._last[0] != self._anchor[0]:
+            end_sample, end_time = self._segment_end()
+            samples.append(end_sample)
+            times.append(end_time)
+        return ClockModel(samples, times, frame_rate=self.frame_rate, tolerance=self.tolerance)
+
+    def save(self, path: str):
+        model = self.model()
+        if self.keep_raw:
+            model.save(path, np.frombuffer(self._raw_sample_indices, dtype=np.int64), np.frombuffer(self._raw_times, dtype=np.float64))
+        else:
+            model.save(path)
+
+    # Private
+
+    def _segment_end(self) -> T.Tuple[int, float]:
+        anchor_sample, anchor_time = self._anchor
+        end_sample, last_time = self._last
+        # Of the slopes that fit, pick the one ending closest to the last timestamp, since the next segment starts there
+        slope = min(max((last_time - anchor_time) / (end_sample - anchor_sample), self._slope_min), self._slope_max)
+        return end_sample, anchor_time + slope * (end_sample - anchor_sample)
+
+    def _close_segment(self):
+        end_sample, end_time = self._segment_end()
+        self._breakpoint_samples.append(end_sample)
+        self._breakpoint_times.append(end_time)
+        # The next segment starts where this one ends, so the model stays continuous
+        self._anchor = (end_sample, end_time)
+
+
+def _delta_encode(sample_indices, times) -> T.Dict[str, np.ndarray]:
+    sample_indices = np.asarray(sample_indices, dtype=np.int64)
+    times = np.asarray(times, dtype=np.float64)
+    assert sample_indices.size == times.size
+
+    if sample_indices.size == 0:
+        return {}
+
+    # Times are stored as integer nanoseconds relative to the first timestamp
+    time_ns = np.round((times - times[0]) * 1e9).astype(np.int64)
+
+    return dict(
+        raw_sample_start=sample_indices[0],
+        raw_sample_deltas=_narrowest(np.diff(sample_indices)),
+        raw_time_start=times[0],
+        raw_time_deltas_ns=_narrowest(np.diff(time_ns)),
+    )
+
+
+def _delta_decode(data) -> T.Tuple[np.ndarray, np.ndarray]:
+    sample_deltas = data["raw_sample_deltas"].astype(np.int64)
+    time_deltas_ns = data["raw_time_deltas_ns"].astype(np.int64)
+    sample_indices = np.concatenate([[0], np.cumsum(sample_deltas)]) + int(data["raw_sample_start"])
+    time_ns = np.concatenate([[0], np.cumsum(time_deltas_ns)])
+    times = float(data["raw_time_start"]) + time_ns / 1e9
+    return sample_indices, times
+
+
+def _narrowest(values: np.ndarray) -> np.ndarray:
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return values.astype(dtype)
+    return values
@@ -0,0 +1,172 @@
+import os
+import errno
+import struct
+import select
+import logging
+import platform
+import ctypes
+import ctypes.util
+import typing as T
+
+
+logger = logging.getLogger(__name__)
+
+
+class InotifyUnavailable(OSError):
+    pass
+
+
+class DeviceNodeWatcher:
+    """
+    Watches a directory of device nodes (e.g. `/dev/snd`) for created, deleted and modified entries.
+
+    Uses Linux inotify through libc; `InotifyUnavailable` is raised on other platforms,
+    or if the directory can't be watched.
+    """
+
+    # Public
+
+    DEFAULT_PATH = "/dev/snd"
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = str(path)
+        self.__is_valid = False
+        self.__inotify_fd = None
+        self.__wake_read_fd, self.__wake_write_fd = None, None
+
+        libc = self._libc()
+
+        fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise InotifyUnavailable(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self.__inotify_fd = fd
+
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.path), self._WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            self.close()
+            raise InotifyUnavailable(err, f"Can't watch \"{self.path}\": {os.strerror(err)}")
+
+        self.__wake_read_fd, self.__wake_write_fd = os.pipe()
+        os.set_blocking(self.__wake_read_fd, False)
+        os.set_blocking(self.__wake_write_fd, False)
+        self.__is_valid = True
+
+    @staticmethod
+    def is_supported() -> bool:
+        try:
+            DeviceNodeWatcher._libc()
+            return True
+        except InotifyUnavailable:
+            return False
+
+    @property
+    def is_valid(self) -> bool:
+        """
+        `False` once the watched directory itself was removed or the watcher was closed.
+        """
+        return self.__is_valid
+
+    def wait(self, timeout: T.Optional[float] = None) -> bool:
+        """
+        Block until an entry of the watched directory changes, `wake` is called, or the timeout expires.
+
+        Returns `True` if any change was observed.
+        """
+        if not self.__is_valid:
+            return False
+
+        read_fds = [self.__inotify_fd, self.__wake_read_fd]
+        try:
+            ready, _, _ = select.select(read_fds, [], [], timeout)
+        except InterruptedError:
+            return False
+
+        if self.__wake_read_fd in ready:
+            self.__drain(self.__wake_read_fd)
+
+        if self.__inotify_fd in ready:
+            return self.__read_events()
+
+        return False
+
+    def wake(self):
+        """
+        Wake up a thread that's blocked in `wait`.
+        """
+        if self.__wake_write_fd is not None:
+            try:
+                os.write(self.__wake_write_fd, b"\0")
+            except BlockingIOError:
+                pass  # The pipe is already full, so the waiter is going to wake up anyway
+
+    def close(self):
+        self.__is_valid = False
+        for fd in (self.__inotify_fd, self.__wake_read_fd, self.__wake_write_fd):
+            if fd is not None:
+                os.close(fd)
+        self.__inotify_fd = None
+        self.__wake_read_fd, self.__wake_write_fd = None, None
+
+    # Private
+
+    # https://github.com/torvalds/linux/blob/master/include/uapi/linux/inotify.h
+    _IN_ATTRIB = 0x00000004
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_DELETE_SELF = 0x00000400
+    _IN_MOVE_SELF = 0x00000800
+    _IN_IGNORED = 0x00008000
+    _IN_NONBLOCK = 0o00004000
+    _IN_CLOEXEC = 0o02000000
+
+    _WATCH_MASK = (
+        _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+    )
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    _cached_libc = None
+
+    @staticmethod
+    def _libc():
+        if DeviceNodeWatcher._cached_libc is not None:
+            return DeviceNodeWatcher._cached_libc
+        if platform.system() != "Linux":
+            raise InotifyUnavailable(errno.ENOSYS, "inotify is only available on Linux")
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        except (OSError, AttributeError) as err:
+            raise InotifyUnavailable(errno.ENOSYS, f"inotify is not available: {err}")
+        DeviceNodeWatcher._cached_libc = libc
+        return libc
+
+    def __read_events(self) -> bool:
+        did_change = False
+        while True:
+            try:
+                data = os.read(self.__inotify_fd, 4096)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + self._EVENT_HEADER.size <= len(data):
+                _, mask, _, name_len = self._EVENT_HEADER.unpack_from(data, offset)
+                offset += self._EVENT_HEADER.size + name_len
+                if mask & (self._IN_DELETE_SELF | self._IN_MOVE_SELF | self._IN_IGNORED):
+                    logger.debug(f"Watched directory \"{self.path}\" is gone")
+                    self.__is_valid = False
+                did_change = True
+        return did_change
+
+    @staticmethod
+    def __drain(fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except BlockingIOError:
+            pass
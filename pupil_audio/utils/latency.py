@@ -0,0 +1,180 @@
+import os
+import array
+import bisect
+import typing as T
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations (in seconds) with fixed buckets, for instrumenting hot paths.
+
+    The counts are kept in a preallocated array, so `record` only does a bisection of the
+    bucket bounds and a few additions, and never allocates. A histogram must be recorded
+    from a single thread; reading it from other threads is fine, but a snapshot taken while
+    it's recorded might be off by the value being recorded.
+    """
+
+    # 1-2-5 series from 1 µs to 10 sec
+    DEFAULT_BOUNDS = tuple(m * 10. ** e for e in range(-6, 1) for m in (1, 2, 5)) + (10.,)
+
+    def __init__(self, bounds: T.Sequence[float] = DEFAULT_BOUNDS):
+        bounds = [float(b) for b in bounds]
+        assert bounds == sorted(bounds) and len(set(bounds)) == len(bounds), "Bucket bounds must be increasing"
+        self.bounds = tuple(bounds)
+        self._bounds = bounds
+        # One bucket per upper bound, plus one for the values above the last bound
+        self._counts = array.array("q", bytes(8 * (len(bounds) + 1)))
+        self._sum = 0.
+        self._max = 0.
+
+    def __len__(self) -> int:
+        return sum(self._counts)
+
+    def record(self, seconds: float):
+        # Buckets include their upper bound, like Prometheus buckets
+        self._counts[bisect.bisect_left(self._bounds, seconds)] += 1
+        self._sum += seconds
+        if seconds > self._max:
+            self._max = seconds
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Add the values recorded by `other`, which must have the same bounds.
+        """
+        assert other.bounds == self.bounds, "Can't merge histograms with different bounds"
+        for i, count in enumerate(other._counts):
+            self._counts[i] += count
+        self._sum += other._sum
+        self._max = max(self._max, other._max)
+
+    def reset(self):
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self._sum = 0.
+        self._max = 0.
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Count of every bucket, the last one being the values above the last bound.
+        """
+        return np.array(self._counts, dtype=np.int64)
+
+    @property
+    def total(self) -> float:
+        return self._sum
+
+    @property
+    def max(self) -> float:
+        return self._max
+
+    @property
+    def mean(self) -> float:
+        count = len(self)
+        return self._sum / count if count else float("nan")
+
+    def percentile(self, q: float) -> float:
+        """
+        Upper bound of the bucket that holds the `q`-th percentile (0 to 100).
+
+        The result is capped to the largest recorded value, which is also reported for the values
+        beyond the last bound.
+        """
+        counts = self.counts
+        count = int(counts.sum())
+        if count == 0:
+            return float("nan")
+        index = int(np.searchsorted(np.cumsum(counts), q / 100. * count, side="left"))
+        return min(self.bounds[index], self._max) if index < len(self.bounds) else self._max
+
+    def summary(self) -> T.Dict[str, float]:
+        return {
+            "count": len(self),
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self._max,
+        }
+
+
+class PipelineLatency:
+    """
+    Latency histograms of the stages of a capture pipeline.
+
+    The stages are timed with `time.perf_counter` by the components they belong to:
+
+    - `callback`: the PortAudio callback of the source
+    - `queue`: from the moment the source queued a buffer until the sink picked it up
+    - `transcode`: `PyAudio2PyAVTranscoder.transcode`
+    - `encode`: encoding a frame (`stream.encode`)
+    - `mux`: writing the packets of a frame to the container (`container.mux`)
+
+    Every stage is recorded by a single thread, and the histograms can be read at any time.
+    """
+
+    STAGES = ("callback", "queue", "transcode", "encode", "mux")
+
+    def __init__(self, bounds: T.Sequence[float] = LatencyHistogram.DEFAULT_BOUNDS, stages: T.Sequence[str] = STAGES):
+        self.histograms = {stage: LatencyHistogram(bounds) for stage in stages}
+
+    def histogram(self, stage: str) -> LatencyHistogram:
+        return self.histograms[stage]
+
+    @staticmethod
+    def merged(latencies: T.Iterable["PipelineLatency"]) -> "PipelineLatency":
+        """
+        Combine the histograms of several pipelines, e.g. of the devices of a multi-device recording.
+        """
+        result = None
+        for latency in latencies:
+            if result is None:
+                first = next(iter(latency.histograms.values()))
+                result = PipelineLatency(bounds=first.bounds, stages=tuple(latency.histograms))
+            for stage, histogram in latency.histograms.items():
+                result.histogram(stage).merge(histogram)
+        return result if result is not None else PipelineLatency()
+
+    def summary(self) -> T.Dict[str, T.Dict[str, float]]:
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def prometheus_text(self, name: str = "pupil_audio_stage_latency_seconds", labels: T.Mapping[str, str] = None) -> str:
+        """
+        Format the histograms in the Prometheus text exposition format.
+        """
+        labels = dict(labels or {})
+        lines = [
+            f"# HELP {name} Latency of the stages of the audio capture pipeline.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, histogram in self.histograms.items():
+            stage_labels = _prometheus_labels(dict(labels, stage=stage))
+            cumulative = np.cumsum(histogram.counts)
+            for bound, count in zip(histogram.bounds, cumulative):
+                lines.append(f'{name}_bucket{{{stage_labels},le="{bound:g}"}} {count}')
+            lines.append(f'{name}_bucket{{{stage_labels},le="+Inf"}} {cumulative[-1]}')
+            lines.append(f"{name}_sum{{{stage_labels}}} {histogram.total!r}")
+            lines.append(f"{name}_count{{{stage_labels}}} {cumulative[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, **kwargs):
+        """
+        Write `prometheus_text` to `path`, e.g. for the textfile collector of the node exporter.
+
+        The file is replaced atomically, so a collector never reads a partial file.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.prometheus_text(**kwargs))
+        os.replace(temp_path, path)
+
+
+def _prometheus_labels(labels: T.Mapping[str, str]) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
@@ -1,3 +1,6 @@
+import time
+import types
+import atexit
 import logging
 import platform
 import itertools
@@ -25,6 +28,8 @@ class TimeInfo(dict):
     current_time           = key_property("current_time",           type=float, readonly=True)
     input_buffer_adc_time  = key_property("input_buffer_adc_time",  type=float, readonly=True)
     output_buffer_dac_time = key_property("output_buffer_dac_time", type=float, readonly=True)
+    # Not part of PortAudio: `time.perf_counter()` when the source queued the buffer, if latency is measured
+    queued_time            = key_property("queued_time",            type=float, readonly=True)
 
 
 class HostApiInfo(dict):
@@ -43,63 +48,49 @@ class HostApiInfo(dict):
 
     @staticmethod
     def supported() -> T.Iterator["HostApiInfo"]:
-        with PyAudioManager.shared_instance() as manager:
-            api_count = manager.get_host_api_count()
-            for api_index in range(api_count):
-                yield HostApiInfo._find_with_api_index(api_index)
+        yield from DeviceSnapshot.current().host_apis
 
     @staticmethod
     def default() -> T.Optional["HostApiInfo"]:
-        if platform.system() == "Linux":
-            return HostApiInfo._default_on_linux()
-        elif platform.system() == "Darwin":
-            return HostApiInfo._default_on_macos()
-        elif platform.system() == "Windows":
-            return HostApiInfo._default_on_windows()
-        else:
-            raise UnsupportedOperatingSystem()
+        return DeviceSnapshot.current().default_host_api
 
     @property
     def has_devices(self) -> bool:
-        for _ in self.enumerate_devices():
-            return True
-        return False
+        return len(DeviceSnapshot.current().devices_by_host_api.get(self.index, ())) > 0
 
     def enumerate_devices(self) -> T.Iterator["DeviceInfo"]:
-        with PyAudioManager.shared_instance() as manager:
-            for device_index in range(self.device_count):
-                try:
-                    device_info = manager.get_device_info_by_host_api_device_index(self.index, device_index)
-                    yield DeviceInfo(device_info)
-                except IOError:
-                    pass
+        yield from DeviceSnapshot.current().devices_by_host_api.get(self.index, ())
 
     # Private
 
     @staticmethod
-    def _default_on_linux() -> T.Optional["HostApiInfo"]:
-        return HostApiInfo._default_with_priority(pyaudio.paALSA)
-
-    @staticmethod
-    def _default_on_macos() -> T.Optional["HostApiInfo"]:
-        return HostApiInfo._default_with_priority(pyaudio.paCoreAudio)
-
-    @staticmethod
-    def _default_on_windows() -> T.Optional["HostApiInfo"]:
-        return HostApiInfo._default_with_priority(pyaudio.paDirectSound)
+    def _prioritised_api_types() -> T.Tuple[int, ...]:
+        if platform.system() == "Linux":
+            return (pyaudio.paALSA,)
+        elif platform.system() == "Darwin":
+            return (pyaudio.paCoreAudio,)
+        elif platform.system() == "Windows":
+            return (pyaudio.paDirectSound,)
+        else:
+            raise UnsupportedOperatingSystem()
 
     @staticmethod
-    def _default_with_priority(*prioritised_api_types) -> T.Optional["HostApiInfo"]:
-        prioritised_apis = filter(None, map(HostApiInfo._find_with_api_type, prioritised_api_types))
+    def _default_with_priority(
+        host_apis: T.Sequence["HostApiInfo"],
+        devices_by_host_api: T.Mapping[int, T.Sequence["DeviceInfo"]],
+        *prioritised_api_types,
+    ) -> T.Optional["HostApiInfo"]:
+        apis_by_type = {api_info.type: api_info for api_info in host_apis}
+        prioritised_apis = filter(None, map(apis_by_type.get, prioritised_api_types))
 
-        all_apis = itertools.chain(prioritised_apis, HostApiInfo.supported())
+        all_apis = itertools.chain(prioritised_apis, host_apis)
 
         first_api_info = None
 
         for api_info in all_apis:
             if first_api_info is None:
                 first_api_info = api_info
-            if api_info.has_devices:
+            if len(devices_by_host_api.get(api_info.index, ())) > 0:
                 return api_info
 
         if first_api_info is not None:
@@ -111,21 +102,25 @@ class HostApiInfo(dict):
 
     @staticmethod
     def _find_with_api_type(api_type) -> T.Optional["HostApiInfo"]:
-        with PyAudioManager.shared_instance() as manager:
-            try:
-                api_info = manager.get_host_api_info_by_type(api_type)
-                return HostApiInfo(api_info)
-            except IOError:
-                return None
+        for api_info in DeviceSnapshot.current().host_apis:
+            if api_info.type == api_type:
+                return api_info
+        return None
 
     @staticmethod
     def _find_with_api_index(api_index) -> T.Optional["HostApiInfo"]:
-        with PyAudioManager.shared_instance() as manager:
+        for api_info in DeviceSnapshot.current().host_apis:
+            if api_info.index == api_index:
+                return api_info
+        return None
+
+    def _enumerate_devices_uncached(self, manager: pyaudio.PyAudio) -> T.Iterator["DeviceInfo"]:
+        for device_index in range(self.device_count):
             try:
-                api_info = manager.get_host_api_info_by_index(api_index)
-                return HostApiInfo(api_info)
+                device_info = manager.get_device_info_by_host_api_device_index(self.index, device_index)
+                yield DeviceInfo(device_info)
             except IOError:
-                return None
+                pass
 
 
 class DeviceInfo(dict):
@@ -156,11 +151,11 @@ class DeviceInfo(dict):
 
     @staticmethod
     def default_input() -> T.Optional["DeviceInfo"]:
-        return DeviceInfo._default_device(getter=pyaudio.PyAudio.get_default_input_device_info)
+        return DeviceSnapshot.current().default_input
 
     @staticmethod
     def default_output() -> T.Optional["DeviceInfo"]:
-        return DeviceInfo._default_device(getter=pyaudio.PyAudio.get_default_output_device_info)
+        return DeviceSnapshot.current().default_output
 
     @staticmethod
     def named_input(name: str) -> "DeviceInfo":
@@ -172,44 +167,28 @@ class DeviceInfo(dict):
 
     @staticmethod
     def inputs_by_name() -> T.Mapping[str, "DeviceInfo"]:
-        return {name: device_info for name, device_info in DeviceInfo.devices_by_name().items() if device_info.max_input_channels > 0}
+        return DeviceSnapshot.current().inputs_by_name
 
     @staticmethod
     def outputs_by_name() -> T.Mapping[str, "DeviceInfo"]:
-        return {name: device_info for name, device_info in DeviceInfo.devices_by_name().items() if device_info.max_output_channels > 0}
+        return DeviceSnapshot.current().outputs_by_name
 
     @staticmethod
     def devices_by_name() -> T.Mapping[str, "DeviceInfo"]:
-        return {device_info.name: device_info for device_info in DeviceInfo.enumerate()}
+        return DeviceSnapshot.current().devices_by_name
 
     @staticmethod
     def enumerate() -> T.Iterator["DeviceInfo"]:
-        api_info = HostApiInfo.default()
-
-        if not api_info:
-            logger.warning("No default PyAudio API available")
-            return []
-
-        device_infos = api_info.enumerate_devices()
-
-        if platform.system() == "Linux":
-            yield from DeviceInfo._filter_on_linux(device_infos)
-        elif platform.system() == "Darwin":
-            yield from DeviceInfo._filter_on_macos(device_infos)
-        elif platform.system() == "Windows":
-            yield from DeviceInfo._filter_on_windows(device_infos)
-        else:
-            raise UnsupportedOperatingSystem()
+        yield from DeviceSnapshot.current().devices
 
     # Private
 
     @staticmethod
-    def _default_device(getter: T.Callable[[pyaudio.PyAudio], dict]) -> T.Optional["DeviceInfo"]:
-        with PyAudioManager.shared_instance() as manager:
-            try:
-                return DeviceInfo(getter(manager))
-            except IOError:
-                return None
+    def _default_device(manager: pyaudio.PyAudio, getter: T.Callable[[pyaudio.PyAudio], dict]) -> T.Optional["DeviceInfo"]:
+        try:
+            return DeviceInfo(getter(manager))
+        except IOError:
+            return None
 
     @staticmethod
     def _named_device_or_raise_exception(name: str, devices_by_name: T.Mapping[str, "DeviceInfo"]) -> "DeviceInfo":
@@ -219,6 +198,17 @@ class DeviceInfo(dict):
             available_devices = ", ".join(sorted(devices_by_name.keys()))
             raise ValueError(f"No device named \"{name}\". Available devices: {available_devices}.")
 
+    @staticmethod
+    def _filter(device_infos: T.Iterator["DeviceInfo"]) -> T.Iterator["DeviceInfo"]:
+        if platform.system() == "Linux":
+            yield from DeviceInfo._filter_on_linux(device_infos)
+        elif platform.system() == "Darwin":
+            yield from DeviceInfo._filter_on_macos(device_infos)
+        elif platform.system() == "Windows":
+            yield from DeviceInfo._filter_on_windows(device_infos)
+        else:
+            raise UnsupportedOperatingSystem()
+
     @staticmethod
     def _filter_on_linux(device_infos: T.Iterator["DeviceInfo"]) -> T.Iterator["DeviceInfo"]:
         for device_info in device_infos:
@@ -239,42 +229,290 @@ class DeviceInfo(dict):
 
     @staticmethod
     def _enumerate_by_api(api: int) -> T.Iterator["DeviceInfo"]:
+        api_info = HostApiInfo._find_with_api_type(api)
+        if api_info is not None:
+            yield from api_info.enumerate_devices()
+
+
+class DeviceSnapshot:
+    """
+    Immutable result of a single enumeration of the PortAudio host APIs and devices.
+
+    The snapshot is built once and indexed by device name, PortAudio device index
+    and host API index, so all `HostApiInfo` and `DeviceInfo` static helpers are
+    served from memory. The shared snapshot is rebuilt when it's invalidated
+    (which happens every time the PortAudio session is terminated), or when it's
+    older than `DeviceSnapshot.ttl` seconds.
+
+    The `DeviceInfo` and `HostApiInfo` entries are shared between all consumers
+    of the snapshot and must not be mutated.
+    """
+
+    # Public
+
+    """
+    Maximum age of the shared snapshot in seconds; if `None`, it's kept until invalidated.
+    """
+    ttl: T.Optional[float] = None
+
+    def __init__(
+        self,
+        host_apis: T.Sequence[HostApiInfo],
+        default_host_api: T.Optional[HostApiInfo],
+        devices_by_host_api: T.Mapping[int, T.Sequence[DeviceInfo]],
+        devices: T.Sequence[DeviceInfo],
+        default_input: T.Optional[DeviceInfo] = None,
+        default_output: T.Optional[DeviceInfo] = None,
+        time_fn=time.monotonic,
+    ):
+        self.__created_at = time_fn()
+        self.__time_fn = time_fn
+        self.__host_apis = tuple(host_apis)
+        self.__default_host_api = default_host_api
+        self.__devices_by_host_api = types.MappingProxyType({
+            api_index: tuple(device_infos)
+            for api_index, device_infos in devices_by_host_api.items()
+        })
+        self.__devices_by_index = types.MappingProxyType({
+            device_info.index: device_info
+            for device_infos in self.__devices_by_host_api.values()
+            for device_info in device_infos
+        })
+        self.__devices = tuple(devices)
+        self.__devices_by_name = types.MappingProxyType({
+            device_info.name: device_info for device_info in self.__devices
+        })
+        self.__inputs_by_name = types.MappingProxyType({
+            name: device_info for name, device_info in self.__devices_by_name.items() if device_info.is_input
+        })
+        self.__outputs_by_name = types.MappingProxyType({
+            name: device_info for name, device_info in self.__devices_by_name.items() if device_info.is_output
+        })
+        self.__default_input = default_input
+        self.__default_output = default_output
+
+    @property
+    def created_at(self) -> float:
+        return self.__created_at
+
+    @property
+    def age(self) -> float:
+        return self.__time_fn() - self.__created_at
+
+    @property
+    def host_apis(self) -> T.Tuple[HostApiInfo, ...]:
+        return self.__host_apis
+
+    @property
+    def default_host_api(self) -> T.Optional[HostApiInfo]:
+        return self.__default_host_api
+
+    @property
+    def devices_by_host_api(self) -> T.Mapping[int, T.Tuple[DeviceInfo, ...]]:
+        """
+        All devices of every host API, keyed by host API index.
+        """
+        return self.__devices_by_host_api
+
+    @property
+    def devices_by_index(self) -> T.Mapping[int, DeviceInfo]:
+        """
+        All devices of every host API, keyed by PortAudio device index.
+        """
+        return self.__devices_by_index
+
+    @property
+    def devices(self) -> T.Tuple[DeviceInfo, ...]:
+        """
+        Platform-filtered devices of the default host API.
+        """
+        return self.__devices
+
+    @property
+    def devices_by_name(self) -> T.Mapping[str, DeviceInfo]:
+        return self.__devices_by_name
+
+    @property
+    def inputs_by_name(self) -> T.Mapping[str, DeviceInfo]:
+        return self.__inputs_by_name
+
+    @property
+    def outputs_by_name(self) -> T.Mapping[str, DeviceInfo]:
+        return self.__outputs_by_name
+
+    @property
+    def default_input(self) -> T.Optional[DeviceInfo]:
+        return self.__default_input
+
+    @property
+    def default_output(self) -> T.Optional[DeviceInfo]:
+        return self.__default_output
+
+    @staticmethod
+    def current(ttl: T.Optional[float] = None) -> "DeviceSnapshot":
+        """
+        Return the shared snapshot, building a new one if there is no valid cached snapshot.
+
+        If `ttl` is not specified, `DeviceSnapshot.ttl` is used.
+        """
+        ttl = DeviceSnapshot.ttl if ttl is None else ttl
+
+        snapshot = DeviceSnapshot._cached_snapshot
+        if snapshot is not None and (ttl is None or snapshot.age < ttl):
+            return snapshot
+
+        with DeviceSnapshot._build_lock:
+            # Another thread might have built the snapshot while waiting for the lock
+            snapshot = DeviceSnapshot._cached_snapshot
+            if snapshot is not None and (ttl is None or snapshot.age < ttl):
+                return snapshot
+
+            generation = DeviceSnapshot._generation
+            snapshot = DeviceSnapshot.build()
+
+            # Don't cache snapshots that were invalidated while being built
+            if generation == DeviceSnapshot._generation:
+                DeviceSnapshot._cached_snapshot = snapshot
+            return snapshot
+
+    @staticmethod
+    def invalidate():
+        """
+        Drop the shared snapshot, so that the next access enumerates the devices again.
+        """
+        DeviceSnapshot._generation += 1
+        DeviceSnapshot._cached_snapshot = None
+
+    @staticmethod
+    def build() -> "DeviceSnapshot":
+        """
+        Enumerate all host APIs and devices with a single PortAudio session.
+        """
+        prioritised_api_types = HostApiInfo._prioritised_api_types()
+
         with PyAudioManager.shared_instance() as manager:
-            api_info = manager.get_host_api_info_by_type(api)
-            for device_index in range(api_info["deviceCount"]):
-                device_info = manager.get_device_info_by_host_api_device_index(api_info["index"], device_index)
-                yield DeviceInfo(device_info)
+            host_apis = []
+            for api_index in range(manager.get_host_api_count()):
+                try:
+                    host_apis.append(HostApiInfo(manager.get_host_api_info_by_index(api_index)))
+                except IOError:
+                    pass
+
+            devices_by_host_api = {
+                api_info.index: list(api_info._enumerate_devices_uncached(manager))
+                for api_info in host_apis
+            }
+
+            default_input = DeviceInfo._default_device(manager, lambda manager: manager.get_default_input_device_info())
+            default_output = DeviceInfo._default_device(manager, lambda manager: manager.get_default_output_device_info())
+
+        default_host_api = HostApiInfo._default_with_priority(host_apis, devices_by_host_api, *prioritised_api_types)
+
+        if default_host_api is None:
+            logger.warning("No default PyAudio API available")
+            devices = []
+        else:
+            # Filters are applied to copies, since they might modify the device infos
+            default_api_devices = (DeviceInfo(device_info) for device_info in devices_by_host_api[default_host_api.index])
+            devices = list(DeviceInfo._filter(default_api_devices))
+
+        return DeviceSnapshot(
+            host_apis=host_apis,
+            default_host_api=default_host_api,
+            devices_by_host_api=devices_by_host_api,
+            devices=devices,
+            default_input=default_input,
+            default_output=default_output,
+        )
+
+    # Private
+
+    _build_lock = threading.Lock()
+    _cached_snapshot = None
+    _generation = 0
+
+
+class PyAudioManagerStats(dict):
+    """
+    Snapshot of the PyAudioManager session counters.
+    """
+    init_count      = key_property("init_count",    type=int, readonly=True, default=0)
+    reuse_count     = key_property("reuse_count",   type=int, readonly=True, default=0)
+    refresh_count   = key_property("refresh_count", type=int, readonly=True, default=0)
+    ref_count       = key_property("ref_count",     type=int, readonly=True, default=0)
+
+    @property
+    def avoided_init_count(self) -> int:
+        """
+        Number of acquisitions that were served by an already initialized session,
+        each of which would have previously required a full PortAudio initialization.
+        """
+        return self.reuse_count
 
 
 class PyAudioManager:
     """
     Manages access to the shared PortAudio library instance.
+
+    The PortAudio session is initialized lazily on the first acquisition and is kept
+    alive afterwards, so repeated acquisitions don't pay for a full PortAudio (and host API)
+    initialization. Acquisitions are reference-counted; the session is only terminated
+    by `refresh` (or at exit) once no acquired instance is outstanding.
+
+    PortAudio only rescans the available devices when initialized, so `refresh` must be
+    called when the device list is expected to have changed.
+
+    The sessions are created by `pyaudio.PyAudio`, unless another backend (any callable that
+    returns an object with the interface of `pyaudio.PyAudio`, like `SimulatedPortAudio`) is
+    set with `set_backend`.
     """
 
     # Public
 
+    @staticmethod
+    def set_backend(backend: T.Optional[T.Callable[[], pyaudio.PyAudio]]):
+        """
+        Create the sessions with `backend` from now on, or with `pyaudio.PyAudio` if it's `None`.
+
+        The current session is terminated, so the next acquisition initializes one with the new
+        backend. Raises `ValueError` while an acquired instance is outstanding.
+        """
+        with PyAudioManager._manager_lock:
+            if PyAudioManager._ref_count > 0:
+                raise ValueError("Can't change the PyAudio backend while the session is in use")
+            PyAudioManager._terminate_session()
+            PyAudioManager._backend = backend
+
+    @staticmethod
+    def backend() -> T.Callable[[], pyaudio.PyAudio]:
+        return PyAudioManager._backend or pyaudio.PyAudio
+
     @staticmethod
     def acquire_shared_instance() -> T.Optional[pyaudio.PyAudio]:
-        if PyAudioManager._manager_lock.acquire():
-            # TODO: Send stdout to /dev/null while initializing the session
-            manager = pyaudio.PyAudio()
+        with PyAudioManager._manager_lock:
+            manager = PyAudioManager._session
+            if manager is None:
+                # TODO: Send stdout to /dev/null while initializing the session
+                manager = PyAudioManager.backend()()
+                PyAudioManager._session = manager
+                PyAudioManager._counters["init_count"] += 1
+                logger.debug("PyAudioManager session initialized")
+            else:
+                PyAudioManager._counters["reuse_count"] += 1
+            PyAudioManager._ref_count += 1
             logger.debug("PyAudioManager acquisition successful")
-            PyAudioManager._acquired_managers.add(manager)
             return manager
-        else:
-            logger.debug("PyAudioManager acquisition failed")
-            return None
 
     @staticmethod
     def release_shared_instance(manager: T.Optional[pyaudio.PyAudio]):
         if manager is None:
             return
-        try:
-            PyAudioManager._acquired_managers.remove(manager)
-        except KeyError:
-            raise ValueError("PyAudio manager instance was not acquired with PyAudioManager.acquire_shared_instance()")
-        manager.terminate()
-        PyAudioManager._manager_lock.release()
+        with PyAudioManager._manager_lock:
+            if manager is not PyAudioManager._session or PyAudioManager._ref_count == 0:
+                raise ValueError("PyAudio manager instance was not acquired with PyAudioManager.acquire_shared_instance()")
+            PyAudioManager._ref_count -= 1
+            if PyAudioManager._ref_count == 0 and PyAudioManager._needs_refresh:
+                PyAudioManager._terminate_session()
 
     @staticmethod
     @contextlib.contextmanager
@@ -284,8 +522,66 @@ class PyAudioManager:
             yield manager
         finally:
             PyAudioManager.release_shared_instance(manager)
-    
+
+    @staticmethod
+    def refresh():
+        """
+        Request a re-initialization of the PortAudio session, e.g. after the devices changed.
+
+        If no acquired instance is outstanding, the session is terminated immediately and
+        the next acquisition initializes a new one. Otherwise, the termination is deferred
+        until the last outstanding instance is released.
+        """
+        with PyAudioManager._manager_lock:
+            PyAudioManager._counters["refresh_count"] += 1
+            if PyAudioManager._ref_count == 0:
+                PyAudioManager._terminate_session()
+            else:
+                PyAudioManager._needs_refresh = True
+
+    @staticmethod
+    def is_refresh_pending() -> bool:
+        """
+        Whether a requested refresh is deferred until the outstanding instances are released.
+        """
+        return PyAudioManager._needs_refresh
+
+    @staticmethod
+    def stats() -> PyAudioManagerStats:
+        with PyAudioManager._manager_lock:
+            return PyAudioManagerStats(
+                ref_count=PyAudioManager._ref_count,
+                **PyAudioManager._counters,
+            )
+
     # Private
 
     _manager_lock = threading.RLock()
-    _acquired_managers = set()
+    _session = None
+    _backend = None
+    _ref_count = 0
+    _needs_refresh = False
+    _counters = {"init_count": 0, "reuse_count": 0, "refresh_count": 0}
+
+    @staticmethod
+    def _terminate_session():
+        with PyAudioManager._manager_lock:
+            assert PyAudioManager._ref_count == 0
+            manager = PyAudioManager._session
+            PyAudioManager._session = None
+            PyAudioManager._needs_refresh = False
+            if manager is not None:
+                manager.terminate()
+                logger.debug("PyAudioManager session terminated")
+            DeviceSnapshot.invalidate()
+
+    @staticmethod
+    def _terminate_at_exit():
+        with PyAudioManager._manager_lock:
+            if PyAudioManager._ref_count == 0:
+                PyAudioManager._terminate_session()
+            else:
+                logger.debug("PyAudioManager session still in use at exit")
+
+
+atexit.register(PyAudioManager._terminate_at_exit)
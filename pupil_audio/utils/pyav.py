@@ -0,0 +1,114 @@
+import typing as T
+
+import av
+import numpy as np
+
+from pupil_audio.utils import key_property
+
+
+class EncoderProfile(dict):
+    """
+    Codec and container settings used to encode an audio stream with PyAV.
+
+    `container_format` is the FFmpeg muxer name (e.g. "mp4", "ogg", "wav"); if it isn't set,
+    the muxer is guessed from the file extension. `options` are passed to the encoder, and
+    `container_options` to the muxer. `sample_format` selects one of the sample formats
+    supported by the encoder; frames in another format are converted by PyAV.
+    """
+    codec             = key_property("codec",             type=str)
+    bitrate           = key_property("bitrate",           type=int,  default=None)
+    options           = key_property("options",           type=dict, default=None)
+    container_format  = key_property("container_format",  type=str,  default=None)
+    container_options = key_property("container_options", type=dict, default=None)
+    thread_count      = key_property("thread_count",      type=int,  default=None)
+    sample_format     = key_property("sample_format",     type=str,  default=None)
+
+    @property
+    def is_compressed(self) -> bool:
+        return not self.codec.startswith("pcm_")
+
+    @staticmethod
+    def aac(bitrate=None, thread_count=None, **kwargs) -> "EncoderProfile":
+        return EncoderProfile(codec="aac", bitrate=bitrate, thread_count=thread_count, **kwargs)
+
+    @staticmethod
+    def opus(bitrate=None, thread_count=None, **kwargs) -> "EncoderProfile":
+        """
+        Opus only supports frame rates of 8, 12, 16, 24 and 48 kHz.
+        """
+        return EncoderProfile(codec="libopus", bitrate=bitrate, thread_count=thread_count, **kwargs)
+
+    @staticmethod
+    def flac(compression_level=None, thread_count=None, **kwargs) -> "EncoderProfile":
+        options = kwargs.pop("options", None) or {}
+        if compression_level is not None:
+            options["compression_level"] = str(compression_level)
+        return EncoderProfile(codec="flac", options=options or None, thread_count=thread_count, **kwargs)
+
+    @staticmethod
+    def pcm_s16le(**kwargs) -> "EncoderProfile":
+        return EncoderProfile(codec="pcm_s16le", **kwargs)
+
+    @staticmethod
+    def pcm_passthrough(dtype=None, **kwargs) -> "EncoderProfile":
+        """
+        Stores the captured samples as they are, without any compression.
+
+        The PCM codec matches `dtype`, so combined with `PassthroughTranscoder` (which produces
+        interleaved frames), the samples aren't converted at all.
+        """
+        dtype = np.dtype(dtype or "int16")
+        try:
+            codec = EncoderProfile._dtype_to_pcm_codec[dtype]
+        except KeyError:
+            raise ValueError(f"Couldn't map {dtype} dtype to a PCM codec")
+        return EncoderProfile(codec=codec, **kwargs)
+
+    _dtype_to_pcm_codec = {
+        np.dtype("<f8"): "pcm_f64le",
+        np.dtype("<f4"): "pcm_f32le",
+        np.dtype("<i2"): "pcm_s16le",
+        np.dtype("<i4"): "pcm_s32le",
+        np.dtype("u1"): "pcm_u8",
+    }
+
+    def open_container(self, file_path) -> av.container.OutputContainer:
+        return av.open(
+            str(file_path),
+            "w",
+            format=self.container_format,
+            container_options=self.container_options or {},
+        )
+
+    def add_stream(self, container, frame_rate, layout) -> av.audio.stream.AudioStream:
+        """
+        Add an audio stream encoded with this profile to `container`.
+
+        The encoder isn't opened, so the codec context can still be changed.
+        """
+        stream = container.add_stream(self.codec, rate=int(frame_rate))
+        codec_context = stream.codec_context
+        codec_context.layout = layout
+        if self.sample_format is not None:
+            codec_context.format = self.sample_format
+        if self.bitrate is not None:
+            codec_context.bit_rate = self.bitrate
+        if self.thread_count is not None:
+            codec_context.thread_count = self.thread_count
+        if self.options:
+            codec_context.options = {str(k): str(v) for k, v in self.options.items()}
+        return stream
+
+    @staticmethod
+    def available_codecs(profiles: T.Iterable["EncoderProfile"]) -> T.List["EncoderProfile"]:
+        """
+        Filter out the profiles whose encoder isn't available in the linked FFmpeg.
+        """
+        available = []
+        for profile in profiles:
+            try:
+                av.codec.Codec(profile.codec, "w")
+            except Exception:
+                continue
+            available.append(profile)
+        return available
@@ -0,0 +1,439 @@
+import enum
+import math
+import queue
+import threading
+import typing as T
+
+import numpy as np
+
+from pupil_audio.utils.pyaudio import TimeInfo
+
+
+class OverflowPolicy(enum.Enum):
+    """
+    What an `AudioRingBuffer` does with a new block when it is full.
+    """
+    DROP_OLDEST = "drop_oldest"  # Overwrite the oldest unread block
+    DROP_NEWEST = "drop_newest"  # Discard the new block
+    BLOCK = "block"              # Wait until the consumer frees a block
+
+
+class AudioRingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring buffer of interleaved audio blocks.
+
+    The samples are stored in a NumPy array with one row per block, next to side arrays
+    with the frame count and PortAudio timestamps of every block, so neither writing nor
+    reading a block allocates Python objects for the audio data. The producer and the
+    consumer each own their own index, so the hot path doesn't take any lock; events are
+    only used to wake up a consumer waiting for data (or a producer waiting for space).
+
+    Exactly one thread may write, and exactly one thread may read at a time.
+
+    Besides `write` and `read`, the buffer implements the subset of the `queue.Queue`
+    interface used by the sources and sinks, with `(data, TimeInfo)` items, so it can be
+    used in place of a queue.
+    """
+
+    # Public
+
+    def __init__(
+        self,
+        seconds: T.Optional[float],
+        frame_rate: int,
+        channels: int,
+        dtype,
+        frames_per_block: int = 1024,
+        overflow_policy: T.Union[OverflowPolicy, str] = OverflowPolicy.DROP_OLDEST,
+        block_count: T.Optional[int] = None,
+    ):
+        """
+        The capacity is either `seconds` of audio, or `block_count` blocks (with `seconds=None`);
+        either way, the buffer holds at least 2 blocks.
+        """
+        assert (seconds is None) != (block_count is None), "Either seconds or block_count must be set"
+        assert seconds is None or seconds > 0
+        assert block_count is None or block_count > 0
+        assert frames_per_block > 0
+
+        self.frame_rate = int(frame_rate)
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype)
+        self.frames_per_block = int(frames_per_block)
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+
+        if block_count is None:
+            block_count = math.ceil(seconds * self.frame_rate / self.frames_per_block)
+        block_count = max(2, int(block_count))
+        block_size = self.frames_per_block * self.channels
+
+        self._block_count = block_count
+        self._block_size = block_size
+
+        self._data = np.zeros((block_count, block_size), dtype=self.dtype)
+        self._frame_counts = np.zeros(block_count, dtype=np.int64)
+        self._adc_times = np.zeros(block_count, dtype=np.float64)
+        self._current_times = np.zeros(block_count, dtype=np.float64)
+        self._queued_times = np.full(block_count, math.nan, dtype=np.float64)
+        # Index of the block stored in each slot, or -1 while the slot is being written
+        self._sequence = np.full(block_count, -1, dtype=np.int64)
+        # Blocks read with DROP_OLDEST are copied here, since their slot might be overwritten
+        self._scratch = np.zeros(block_size, dtype=self.dtype)
+
+        # Owned by the producer
+        self._write_index = 0
+        self._dropped_block_count = 0
+        self._high_water_mark = 0
+        self._producer_is_waiting = False
+        self._space_available = threading.Event()
+
+        # Owned by the consumer
+        self._read_index = 0
+        self._release_index = 0
+        self._overwritten_block_count = 0
+        self._read_queued_time = math.nan
+        self._consumer_is_waiting = False
+        self._data_available = threading.Event()
+        self._is_interrupted = False
+
+    @property
+    def capacity_blocks(self) -> int:
+        return self._block_count
+
+    @property
+    def capacity_seconds(self) -> float:
+        return self._block_count * self.frames_per_block / self.frame_rate
+
+    @property
+    def dropped_block_count(self) -> int:
+        """
+        Number of new blocks discarded because the buffer was full (`DROP_NEWEST`, `BLOCK` with a timeout).
+        """
+        return self._dropped_block_count
+
+    @property
+    def overwritten_block_count(self) -> int:
+        """
+        Number of unread blocks that were overwritten by newer blocks (`DROP_OLDEST`).
+        """
+        return self._overwritten_block_count
+
+    @property
+    def high_water_mark(self) -> int:
+        """
+        Maximum number of unread blocks observed by the producer.
+        """
+        return self._high_water_mark
+
+    def qsize(self) -> int:
+        return max(0, min(self._write_index - self._read_index, self._block_count))
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def __len__(self) -> int:
+        return self.qsize()
+
+    def write(self, data, adc_time: float = math.nan, current_time: float = math.nan, block: bool = True, timeout: T.Optional[float] = None, queued_time: float = math.nan) -> bool:
+        """
+        Copy a block of interleaved samples (any object supporting the buffer protocol) into the buffer.
+
+        Returns `False` if the block was discarded because the buffer was full. Only the `BLOCK`
+        policy waits for space, and only if `block` is `True`. `queued_time` is returned by `get`
+        as the `queued_time` of the `TimeInfo`, to measure how long the block waited in the buffer.
+        """
+        samples = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=self.dtype)
+        sample_count = samples.size
+        assert sample_count <= self._block_size, f"Block of {sample_count} samples exceeds {self._block_size}"
+
+        block_count = self._block_count
+        write_index = self._write_index
+
+        if self.overflow_policy is not OverflowPolicy.DROP_OLDEST:
+            if write_index - self._release_index >= block_count:
+                if self.overflow_policy is OverflowPolicy.DROP_NEWEST or not block or not self._wait_for_space(write_index, timeout):
+                    self._dropped_block_count += 1
+                    return False
+
+        slot = write_index % block_count
+        self._sequence[slot] = -1
+        self._data[slot, :sample_count] = samples.reshape(-1)
+        self._frame_counts[slot] = sample_count // self.channels
+        self._adc_times[slot] = adc_time
+        self._current_times[slot] = current_time
+        self._queued_times[slot] = queued_time
+        self._sequence[slot] = write_index
+        self._write_index = write_index + 1
+
+        fill = min(write_index + 1 - self._read_index, block_count)
+        if fill > self._high_water_mark:
+            self._high_water_mark = fill
+
+        if self._consumer_is_waiting:
+            self._data_available.set()
+
+        return True
+
+    def read(self, block: bool = True, timeout: T.Optional[float] = None) -> T.Tuple[np.ndarray, float, float]:
+        """
+        Return the oldest unread block as `(samples, adc_time, current_time)`.
+
+        `samples` is a 1-D view of the interleaved samples, which stays valid until the next call to `read`.
+        Raises `queue.Empty` if there is no block within `timeout` (or immediately, if `block` is `False`).
+        """
+        block_count = self._block_count
+        is_dropping_oldest = self.overflow_policy is OverflowPolicy.DROP_OLDEST
+
+        # Release the block returned by the previous call
+        if self._release_index != self._read_index:
+            self._release_index = self._read_index
+            if self._producer_is_waiting:
+                self._space_available.set()
+
+        while True:
+            read_index = self._wait_for_data(block, timeout)
+
+            slot = read_index % block_count
+
+            if not is_dropping_oldest:
+                sample_count = self._frame_counts[slot] * self.channels
+                self._read_index = read_index + 1
+                self._read_queued_time = self._queued_times[slot]
+                return self._data[slot, :sample_count], self._adc_times[slot], self._current_times[slot]
+
+            # The producer might overwrite the slot while it's copied;
+            # the copy is only valid if the slot holds the same block before and after
+            sequence_before = self._sequence[slot]
+            sample_count = self._frame_counts[slot] * self.channels
+            adc_time, current_time = self._adc_times[slot], self._current_times[slot]
+            queued_time = self._queued_times[slot]
+            self._scratch[:sample_count] = self._data[slot, :sample_count]
+            sequence_after = self._sequence[slot]
+
+            self._read_index = read_index + 1
+            self._release_index = self._read_index
+
+            if sequence_before == sequence_after == read_index:
+                self._read_queued_time = queued_time
+                return self._scratch[:sample_count], adc_time, current_time
+
+            self._overwritten_block_count += 1
+
+    def interrupt(self):
+        """
+        Make the consumer's pending (or next) `read` raise `queue.Empty` once there is no unread block left.
+
+        This lets a consumer block in `read` without a timeout, and still be stopped.
+        """
+        self._is_interrupted = True
+        self._data_available.set()
+
+    def clear(self):
+        """
+        Discard the unread blocks and a pending interrupt, e.g. before a new recording starts.
+
+        Neither the producer nor the consumer may run while the buffer is cleared.
+        """
+        self._read_index = self._release_index = self._write_index
+        self._is_interrupted = False
+        self._data_available.clear()
+
+    def put(self, item: T.Tuple[T.Any, TimeInfo], block: bool = True, timeout: T.Optional[float] = None):
+        data, time_info = item
+        self.write(
+            data,
+            adc_time=time_info.get("input_buffer_adc_time", math.nan),
+            current_time=time_info.get("current_time", math.nan),
+            block=block,
+            timeout=timeout,
+            queued_time=time_info.get("queued_time", math.nan),
+        )
+
+    def put_nowait(self, item: T.Tuple[T.Any, TimeInfo]):
+        self.put(item, block=False)
+
+    def get(self, block: bool = True, timeout: T.Optional[float] = None) -> T.Tuple[np.ndarray, TimeInfo]:
+        data, adc_time, current_time = self.read(block=block, timeout=timeout)
+        time_info = TimeInfo(input_buffer_adc_time=float(adc_time), current_time=float(current_time))
+        queued_time = self._read_queued_time
+        if not math.isnan(queued_time):
+            time_info["queued_time"] = float(queued_time)
+        return data, time_info
+
+    def get_nowait(self) -> T.Tuple[np.ndarray, TimeInfo]:
+        return self.get(block=False)
+
+    # Private
+
+    def _wait_for_data(self, block: bool, timeout: T.Optional[float]) -> int:
+        while True:
+            write_index = self._write_index
+            read_index = self._read_index
+
+            if write_index - read_index > self._block_count:
+                # With DROP_OLDEST, the producer lapped the consumer; skip the overwritten blocks
+                skipped = write_index - self._block_count - read_index
+                self._overwritten_block_count += skipped
+                read_index = self._read_index = write_index - self._block_count
+
+            if read_index < write_index:
+                return read_index
+
+            if self._is_interrupted:
+                self._is_interrupted = False
+                raise queue.Empty
+
+            if not block:
+                raise queue.Empty
+
+            self._data_available.clear()
+            self._consumer_is_waiting = True
+            try:
+                # Re-check after announcing the wait, in case the producer wrote (or an interrupt came) in between
+                if self._write_index == write_index and not self._is_interrupted and not self._data_available.wait(timeout):
+                    raise queue.Empty
+            finally:
+                self._consumer_is_waiting = False
+
+    def _wait_for_space(self, write_index: int, timeout: T.Optional[float]) -> bool:
+        self._space_available.clear()
+        self._producer_is_waiting = True
+        try:
+            while write_index - self._release_index >= self._block_count:
+                if not self._space_available.wait(timeout):
+                    return write_index - self._release_index < self._block_count
+                self._space_available.clear()
+            return True
+        finally:
+            self._producer_is_waiting = False
+
+
+class SampleRingBuffer:
+    """
+    Preallocated single-producer/single-consumer FIFO of interleaved audio frames.
+
+    Unlike `AudioRingBuffer`, which stores whole blocks, frames are written and read in any
+    amount, e.g. written in chunks of one size and read by a PortAudio callback in buffers of
+    another. Neither `write` nor `read_into` allocates; the frames are copied (in at most two
+    slices, where the ring wraps around) from and to the caller's arrays.
+
+    Exactly one thread may write, and exactly one thread may read at a time.
+    """
+
+    # Public
+
+    def __init__(self, capacity_frames: int, channels: int, dtype):
+        assert capacity_frames > 0
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype)
+        self.capacity_frames = int(capacity_frames)
+
+        self._data = np.zeros((self.capacity_frames, self.channels), dtype=self.dtype)
+
+        # Total frames written (owned by the producer) and read (owned by the consumer)
+        self._write_index = 0
+        self._read_index = 0
+        self._producer_is_waiting = False
+        self._space_available = threading.Event()
+        self._consumer_is_waiting = False
+        self._data_available = threading.Event()
+
+    @property
+    def available_frames(self) -> int:
+        return self._write_index - self._read_index
+
+    @property
+    def free_frames(self) -> int:
+        return self.capacity_frames - self.available_frames
+
+    def write(self, data) -> int:
+        """
+        Copy as many frames of `data` as fit into the buffer, without waiting.
+
+        `data` is a `(frames, channels)` array, or any object supporting the buffer protocol with
+        interleaved samples. Returns the number of frames written.
+        """
+        frames = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=self.dtype)
+        frames = frames.reshape(-1, self.channels)
+
+        write_index = self._write_index
+        count = min(frames.shape[0], self.capacity_frames - (write_index - self._read_index))
+        if count <= 0:
+            return 0
+
+        start = write_index % self.capacity_frames
+        first = min(count, self.capacity_frames - start)
+        self._data[start:start + first] = frames[:first]
+        self._data[:count - first] = frames[first:count]
+
+        self._write_index = write_index + count
+        if self._consumer_is_waiting:
+            self._data_available.set()
+        return count
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        Move up to `len(out)` frames into the `(frames, channels)` array `out`.
+
+        Returns the number of frames read; the rest of `out` is left untouched.
+        """
+        read_index = self._read_index
+        count = min(out.shape[0], self._write_index - read_index)
+        if count <= 0:
+            return 0
+
+        start = read_index % self.capacity_frames
+        first = min(count, self.capacity_frames - start)
+        out[:first] = self._data[start:start + first]
+        out[first:count] = self._data[:count - first]
+
+        self._read_index = read_index + count
+        if self._producer_is_waiting:
+            self._space_available.set()
+        return count
+
+    def wait_for_space(self, frames: int, timeout: T.Optional[float] = None) -> bool:
+        """
+        Block until at least `frames` frames (at most the capacity) are free.
+
+        Returns `False` if there still isn't enough space after `timeout` seconds.
+        """
+        frames = min(frames, self.capacity_frames)
+        self._space_available.clear()
+        self._producer_is_waiting = True
+        try:
+            # Re-check after announcing the wait, in case the consumer read in between
+            while self.free_frames < frames:
+                if not self._space_available.wait(timeout):
+                    return self.free_frames >= frames
+                self._space_available.clear()
+            return True
+        finally:
+            self._producer_is_waiting = False
+
+    def wait_for_data(self, frames: int, timeout: T.Optional[float] = None) -> bool:
+        """
+        Block until at least `frames` frames (at most the capacity) are available.
+
+        Returns `False` if there still aren't enough frames after `timeout` seconds.
+        """
+        frames = min(frames, self.capacity_frames)
+        self._data_available.clear()
+        self._consumer_is_waiting = True
+        try:
+            # Re-check after announcing the wait, in case the producer wrote in between
+            while self.available_frames < frames:
+                if not self._data_available.wait(timeout):
+                    return self.available_frames >= frames
+                self._data_available.clear()
+            return True
+        finally:
+            self._consumer_is_waiting = False
+
+    def clear(self):
+        """
+        Drop the unread frames; only the consumer may call this.
+        """
+        self._read_index = self._write_index
+        if self._producer_is_waiting:
+            self._space_available.set()
@@ -0,0 +1,571 @@
+import math
+import time
+import random
+import logging
+import threading
+import contextlib
+import typing as T
+
+import numpy as np
+import pyaudio
+
+from pupil_audio.utils import key_property
+from pupil_audio.utils.pyaudio import PyAudioManager, HostApiInfo
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimulatedDevice(dict):
+    """
+    Sound card of a `SimulatedPortAudio` backend.
+
+    On Linux, only the devices with "hw:" in their name pass the device filter of `DeviceInfo`.
+    """
+    name                = key_property("name",                type=str,   readonly=True)
+    max_input_channels  = key_property("max_input_channels",  type=int,   readonly=True, default=2)
+    max_output_channels = key_property("max_output_channels", type=int,   readonly=True, default=0)
+    default_sample_rate = key_property("default_sample_rate", type=float, readonly=True, default=48000.)
+    latency             = key_property("latency",             type=float, readonly=True, default=0.01)
+
+
+class SimulatedPortAudioStats(dict):
+    """
+    Counters of all the streams opened with a `SimulatedPortAudio` backend.
+
+    `overflow_count` counts the buffers flagged with `paInputOverflow`, and `lost_frames` the
+    frames skipped before them, either injected or because the consumer fell behind.
+    """
+    open_stream_count   = key_property("open_stream_count",   type=int, readonly=True, default=0)
+    callback_count      = key_property("callback_count",      type=int, readonly=True, default=0)
+    overflow_count      = key_property("overflow_count",      type=int, readonly=True, default=0)
+    lost_frames         = key_property("lost_frames",         type=int, readonly=True, default=0)
+    disconnect_count    = key_property("disconnect_count",    type=int, readonly=True, default=0)
+
+
+class SimulatedPortAudio:
+    """
+    PortAudio backend without sound hardware, for `PyAudioManager.set_backend` (or `installed`).
+
+    Every session it creates (see `SimulatedPyAudio`) lists the devices that were connected when
+    it was created, just like PortAudio only scans the devices when initialized. Input streams
+    deliver a tone on schedule, with the ADC time of every buffer on the `time.monotonic` clock:
+
+    - every callback comes up to `jitter` seconds late
+    - with `overflow_probability`, a callback is held up for `overflow_buffers` buffers, which are
+      lost, and the next buffer is flagged with `paInputOverflow` (also see `inject_overflow`)
+    - if a consumer falls more than `max_backlog_buffers` buffers behind, the buffers beyond that
+      are lost as well, like when the host buffer of a sound card overflows
+
+    Devices can be connected and disconnected at any time with `add_device` and `remove_device`.
+    The streams of a disconnected device stop, without calling their callback again.
+    """
+
+    # Public
+
+    def __init__(
+        self,
+        devices: T.Iterable[SimulatedDevice] = (),
+        jitter: float = 0.,
+        overflow_probability: float = 0.,
+        overflow_buffers: int = 4,
+        max_backlog_buffers: int = 8,
+        seed: T.Optional[int] = None,
+    ):
+        assert jitter >= 0
+        assert 0 <= overflow_probability <= 1
+        self.jitter = float(jitter)
+        self.overflow_probability = float(overflow_probability)
+        self.overflow_buffers = int(overflow_buffers)
+        self.max_backlog_buffers = int(max_backlog_buffers)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._devices = []
+        self._streams = []
+        self._pending_overflows = {}
+        self._closed_counters = SimulatedPortAudioStats()
+        self._disconnect_count = 0
+        for device in devices:
+            self.add_device(device)
+
+    def __call__(self) -> "SimulatedPyAudio":
+        with self._lock:
+            return SimulatedPyAudio(self, tuple(self._devices))
+
+    @contextlib.contextmanager
+    def installed(self):
+        """
+        Use this backend for the `PyAudioManager` sessions within the context.
+        """
+        PyAudioManager.set_backend(self)
+        try:
+            yield self
+        finally:
+            PyAudioManager.set_backend(None)
+
+    @property
+    def devices(self) -> T.Tuple[SimulatedDevice, ...]:
+        with self._lock:
+            return tuple(self._devices)
+
+    def add_device(self, device: SimulatedDevice):
+        with self._lock:
+            if any(d.name == device.name for d in self._devices):
+                raise ValueError(f"Device \"{device.name}\" is already connected")
+            self._devices.append(device)
+
+    def remove_device(self, name: str):
+        with self._lock:
+            device = self._connected_device(name)
+            if device is None:
+                raise ValueError(f"No device named \"{name}\"")
+            self._devices.remove(device)
+            self._disconnect_count += 1
+            streams = [s for s in self._streams if s.device.name == name]
+        for stream in streams:
+            stream._disconnect()
+
+    def inject_overflow(self, name: T.Optional[str] = None, buffers: T.Optional[int] = None):
+        """
+        Hold up the next callback of the input streams of device `name` (or of all devices) for `buffers` buffers.
+        """
+        buffers = self.overflow_buffers if buffers is None else int(buffers)
+        with self._lock:
+            for stream in self._streams:
+                if name is None or stream.device.name == name:
+                    self._pending_overflows[stream] = self._pending_overflows.get(stream, 0) + buffers
+
+    def stats(self) -> SimulatedPortAudioStats:
+        with self._lock:
+            counters = dict(self._closed_counters)
+            for stream in self._streams:
+                for key, value in stream._counters().items():
+                    counters[key] = counters.get(key, 0) + value
+            return SimulatedPortAudioStats(
+                counters,
+                open_stream_count=len(self._streams),
+                disconnect_count=self._disconnect_count,
+            )
+
+    # Private
+
+    def _connected_device(self, name: str) -> T.Optional[SimulatedDevice]:
+        for device in self._devices:
+            if device.name == name:
+                return device
+        return None
+
+    def _register(self, stream: "SimulatedStream"):
+        with self._lock:
+            if self._connected_device(stream.device.name) is not stream.device:
+                raise IOError("Device unavailable", pyaudio.paDeviceUnavailable)
+            self._streams.append(stream)
+
+    def _unregister(self, stream: "SimulatedStream"):
+        with self._lock:
+            if stream not in self._streams:
+                return
+            self._streams.remove(stream)
+            self._pending_overflows.pop(stream, None)
+            for key, value in stream._counters().items():
+                self._closed_counters[key] = self._closed_counters.get(key, 0) + value
+
+    def _callback_delay(self) -> float:
+        return self._random.uniform(0., self.jitter) if self.jitter else 0.
+
+    def _overflow_buffers(self, stream: "SimulatedStream") -> int:
+        with self._lock:
+            buffers = self._pending_overflows.pop(stream, 0)
+        if self.overflow_probability and self._random.random() < self.overflow_probability:
+            buffers += self.overflow_buffers
+        return buffers
+
+
+class SimulatedPyAudio:
+    """
+    Session of a `SimulatedPortAudio` backend, with the interface of `pyaudio.PyAudio`.
+
+    It has a single host API, of the type `HostApiInfo` prefers on this platform.
+    """
+
+    def __init__(self, backend: SimulatedPortAudio, devices: T.Sequence[SimulatedDevice]):
+        self.backend = backend
+        self.devices = tuple(devices)
+        self._streams = []
+
+    def terminate(self):
+        for stream in list(self._streams):
+            stream.close()
+
+    def open(self, *args, **kwargs) -> "SimulatedStream":
+        stream = SimulatedStream(self, *args, **kwargs)
+        self._streams.append(stream)
+        return stream
+
+    def close(self, stream: "SimulatedStream"):
+        stream.close()
+
+    @staticmethod
+    def get_sample_size(format: int) -> int:
+        return pyaudio.get_sample_size(format)
+
+    @staticmethod
+    def get_format_from_width(width: int, unsigned: bool = True) -> int:
+        return pyaudio.get_format_from_width(width, unsigned)
+
+    def get_host_api_count(self) -> int:
+        return 1
+
+    def get_default_host_api_info(self) -> dict:
+        return self.get_host_api_info_by_index(0)
+
+    def get_host_api_info_by_index(self, host_api_index: int) -> dict:
+        if host_api_index != 0:
+            raise IOError("Invalid host API index", pyaudio.paInvalidHostApi)
+        inputs = [i for i, d in enumerate(self.devices) if d.max_input_channels > 0]
+        outputs = [i for i, d in enumerate(self.devices) if d.max_output_channels > 0]
+        return {
+            "index": 0,
+            "structVersion": 1,
+            "type": HostApiInfo._prioritised_api_types()[0],
+            "name": "Simulated",
+            "deviceCount": len(self.devices),
+            "defaultInputDevice": inputs[0] if inputs else pyaudio.paNoDevice,
+            "defaultOutputDevice": outputs[0] if outputs else pyaudio.paNoDevice,
+        }
+
+    def get_device_count(self) -> int:
+        return len(self.devices)
+
+    def get_device_info_by_index(self, device_index: int) -> dict:
+        if not 0 <= device_index < len(self.devices):
+            raise IOError("Invalid device index", pyaudio.paInvalidDevice)
+        device = self.devices[device_index]
+        return {
+            "index": device_index,
+            "structVersion": 2,
+            "name": device.name,
+            "hostApi": 0,
+            "maxInputChannels": device.max_input_channels,
+            "maxOutputChannels": device.max_output_channels,
+            "defaultLowInputLatency": device.latency,
+            "defaultLowOutputLatency": device.latency,
+            "defaultHighInputLatency": 4 * device.latency,
+            "defaultHighOutputLatency": 4 * device.latency,
+            "defaultSampleRate": device.default_sample_rate,
+        }
+
+    def get_device_info_by_host_api_device_index(self, host_api_index: int, host_api_device_index: int) -> dict:
+        if host_api_index != 0:
+            raise IOError("Invalid host API index", pyaudio.paInvalidHostApi)
+        return self.get_device_info_by_index(host_api_device_index)
+
+    def get_default_input_device_info(self) -> dict:
+        device_index = self.get_default_host_api_info()["defaultInputDevice"]
+        if device_index == pyaudio.paNoDevice:
+            raise IOError("No Default Input Device Available", pyaudio.paInvalidDevice)
+        return self.get_device_info_by_index(device_index)
+
+    def get_default_output_device_info(self) -> dict:
+        device_index = self.get_default_host_api_info()["defaultOutputDevice"]
+        if device_index == pyaudio.paNoDevice:
+            raise IOError("No Default Output Device Available", pyaudio.paInvalidDevice)
+        return self.get_device_info_by_index(device_index)
+
+
+class SimulatedStream:
+    """
+    Stream of a `SimulatedPyAudio` session, with the interface of `pyaudio.Stream`.
+
+    In callback mode, the callback is called by a thread of the stream. In blocking mode,
+    `read` and `write` block until the device would have captured (or played) the frames.
+    """
+
+    def __init__(
+        self,
+        session: SimulatedPyAudio,
+        rate: int,
+        channels: int,
+        format: int,
+        input: bool = False,
+        output: bool = False,
+        input_device_index: T.Optional[int] = None,
+        output_device_index: T.Optional[int] = None,
+        frames_per_buffer: int = pyaudio.paFramesPerBufferUnspecified,
+        start: bool = True,
+        input_host_api_specific_stream_info=None,
+        output_host_api_specific_stream_info=None,
+        stream_callback=None,
+    ):
+        if not (input or output):
+            raise ValueError("Must specify an input or output stream.")
+        if input and output:
+            raise ValueError("Simulated streams are either input or output streams")
+
+        self._session = session
+        self._backend = session.backend
+        self._is_input = bool(input)
+        self._callback = stream_callback
+        self._rate = int(rate)
+        self._channels = int(channels)
+        self._format = format
+        self._frames_per_buffer = int(frames_per_buffer) or 1024
+        self._period = self._frames_per_buffer / self._rate
+
+        host_api_info = session.get_default_host_api_info()
+        device_index = input_device_index if input else output_device_index
+        if device_index is None:
+            device_index = host_api_info["defaultInputDevice" if input else "defaultOutputDevice"]
+        device_info = session.get_device_info_by_index(device_index)
+        max_channels = device_info["maxInputChannels" if input else "maxOutputChannels"]
+        if not 0 < self._channels <= max_channels:
+            raise IOError("Invalid number of channels", pyaudio.paInvalidChannelCount)
+        try:
+            self._dtype = np.dtype(_FORMAT_DTYPES[format])
+        except KeyError:
+            raise IOError("Sample format not supported", pyaudio.paSampleFormatNotSupported)
+
+        self._bytes_per_frame = self._channels * self._dtype.itemsize
+
+        self.device = session.devices[device_index]
+        self._latency = self.device.latency
+        self._input_data = self._tone(self._frames_per_buffer) if input else None
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._should_stop = threading.Event()
+        self._is_active = False
+        self._is_disconnected = False
+        self._is_closed = False
+        self._start_time = None
+        self._position = 0
+
+        self._callback_count = 0
+        self._overflow_count = 0
+        self._lost_frames = 0
+
+        self._backend._register(self)
+        if start:
+            self.start_stream()
+
+    def start_stream(self):
+        with self._lock:
+            if self._is_closed:
+                raise IOError("Stream closed", pyaudio.paBadStreamPtr)
+            if self._is_active:
+                return
+            self._raise_if_disconnected()
+            self._should_stop.clear()
+            self._is_active = True
+            self._start_time = time.monotonic()
+            self._position = 0
+            if self._callback is not None:
+                self._thread = threading.Thread(
+                    name=f"{type(self).__name__}-{self.device.name}",
+                    target=self._callback_loop,
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def stop_stream(self):
+        with self._lock:
+            self._should_stop.set()
+            thread, self._thread = self._thread, None
+            self._is_active = False
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def close(self):
+        self.stop_stream()
+        with self._lock:
+            if self._is_closed:
+                return
+            self._is_closed = True
+        self._backend._unregister(self)
+        if self in self._session._streams:
+            self._session._streams.remove(self)
+
+    def is_active(self) -> bool:
+        return self._is_active and not self._is_disconnected
+
+    def is_stopped(self) -> bool:
+        return not self._is_active
+
+    def get_time(self) -> float:
+        return time.monotonic()
+
+    def get_input_latency(self) -> float:
+        return self._latency if self._is_input else 0.
+
+    def get_output_latency(self) -> float:
+        return 0. if self._is_input else self._latency
+
+    def get_cpu_load(self) -> float:
+        return 0.
+
+    def get_read_available(self) -> int:
+        if not self._is_input or not self._is_active:
+            return 0
+        captured = int((time.monotonic() - self._start_time) * self._rate)
+        return max(0, captured - self._position)
+
+    def get_write_available(self) -> int:
+        if self._is_input or not self._is_active:
+            return 0
+        played = int((time.monotonic() - self._start_time) * self._rate)
+        capacity = self.max_backlog_frames
+        return max(0, capacity - (self._position - played))
+
+    @property
+    def max_backlog_frames(self) -> int:
+        return self._backend.max_backlog_buffers * self._frames_per_buffer
+
+    def read(self, num_frames: int, exception_on_overflow: bool = True) -> bytes:
+        if not self._is_input:
+            raise IOError("Not input stream", pyaudio.paCanNotReadFromAnOutputOnlyStream)
+        self._raise_if_inactive()
+
+        lost_frames = self._backend._overflow_buffers(self) * self._frames_per_buffer
+        # Blocks until the last frame was captured
+        self._wait_until(self._start_time + (self._position + lost_frames + num_frames) / self._rate)
+        self._raise_if_disconnected()
+
+        captured = int((time.monotonic() - self._start_time) * self._rate)
+        backlog = captured - (self._position + lost_frames + num_frames)
+        if backlog > self.max_backlog_frames:
+            lost_frames += backlog - self.max_backlog_frames
+        if lost_frames > 0:
+            self._position += lost_frames
+            self._overflow_count += 1
+            self._lost_frames += lost_frames
+            if exception_on_overflow:
+                raise IOError("Input overflowed", pyaudio.paInputOverflowed)
+
+        self._position += num_frames
+        return self._tone(num_frames)
+
+    def write(self, frames, num_frames: T.Optional[int] = None, exception_on_underflow: bool = False):
+        if self._is_input:
+            raise IOError("Not output stream", pyaudio.paCanNotWriteToAnInputOnlyStream)
+        self._raise_if_inactive()
+        if num_frames is None:
+            num_frames = len(frames) // (self._channels * self._dtype.itemsize)
+        # Blocks while the host buffer is full
+        self._wait_until(self._start_time + (self._position + num_frames - self.max_backlog_frames) / self._rate)
+        self._raise_if_disconnected()
+        self._position += num_frames
+
+    # Private
+
+    def _counters(self) -> T.Dict[str, int]:
+        return {
+            "callback_count": self._callback_count,
+            "overflow_count": self._overflow_count,
+            "lost_frames": self._lost_frames,
+        }
+
+    def _disconnect(self):
+        self._is_disconnected = True
+        self._should_stop.set()
+
+    def _raise_if_disconnected(self):
+        if self._is_disconnected:
+            raise IOError("Device unavailable", pyaudio.paDeviceUnavailable)
+
+    def _raise_if_inactive(self):
+        self._raise_if_disconnected()
+        if not self._is_active:
+            raise IOError("Stream is stopped", pyaudio.paStreamIsStopped)
+
+    def _wait_until(self, deadline: float):
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            self._should_stop.wait(remaining)
+
+    def _tone(self, frames: int) -> bytes:
+        # A 440 Hz tone at -12 dBFS on every channel
+        t = np.arange(frames) / self._rate
+        signal = 0.25 * np.sin(2 * np.pi * 440. * t)
+        if self._dtype.kind == "f":
+            samples = signal
+        else:
+            info = np.iinfo(self._dtype)
+            samples = signal * (int(info.max) - int(info.min)) / 2 + (int(info.max) + int(info.min)) / 2
+        return np.repeat(samples[:, np.newaxis], self._channels, axis=1).astype(self._dtype).tobytes()
+
+    def _callback_loop(self):
+        backend = self._backend
+        period = self._period
+        frames = self._frames_per_buffer
+        max_backlog = backend.max_backlog_buffers
+        start_time = self._start_time
+        index = 0
+        status = 0
+
+        while not self._should_stop.is_set():
+            lost_buffers = backend._overflow_buffers(self) if self._is_input else 0
+            if lost_buffers:
+                # The callback is held up, and the buffers it couldn't deliver are lost
+                index += lost_buffers
+                self._lost_frames += lost_buffers * frames
+                self._overflow_count += 1
+                status |= pyaudio.paInputOverflow
+
+            # A buffer can only be delivered once its last frame was captured
+            self._wait_until(start_time + (index + 1) * period + backend._callback_delay())
+            if self._should_stop.is_set():
+                break
+
+            now = time.monotonic()
+            backlog = int((now - start_time) / period) - (index + 1)
+            if self._is_input and backlog > max_backlog:
+                # The consumer fell behind, and the host buffer overflowed
+                index += backlog - max_backlog
+                self._lost_frames += (backlog - max_backlog) * frames
+                self._overflow_count += 1
+                status |= pyaudio.paInputOverflow
+
+            if self._is_input:
+                time_info = {"input_buffer_adc_time": start_time + index * period, "current_time": now, "output_buffer_dac_time": 0.}
+            else:
+                time_info = {"input_buffer_adc_time": 0., "current_time": now, "output_buffer_dac_time": start_time + index * period + self._latency}
+
+            try:
+                out_data, flag = self._callback(self._input_data, frames, time_info, status)
+                if not self._is_input and _output_byte_count(out_data) < frames * self._bytes_per_frame:
+                    # PyAudio plays silence for the missing frames, and completes the stream
+                    flag = pyaudio.paComplete
+            except Exception as err:
+                # PyAudio aborts the stream when its callback raises
+                logger.error(err)
+                break
+
+            self._callback_count += 1
+            index += 1
+            status = 0
+            if flag != pyaudio.paContinue:
+                break
+
+        self._is_active = False
+
+
+def _output_byte_count(data) -> int:
+    # PyAudio parses the output data of a callback as "z#", which only accepts C-contiguous
+    # buffers whose type doesn't need to release them (e.g. `bytes` or numpy arrays)
+    if data is None:
+        return 0
+    if isinstance(data, (memoryview, bytearray)):
+        raise TypeError(f"argument 1 must be read-only bytes-like object, not {type(data).__name__}")
+    view = memoryview(data)
+    if not view.c_contiguous:
+        raise TypeError("callback output data is not C-contiguous")
+    return view.nbytes
+
+
+_FORMAT_DTYPES = {
+    pyaudio.paFloat32: "<f4",
+    pyaudio.paInt32: "<i4",
+    pyaudio.paInt16: "<i2",
+    pyaudio.paInt8: "i1",
+    pyaudio.paUInt8: "u1",
+}
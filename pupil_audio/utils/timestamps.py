@@ -0,0 +1,159 @@
+import os
+import struct
+import typing as T
+
+import numpy as np
+
+
+class TimestampWriter:
+    """
+    Appends timestamps to a `.npy` file while recording, with flat memory use.
+
+    The file is preallocated in extents of `chunk_size` entries, which are filled with NaN and
+    memory-mapped one at a time, so only the current extent is ever mapped. The array length in
+    the header is updated every time an extent is completed, and the file is truncated to its
+    final length on `close`.
+
+    The header has a fixed size, so it can be rewritten in place. If the process crashes before
+    `close`, `read_timestamps` still returns every timestamp that reached the file, and
+    `recover_timestamps` turns it back into a regular `.npy` file.
+    """
+
+    HEADER_SIZE = 128
+
+    def __init__(self, path: str, chunk_size: int = 4096, dtype=np.float64):
+        assert chunk_size > 0
+        self.path = str(path)
+        self.chunk_size = int(chunk_size)
+        self.dtype = np.dtype(dtype)
+        self._count = 0
+        self._extent_count = 0
+        self._window = None
+        self._window_index = 0
+        self._file = open(self.path, "w+b")
+        self._write_header(self._count)
+        self._map_next_extent()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def is_closed(self) -> bool:
+        return self._file is None
+
+    def append(self, timestamp: float):
+        if self._window_index == self.chunk_size:
+            self._map_next_extent()
+        self._window[self._window_index] = timestamp
+        self._window_index += 1
+        self._count += 1
+
+    def extend(self, timestamps: T.Iterable[float]):
+        for timestamp in timestamps:
+            self.append(timestamp)
+
+    def flush(self):
+        """
+        Write the mapped extent and the current length to disk.
+        """
+        if self._window is not None:
+            self._window.flush()
+        self._write_header(self._count)
+
+    def close(self):
+        if self.is_closed:
+            return
+        if self._window is not None:
+            self._window.flush()
+            self._window = None
+        self._file.truncate(self.HEADER_SIZE + self._count * self.dtype.itemsize)
+        self._write_header(self._count)
+        self._file.close()
+        self._file = None
+
+    # Private
+
+    def _map_next_extent(self):
+        if self._window is not None:
+            self._window.flush()
+            self._window = None
+            # The completed extent is on disk, so the header can account for it
+            self._write_header(self._count)
+
+        extent_bytes = self.chunk_size * self.dtype.itemsize
+        offset = self.HEADER_SIZE + self._extent_count * extent_bytes
+        self._file.truncate(offset + extent_bytes)
+
+        self._window = np.memmap(self._file, dtype=self.dtype, mode="r+", offset=offset, shape=(self.chunk_size,))
+        self._window[:] = np.nan
+        self._window_index = 0
+        self._extent_count += 1
+
+    def _write_header(self, count: int):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, count, self.HEADER_SIZE))
+        self._file.flush()
+
+
+def read_timestamps(path: str) -> np.ndarray:
+    """
+    Load the timestamps written by a `TimestampWriter`, or any 1-D `.npy` file.
+
+    Unlike `np.load`, this tolerates files that weren't closed properly: the length is taken
+    from the data actually present in the file, instead of from the header alone.
+    """
+    with open(path, "rb") as file:
+        dtype, header_count, header_size = _read_npy_header(file)
+        count = _recovered_count(file, dtype, header_count, header_size)
+        file.seek(header_size)
+        return np.fromfile(file, dtype=dtype, count=count)
+
+
+def recover_timestamps(path: str) -> int:
+    """
+    Turn a timestamp file that wasn't closed properly back into a regular `.npy` file.
+
+    Returns the number of recovered timestamps.
+    """
+    with open(path, "r+b") as file:
+        dtype, header_count, header_size = _read_npy_header(file)
+        count = _recovered_count(file, dtype, header_count, header_size)
+        file.truncate(header_size + count * dtype.itemsize)
+        file.seek(0)
+        file.write(_npy_header(dtype, count, header_size))
+    return count
+
+
+def _npy_header(dtype: np.dtype, count: int, size: int) -> bytes:
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (dtype.str, count)
+    # Magic string, version and header length take 10 bytes; the header ends with a newline
+    header = header.ljust(size - 10 - 1) + "\n"
+    assert len(header) == size - 10, "Timestamp count doesn't fit in the header"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _read_npy_header(file) -> T.Tuple[np.dtype, int, int]:
+    file.seek(0)
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    if len(shape) != 1:
+        raise ValueError(f"Expected a 1-D timestamp array, got shape {shape}")
+    return dtype, shape[0], file.tell()
+
+
+def _recovered_count(file, dtype: np.dtype, header_count: int, header_size: int) -> int:
+    file_size = os.fstat(file.fileno()).st_size
+    available = max(0, (file_size - header_size) // dtype.itemsize)
+
+    if available <= header_count:
+        # The file was truncated; keep whatever is there
+        return available
+
+    # Entries beyond the header length were written after the last header update,
+    # up to the NaN fill of the preallocated extent
+    tail = np.memmap(file, dtype=dtype, mode="r", offset=header_size + header_count * dtype.itemsize, shape=(available - header_count,))
+    written = np.flatnonzero(~np.isnan(tail))
+    return header_count + (int(written[-1]) + 1 if written.size else 0)
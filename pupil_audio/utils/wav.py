@@ -0,0 +1,296 @@
+import os
+import mmap
+import struct
+import typing as T
+
+import numpy as np
+
+from pupil_audio.utils import key_property
+
+
+class WavInfo(dict):
+    """
+    Format and location of the samples of a PCM WAV file.
+    """
+    frame_rate  = key_property("frame_rate",  type=int,      readonly=True)
+    channels    = key_property("channels",    type=int,      readonly=True)
+    dtype       = key_property("dtype",       type=np.dtype, readonly=True)
+    data_offset = key_property("data_offset", type=int,      readonly=True)
+    data_size   = key_property("data_size",   type=int,      readonly=True)
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.dtype.itemsize
+
+    @property
+    def frame_count(self) -> int:
+        return self.data_size // self.block_align
+
+
+class WavMmapWriter:
+    """
+    Writes interleaved PCM samples to a WAV file through a memory map.
+
+    The file is preallocated in extents of `extent_size` bytes, and only the current extent is
+    mapped; the samples are copied straight from the buffer passed to `write` into the mapping.
+    The sizes in the RIFF header are patched every time an extent is completed, and the file is
+    truncated to its final length on `close`.
+
+    If the process crashes before `close`, `recover_wav` turns the file back into a regular WAV file.
+    """
+
+    HEADER_SIZE = 44
+
+    # The RIFF chunk size is a 32 bit field, which also covers the rest of the header
+    MAX_DATA_SIZE = 0xFFFFFFFF - (HEADER_SIZE - 8)
+
+    def __init__(self, path: str, frame_rate: int, channels: int, dtype=np.int16, extent_size: int = 16 * 1024 * 1024):
+        self.path = str(path)
+        self.frame_rate = int(frame_rate)
+        self.channels = int(channels)
+        self.dtype = np.dtype(dtype)
+        self.block_align = self.channels * self.dtype.itemsize
+        # Extents hold whole frames, so a frame never straddles two mappings
+        self.extent_size = max(1, int(extent_size) // self.block_align) * self.block_align
+        self._format_tag = _wav_format_tag(self.dtype)
+        self._data_size = 0
+        self._mapped_end = self.HEADER_SIZE
+        self._window = None
+        self._window_view = None
+        self._window_index = 0
+        self._file = open(self.path, "w+b")
+        self._write_header(self._data_size)
+
+    @property
+    def byte_count(self) -> int:
+        return self._data_size
+
+    @property
+    def frame_count(self) -> int:
+        return self._data_size // self.block_align
+
+    @property
+    def is_closed(self) -> bool:
+        return self._file is None
+
+    def write(self, samples):
+        """
+        Append interleaved samples, given as any buffer (`bytes`, `np.ndarray`, ...) in the format of the file.
+        """
+        if isinstance(samples, np.ndarray):
+            data = np.ascontiguousarray(samples).reshape(-1).view(np.uint8)
+        else:
+            data = np.frombuffer(samples, dtype=np.uint8)
+
+        if data.size % self.block_align != 0:
+            raise ValueError(f"Expected whole frames of {self.block_align} bytes, got {data.size} bytes")
+        if self._data_size + data.size > self.MAX_DATA_SIZE:
+            raise ValueError(f"{self.path} would exceed the maximum WAV file size")
+
+        written = 0
+        while written < data.size:
+            if self._window_view is None or self._window_index == self._window_view.size:
+                self._map_next_extent()
+            count = min(data.size - written, self._window_view.size - self._window_index)
+            self._window_view[self._window_index:self._window_index + count] = data[written:written + count]
+            self._window_index += count
+            self._data_size += count
+            written += count
+
+    def write_silence(self, frame_count: int):
+        silence = np.full(frame_count * self.channels, _silence_value(self.dtype), dtype=self.dtype)
+        self.write(silence)
+
+    def flush(self):
+        """
+        Write the mapped extent and the current sizes to disk.
+        """
+        if self._window is not None:
+            self._window.flush()
+        self._write_header(self._data_size)
+
+    def close(self):
+        if self.is_closed:
+            return
+        self._unmap_window()
+        data_size = self._data_size
+        # Chunks are word-aligned, so an odd sized data chunk is followed by a pad byte
+        self._file.truncate(self.HEADER_SIZE + data_size + data_size % 2)
+        self._write_header(data_size)
+        self._file.close()
+        self._file = None
+
+    # Private
+
+    def _map_next_extent(self):
+        if self._window is not None:
+            self._unmap_window()
+            # The completed extent is on disk, so the header can account for it
+            self._write_header(self._data_size)
+
+        start = self._mapped_end
+        end = start + self.extent_size
+        self._file.truncate(end)
+
+        # The offset of a mapping must be a multiple of the allocation granularity
+        map_offset = start - start % mmap.ALLOCATIONGRANULARITY
+        self._window = mmap.mmap(self._file.fileno(), end - map_offset, offset=map_offset)
+        self._window_view = np.frombuffer(self._window, dtype=np.uint8)[start - map_offset:]
+        self._window_index = 0
+        self._mapped_end = end
+
+    def _unmap_window(self):
+        if self._window is None:
+            return
+        # The mapping can only be closed once no view exports its buffer
+        self._window_view = None
+        self._window.flush()
+        self._window.close()
+        self._window = None
+
+    def _write_header(self, data_size: int):
+        self._file.seek(0)
+        self._file.write(_wav_header(self._format_tag, self.frame_rate, self.channels, self.dtype, data_size))
+        self._file.flush()
+
+
+def read_wav_info(file) -> WavInfo:
+    """
+    Parse the RIFF chunks of a PCM WAV file, given as a path or a binary file object.
+
+    The data size is clamped to the data actually present in the file, so files that weren't
+    closed properly can still be read.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return read_wav_info(f)
+
+    file.seek(0)
+    riff, _, wave = struct.unpack("<4sI4s", _read_exactly(file, 12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        raise ValueError("Not a RIFF WAVE file")
+
+    file_size = os.fstat(file.fileno()).st_size
+    fmt = None
+
+    while True:
+        chunk_id, chunk_size = struct.unpack("<4sI", _read_exactly(file, 8))
+        chunk_offset = file.tell()
+
+        if chunk_id == b"fmt ":
+            fmt = _parse_fmt_chunk(_read_exactly(file, chunk_size))
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before the fmt chunk")
+            format_tag, channels, frame_rate, bits_per_sample = fmt
+            return WavInfo(
+                frame_rate=frame_rate,
+                channels=channels,
+                dtype=_wav_dtype(format_tag, bits_per_sample),
+                data_offset=chunk_offset,
+                data_size=min(chunk_size, file_size - chunk_offset),
+            )
+
+        file.seek(chunk_offset + chunk_size + chunk_size % 2)
+
+
+def recover_wav(path: str) -> int:
+    """
+    Patch the RIFF sizes of a WAV file written by a `WavMmapWriter` that wasn't closed properly.
+
+    Besides the samples accounted for by the header, the samples written after the last header
+    update are kept, up to the zero-filled end of the preallocated extent; trailing digital
+    silence is therefore dropped as well.
+
+    Returns the number of recovered frames.
+    """
+    with open(path, "r+b") as file:
+        info = read_wav_info(file)
+        file.seek(info.data_offset - 4)
+        header_data_size = struct.unpack("<I", file.read(4))[0]
+
+        file_size = os.fstat(file.fileno()).st_size
+        available = file_size - info.data_offset
+        if available > header_data_size:
+            # Samples beyond the header size were written after the last header update
+            data_size = header_data_size + _written_size(file, info.data_offset + header_data_size, available - header_data_size)
+        else:
+            # The file was truncated; keep whatever is there
+            data_size = available
+
+        data_size -= data_size % info.block_align
+        file.truncate(info.data_offset + data_size + data_size % 2)
+        file.seek(4)
+        file.write(struct.pack("<I", info.data_offset - 8 + data_size + data_size % 2))
+        file.seek(info.data_offset - 4)
+        file.write(struct.pack("<I", data_size))
+
+    return data_size // info.block_align
+
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _wav_format_tag(dtype: np.dtype) -> int:
+    if dtype.kind == "f" and dtype.str in ("<f4", "<f8"):
+        return _WAVE_FORMAT_IEEE_FLOAT
+    if dtype.str in ("|u1", "<i2", "<i4"):
+        return _WAVE_FORMAT_PCM
+    raise ValueError(f"Couldn't map {dtype} dtype to a WAV sample format")
+
+
+def _wav_dtype(format_tag: int, bits_per_sample: int) -> np.dtype:
+    if format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits_per_sample in (32, 64):
+        return np.dtype(f"<f{bits_per_sample // 8}")
+    if format_tag == _WAVE_FORMAT_PCM:
+        if bits_per_sample == 8:
+            return np.dtype("u1")
+        if bits_per_sample in (16, 32):
+            return np.dtype(f"<i{bits_per_sample // 8}")
+    raise ValueError(f"Unsupported WAV sample format {format_tag} with {bits_per_sample} bits per sample")
+
+
+def _silence_value(dtype: np.dtype):
+    # Unsigned 8 bit samples are centered on 128
+    return 128 if dtype.kind == "u" else 0
+
+
+def _wav_header(format_tag: int, frame_rate: int, channels: int, dtype: np.dtype, data_size: int) -> bytes:
+    block_align = channels * dtype.itemsize
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", WavMmapWriter.HEADER_SIZE - 8 + data_size + data_size % 2, b"WAVE",
+        b"fmt ", 16, format_tag, channels, frame_rate, frame_rate * block_align, block_align, 8 * dtype.itemsize,
+        b"data", data_size,
+    )
+
+
+def _parse_fmt_chunk(chunk: bytes) -> T.Tuple[int, int, int, int]:
+    format_tag, channels, frame_rate, _, _, bits_per_sample = struct.unpack("<HHIIHH", chunk[:16])
+    if format_tag == _WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+        # The actual format is in the first two bytes of the sub-format GUID
+        format_tag, = struct.unpack("<H", chunk[24:26])
+    return format_tag, channels, frame_rate, bits_per_sample
+
+
+def _read_exactly(file, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of WAV file")
+    return data
+
+
+def _written_size(file, offset: int, size: int, block_size: int = 1024 * 1024) -> int:
+    # Size of the region up to its last non-zero byte, scanned backwards block by block
+    end = size
+    while end > 0:
+        start = max(0, end - block_size)
+        file.seek(offset + start)
+        block = np.frombuffer(file.read(end - start), dtype=np.uint8)
+        nonzero = np.flatnonzero(block)
+        if nonzero.size:
+            return start + int(nonzero[-1]) + 1
+        end = start
+    return 0